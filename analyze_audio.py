@@ -0,0 +1,28 @@
+import glob
+import os
+import time
+import argparse
+from building.audio_analysis import AudioCache
+
+
+def analyze_files(paths, cache, sample_rate, frame_size, band_count):
+    for path in paths:
+        start = time.perf_counter()
+        analysis = cache.load(path, sample_rate=sample_rate, frame_size=frame_size, band_count=band_count)
+        print(f"{path}: {analysis.duration:.1f} s, {len(analysis)} frames, {analysis.band_count} bands "
+              f"({time.perf_counter() - start:.2f} s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='音声ファイルをデコード・解析してキャッシュを事前に作成します。')
+    parser.add_argument('paths', nargs='*', help='音声ファイル（省略時は sound/*.mp3）')
+    parser.add_argument('--cache-dir', default='.audio_cache', help='キャッシュのディレクトリ')
+    parser.add_argument('--sample-rate', type=int, default=44100, help='サンプリングレート')
+    parser.add_argument('--frame-size', type=int, default=1024, help='解析の 1 フレームのサンプル数')
+    parser.add_argument('--bands', type=int, default=16, help='周波数の帯域の数')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join('sound', '*.mp3')))
+    audio_cache = AudioCache(args.cache_dir)
+    analyze_files(paths, audio_cache, args.sample_rate, args.frame_size, args.bands)
+    print(f"cache hits: {audio_cache.hits}, misses: {audio_cache.misses}")
@@ -0,0 +1,79 @@
+"""
+長方形のビルを「ビルごとのノード」と「インスタンス描画」で描いたときの
+シーン作成時間とフレーム時間を比較します（オフスクリーンで描画します）。
+
+リポジトリのルートで実行します:
+    python -m benchmarks.bench_instanced_boxes [ビル数 ...]
+"""
+import sys
+import time
+import numpy as np
+from panda3d.core import loadPrcFileData
+from building.building_table import BuildingTable
+from building.geometry_generator import GeometryGenerator
+
+
+def make_rect_table(count, seed=0):
+    """タイル全体にランダムに配置した長方形のビルのテーブル"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.uniform(0, 4096, size=(count, 2))
+    width = rng.uniform(5, 30, size=count)
+    height = rng.uniform(1, 100, size=count)
+    colors = np.column_stack([rng.uniform(0, 1, size=(count, 3)), np.ones(count)])
+    return BuildingTable(np.arange(count), height, np.zeros((0, 2)), [0], np.zeros(count + 1),
+                         centroids, width, width, width, rng.uniform(-180, 180, size=count), colors)
+
+
+def measure_frames(base, frames):
+    # 最初の数フレームはシェーダーのコンパイルなどを含むので除外
+    for _ in range(5):
+        base.graphicsEngine.renderFrame()
+    start = time.perf_counter()
+    for _ in range(frames):
+        base.graphicsEngine.renderFrame()
+    base.graphicsEngine.syncFrame()
+    return (time.perf_counter() - start) / frames
+
+
+def bench_per_node(base, table, frames):
+    root = base.render.attachNewNode('per_node')
+    start = time.perf_counter()
+    for building in table:
+        building.node = root.attachNewNode(str(building.id))
+        rect_params = (building.rect_width, building.rect_height, building.rect_angle)
+        GeometryGenerator.create_rect_building(building.node, rect_params, building.centroid,
+                                               building.height, color=building.color)
+    build_time = time.perf_counter() - start
+    frame_time = measure_frames(base, frames)
+    root.removeNode()
+    return build_time, frame_time
+
+
+def bench_instanced(base, table, frames):
+    root = base.render.attachNewNode('instanced')
+    start = time.perf_counter()
+    GeometryGenerator.create_instanced_rect_buildings(root, table)
+    build_time = time.perf_counter() - start
+    frame_time = measure_frames(base, frames)
+    root.removeNode()
+    return build_time, frame_time
+
+
+if __name__ == '__main__':
+    loadPrcFileData('', 'window-type offscreen')
+    loadPrcFileData('', 'win-size 1600 900')
+    loadPrcFileData('', 'sync-video false')
+    from direct.showbase.ShowBase import ShowBase
+
+    base = ShowBase()
+    base.camera.setPos(2048, -3000, 3000)
+    base.camera.lookAt(2048, 2048, 0)
+
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    frames = 50
+    print(f"{'buildings':>10}  {'mode':>10}  {'build [s]':>10}  {'frame [ms]':>10}")
+    for count in counts:
+        table = make_rect_table(count)
+        for mode, bench in (('per-node', bench_per_node), ('instanced', bench_instanced)):
+            build_time, frame_time = bench(base, table, frames)
+            print(f"{count:>10}  {mode:>10}  {build_time:>10.3f}  {frame_time * 1000:>10.2f}")
@@ -0,0 +1,40 @@
+"""
+MultiTileLoader のワーカー数ごとの読み込み時間を計測します。
+
+リポジトリのルートで実行します:
+    python -m benchmarks.bench_multi_tile_loader
+"""
+import os
+import time
+from building.multi_tile_loader import MultiTileLoader
+
+
+def tiles_in_range(z, x_range, y_range):
+    """指定範囲のうち pbf ファイルが存在するタイルのリスト"""
+    return [(z, x, y) for x in x_range for y in y_range if os.path.isfile(f'{z}/{x}/{y}.pbf')]
+
+
+def run(tiles, worker_counts, repeat=3):
+    results = []
+    for workers in worker_counts:
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            table = MultiTileLoader(tiles, max_workers=workers).load()
+            elapsed.append(time.perf_counter() - start)
+        results.append((workers, min(elapsed), len(table)))
+    return results
+
+
+if __name__ == '__main__':
+    # 渋谷駅周辺のズームレベル 16 のタイル (8 x 8)
+    tiles = tiles_in_range(16, range(58195, 58203), range(25807, 25815))
+    cpu_count = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+
+    print(f"tiles: {len(tiles)}, cpu: {cpu_count}")
+    results = run(tiles, worker_counts)
+    base_time = results[0][1]
+    for workers, seconds, building_count in results:
+        print(f"workers={workers:2d}  {seconds:7.3f} s  "
+              f"speedup={base_time / seconds:5.2f}x  buildings={building_count}")
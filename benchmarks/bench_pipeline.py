@@ -0,0 +1,288 @@
+"""
+タイルからシーンを作るまでの各段階の時間を、同梱の 10/〜16/ のタイルでズームレベルごとに計測します。
+
+- decode: pbf のデコード（mvt_decoder.decode_polygons、ファイルの読み込みは含まない）
+- process: 簡略化・重心・長方形の判定（process_polygon_batch、process_coordinates のバッチ版）
+- lod: 詳細度ごとのポリゴンの作成（BuildingLod.build）
+- colors_nearest / colors_bilinear / colors_area: 画像からの色の取得
+- geometry: 描画用のジオメトリの作成（BatchedBuildings と InstancedBoxes）
+- update: 1 回の更新で全ビルの高さを計算して頂点に書き込む時間（CPU でアニメーションする場合）
+- process_coordinates, geom_utils: ビルごとの従来の処理（--legacy を指定した場合だけ、時間がかかります）
+
+各段階はタイルの全体を repeat 回処理した最短の時間で、ビル数/秒と頂点数/秒も表示します。
+結果は .benchmarks/pipeline/ に JSON で保存し、前回の結果より遅くなった段階を表示します。
+
+リポジトリのルートで実行します:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --zooms 14 15 16 --max-tiles 4 --legacy
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+import shapely
+from panda3d.core import NodePath, PandaSystem
+from building.data_loader import DataLoader
+from building.mvt_decoder import decode_polygons
+from building.batch_geometry import process_polygon_batch
+from building.lod import BuildingLod, SLIVER_RATIO
+from building.geometry_generator import GeometryGenerator
+from building.geom_utils import create_box_geom, create_polygon_geom, create_side_geom
+from building.image_sampler import SAMPLING_MODES
+from building.wave import WaveAnimator
+from warm_tile_cache import find_tiles
+
+# 渋谷駅のズームレベル 16 のタイル（各ズームレベルでこのタイルに近いタイルを使う）
+ORIGIN_TILE = (16, 58199, 25811)
+IMAGE_PATH = 'images/techno_pop_music.png'
+RESULTS_DIR = os.path.join('.benchmarks', 'pipeline')
+
+
+def select_tiles(z, max_tiles):
+    """ズームレベル z の pbf があるタイルのうち、ORIGIN_TILE に近い順に max_tiles 個"""
+    shift = ORIGIN_TILE[0] - z
+    center_x, center_y = ORIGIN_TILE[1] >> shift, ORIGIN_TILE[2] >> shift
+    tiles = find_tiles(z)
+    tiles.sort(key=lambda tile: (max(abs(tile[1] - center_x), abs(tile[2] - center_y)), tile))
+    return tiles[:max_tiles]
+
+
+class TileFixture:
+    """1 タイル分の各段階の入力（前の段階の出力）"""
+
+    def __init__(self, tile):
+        self.tile = tile
+        z, x, y = tile
+        with open(f'{z}/{x}/{y}.pbf', 'rb') as f:
+            self.data = f.read()
+        self.polygons = decode_polygons(self.data, 'bldg')
+        self.result = process_stage(self)
+        self.table = DataLoader(z, x, y, None).build_table(self.polygons.polygon_ids(),
+                                                           self.polygons.polygon_heights(), self.result)
+        self.painters = {sampling: DataLoader(z, x, y, IMAGE_PATH, color_sampling=sampling)
+                         for sampling in SAMPLING_MODES}
+        self.node = NodePath('bench_pipeline')
+        self.batched_buildings = GeometryGenerator.create_batched_buildings(self.node, self.table,
+                                                                            include_rect=False)
+        self.instanced_boxes = GeometryGenerator.create_instanced_rect_buildings(self.node, self.table)
+        self.wave_animator = WaveAnimator(self.table.centroids)
+        # 従来の process_coordinates の入力（--legacy の場合だけ作成）
+        self.legacy_rings = None
+
+    def rings(self):
+        """デコードしたポリゴンごとのリングの座標のリスト（従来の process_coordinates の入力）"""
+        vertices = self.polygons.vertices.tolist()
+        ring_offsets = self.polygons.ring_offsets.tolist()
+        polygon_offsets = self.polygons.polygon_offsets.tolist()
+        return [[vertices[ring_offsets[r]:ring_offsets[r + 1]] for r in range(polygon_offsets[p],
+                                                                              polygon_offsets[p + 1])]
+                for p in range(len(polygon_offsets) - 1)]
+
+
+def decode_stage(fixture):
+    return decode_polygons(fixture.data, 'bldg')
+
+
+def process_stage(fixture):
+    polygons = fixture.polygons
+    return process_polygon_batch(polygons.vertices, polygons.ring_offsets,
+                                 DataLoader.simplify_tolerance(fixture.tile[0]),
+                                 polygon_offsets=polygons.polygon_offsets, sliver_ratio=SLIVER_RATIO)
+
+
+def lod_stage(fixture):
+    return BuildingLod.build(fixture.table, DataLoader.simplify_tolerance(fixture.tile[0]))
+
+
+def colors_stage(sampling):
+    def stage(fixture):
+        return fixture.painters[sampling].get_table_colors(fixture.result)
+    return stage
+
+
+def geometry_stage(fixture):
+    node = NodePath('geometry')
+    GeometryGenerator.create_batched_buildings(node, fixture.table, include_rect=False)
+    GeometryGenerator.create_instanced_rect_buildings(node, fixture.table)
+    return node
+
+
+def update_stage(fixture):
+    heights = fixture.wave_animator.heights(0.5, time.perf_counter())
+    fixture.batched_buildings.set_heights(heights)
+    fixture.instanced_boxes.set_heights(heights)
+
+
+def process_coordinates_stage(fixture):
+    tolerance = DataLoader.simplify_tolerance(fixture.tile[0])
+    return [DataLoader.process_coordinates(rings, tolerance) for rings in fixture.legacy_rings]
+
+
+def geom_utils_stage(fixture):
+    table = fixture.table
+    geoms = []
+    for building in table:
+        color = building.color
+        if building.rect_width is not None:
+            geoms.append(create_box_geom((building.rect_width, building.rect_height, building.rect_angle), color))
+        else:
+            rings = building.simplified_coordinates
+            geoms.append(create_polygon_geom(rings, color))
+            geoms.append(create_side_geom(rings, color))
+    return geoms
+
+
+def input_counts(fixture):
+    """デコードと簡略化の段階の入力の (ビル数, 頂点数)"""
+    return fixture.polygons.polygon_count, len(fixture.polygons.vertices)
+
+
+def table_counts(fixture):
+    """簡略化後の段階の入力の (ビル数, 頂点数)"""
+    return len(fixture.table), len(fixture.table.vertices)
+
+
+def stages(legacy=False):
+    """(名前, 1 タイルを処理する関数, 入力の数を返す関数)"""
+    result = [('decode', decode_stage, input_counts),
+              ('process', process_stage, input_counts),
+              ('lod', lod_stage, table_counts)]
+    result += [(f'colors_{sampling}', colors_stage(sampling), table_counts) for sampling in SAMPLING_MODES]
+    result += [('geometry', geometry_stage, table_counts),
+               ('update', update_stage, table_counts)]
+    if legacy:
+        result += [('process_coordinates', process_coordinates_stage, input_counts),
+                   ('geom_utils', geom_utils_stage, table_counts)]
+    return result
+
+
+def measure(stage, fixtures, repeat):
+    """全タイルを repeat 回処理した最短の時間（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [stage(fixture) for fixture in fixtures]
+        best = min(best, time.perf_counter() - start)
+        del outputs
+    return best
+
+
+def run(zooms, max_tiles, repeat, legacy=False):
+    results = []
+    for z in zooms:
+        tiles = select_tiles(z, max_tiles)
+        if not tiles:
+            print(f"z{z}: no tiles")
+            continue
+        fixtures = [TileFixture(tile) for tile in tiles]
+        if legacy:
+            for fixture in fixtures:
+                fixture.legacy_rings = fixture.rings()
+        for name, stage, counts in stages(legacy):
+            # 従来の処理は遅いので 1 回だけ
+            seconds = measure(stage, fixtures, 1 if name in ('process_coordinates', 'geom_utils') else repeat)
+            building_count, vertex_count = np.sum([counts(fixture) for fixture in fixtures], axis=0).tolist()
+            results.append({
+                'zoom': z, 'stage': name, 'tiles': len(tiles),
+                'buildings': building_count, 'vertices': vertex_count,
+                'ms': seconds * 1000,
+                'buildings_per_s': building_count / seconds if seconds else None,
+                'vertices_per_s': vertex_count / seconds if seconds else None,
+            })
+            print_result(results[-1])
+    return results
+
+
+def print_result(result):
+    print(f"z{result['zoom']:<3d} {result['stage']:>20}  {result['tiles']:>5d}  {result['buildings']:>8d}  "
+          f"{result['ms']:>10.2f}  {result['buildings_per_s'] / 1e3:>12.1f}  {result['vertices_per_s'] / 1e6:>10.2f}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'shapely': shapely.__version__,
+        'panda3d': PandaSystem.getVersionString(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(results, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    env = environment()
+    path = os.path.join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{env['commit'] or 'unknown'}.json")
+    with open(path, 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=2)
+    return path
+
+
+def latest_results(results_dir=RESULTS_DIR, exclude=None):
+    """results_dir の最も新しい結果のファイル（exclude を除く）。ない場合は None。"""
+    paths = sorted(path for path in glob.glob(os.path.join(results_dir, '*.json')) if path != exclude)
+    return paths[-1] if paths else None
+
+
+def compare(results, baseline_path, threshold=0.2):
+    """
+    baseline_path の結果と比べて、threshold（割合）より遅くなった (ズームレベル, 段階) を表示します。
+    遅くなった段階の数を返します。
+    """
+    with open(baseline_path) as f:
+        baseline = {(r['zoom'], r['stage']): r for r in json.load(f)['results']}
+    print(f"\ncompared with {baseline_path}")
+    regressions = 0
+    for result in results:
+        previous = baseline.get((result['zoom'], result['stage']))
+        # タイル数が違う場合は比べない
+        if previous is None or previous['tiles'] != result['tiles']:
+            continue
+        ratio = result['ms'] / previous['ms'] if previous['ms'] else 1.0
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  REGRESSION'
+            regressions += 1
+        print(f"z{result['zoom']:<3d} {result['stage']:>20}  {previous['ms']:>10.2f} -> {result['ms']:>10.2f} ms"
+              f"  ({ratio:.2f}x){mark}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='タイルからシーンを作るまでの各段階の時間をズームレベルごとに計測します。')
+    parser.add_argument('--zooms', type=int, nargs='+', default=list(range(10, 17)), help='ズームレベル')
+    parser.add_argument('--max-tiles', type=int, default=8, help='ズームレベルごとのタイル数の上限')
+    parser.add_argument('--repeat', type=int, default=5, help='各段階の繰り返し回数（最短の時間を使う）')
+    parser.add_argument('--legacy', action='store_true', help='ビルごとの従来の処理も計測する')
+    parser.add_argument('--results-dir', default=RESULTS_DIR, help='結果を保存するディレクトリ')
+    parser.add_argument('--compare', default=None, help='比べる結果のファイル（省略時は前回の結果）')
+    parser.add_argument('--threshold', type=float, default=0.2, help='遅くなったとみなす割合')
+    parser.add_argument('--no-save', action='store_true', help='結果を保存しない')
+    args = parser.parse_args()
+
+    print(f"{'zoom':<4} {'stage':>20}  {'tiles':>5}  {'bldgs':>8}  {'time [ms]':>10}  "
+          f"{'k bldgs/s':>12}  {'M verts/s':>10}")
+    pipeline_results = run(args.zooms, args.max_tiles, args.repeat, args.legacy)
+
+    saved_path = None
+    if not args.no_save:
+        saved_path = save_results(pipeline_results, args.results_dir)
+        print(f"\nsaved: {saved_path}")
+    baseline_path = args.compare or latest_results(args.results_dir, exclude=saved_path)
+    if baseline_path is not None:
+        if compare(pipeline_results, baseline_path, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,124 @@
+"""
+{z}/{x}/{y}.pbf のファイルと、pack_tiles で作ったアーカイブ（圧縮なし・gzip・zstd）で
+タイルの存在確認、読み込み、読み込みとデコードの時間とディスク上のサイズを比べます。
+
+--cold を指定すると、計測の前に posix_fadvise でファイルをページキャッシュから追い出します
+（Linux のみ。キャッシュに載っていない状態からの読み込みに近くなります）。
+
+リポジトリのルートで実行します:
+    python -m benchmarks.bench_tile_archive
+    python -m benchmarks.bench_tile_archive --zooms 16 --cold
+"""
+import os
+import time
+import zlib
+import argparse
+import tempfile
+from building.mvt_decoder import decode_polygons
+from building.tile_archive import TileArchive, find_tile_files, pack_tiles
+
+
+def disk_usage(paths):
+    """(ファイルの大きさの合計, ディスク上で使うブロックの大きさの合計)"""
+    size = blocks = 0
+    for path in paths:
+        stat = os.stat(path)
+        size += stat.st_size
+        blocks += getattr(stat, 'st_blocks', 0) * 512
+    return size, blocks
+
+
+def drop_page_cache(paths):
+    """ファイルをページキャッシュから追い出します（対応していない環境では何もしません）。"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def read_file(tile):
+    z, x, y = tile
+    with open(f'{z}/{x}/{y}.pbf', 'rb') as f:
+        return f.read()
+
+
+def measure(tiles, exists, read, decode_tiles, cold_paths=None):
+    """(存在確認, 読み込み, 読み込みとデコード) の時間（秒）。デコードは decode_tiles だけで計ります。"""
+    start = time.perf_counter()
+    for tile in tiles:
+        exists(tile)
+    exists_time = time.perf_counter() - start
+
+    if cold_paths is not None:
+        drop_page_cache(cold_paths)
+    start = time.perf_counter()
+    for tile in tiles:
+        # 全バイトに触れて、メモリマップの場合も実際に読み込ませる
+        zlib.crc32(read(tile))
+    read_time = time.perf_counter() - start
+
+    if cold_paths is not None:
+        drop_page_cache(cold_paths)
+    start = time.perf_counter()
+    for tile in decode_tiles:
+        decode_polygons(read(tile), 'bldg')
+    decode_time = time.perf_counter() - start
+    return exists_time, read_time, decode_time
+
+
+def zstd_available():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='タイルのファイルとアーカイブの読み込みの時間を比べます。')
+    parser.add_argument('--zooms', type=int, nargs='+', default=list(range(10, 17)), help='ズームレベル')
+    parser.add_argument('--decode-count', type=int, default=200, help='デコードの時間を計るタイルの数（全体から等間隔に選ぶ）')
+    parser.add_argument('--cold', action='store_true', help='計測の前にファイルをページキャッシュから追い出す')
+    args = parser.parse_args()
+
+    files = find_tile_files('.', args.zooms)
+    tiles = sorted(tile for tile, _ in files)
+    paths = [path for _, path in files]
+    size, blocks = disk_usage(paths)
+    directories = len({os.path.dirname(path) for path in paths})
+    step = max(1, len(tiles) // max(1, args.decode_count))
+    decode_tiles = tiles[::step][:args.decode_count]
+    print(f"tiles: {len(tiles)} (z{min(args.zooms)}-z{max(args.zooms)}), directories: {directories}, "
+          f"decoded: {len(decode_tiles)}")
+
+    print(f"{'layout':>14}  {'MB':>7}  {'disk MB':>8}  {'pack [s]':>8}  {'open [ms]':>9}  "
+          f"{'exists [ms]':>11}  {'read [ms]':>10}  {'decode [ms]':>11}")
+    loose = measure(tiles, lambda tile: os.path.isfile('{}/{}/{}.pbf'.format(*tile)), read_file,
+                    decode_tiles, paths if args.cold else None)
+    print(f"{'loose files':>14}  {size / 1e6:>7.1f}  {blocks / 1e6:>8.1f}  {'':>8}  {'':>9}  "
+          f"{loose[0] * 1000:>11.1f}  {loose[1] * 1000:>10.1f}  {loose[2] * 1000:>11.1f}")
+
+    compressions = ['none', 'gzip'] + (['zstd'] if zstd_available() else [])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for compression in compressions:
+            path = os.path.join(tmp_dir, f'tiles-{compression}.plta')
+            start = time.perf_counter()
+            pack_tiles(path, '.', args.zooms, compression=compression)
+            pack_time = time.perf_counter() - start
+
+            if args.cold:
+                drop_page_cache([path])
+            start = time.perf_counter()
+            archive = TileArchive(path)
+            open_time = time.perf_counter() - start
+            result = measure(tiles, archive.__contains__, lambda tile: archive.get(*tile),
+                             decode_tiles, [path] if args.cold else None)
+            archive_size, archive_blocks = disk_usage([path])
+            print(f"{'archive ' + compression:>14}  {archive_size / 1e6:>7.1f}  {archive_blocks / 1e6:>8.1f}  "
+                  f"{pack_time:>8.1f}  {open_time * 1000:>9.2f}  {result[0] * 1000:>11.1f}  "
+                  f"{result[1] * 1000:>10.1f}  {result[2] * 1000:>11.1f}")
+            del archive
@@ -0,0 +1,77 @@
+"""
+上面の三角形分割を「頂点 0 からの扇形」「耳刈り法（ビルごと）」「triangulate_polygons（タイル単位）」で比較します。
+扇形は凹型のビルや穴を正しく塗れないため、三角形の面積の合計がポリゴンの面積と一致しないビル数も表示します。
+
+リポジトリのルートで実行します:
+    python -m benchmarks.bench_triangulate
+"""
+import time
+import numpy as np
+import shapely
+from building.data_loader import DataLoader
+from building.mvt_decoder import ragged_arange
+from building.triangulate import triangulate_polygons, triangulate_rings
+from benchmarks.bench_multi_tile_loader import tiles_in_range
+
+
+def fan_triangles(table):
+    """外周の頂点 0 からの扇形 (0, i, i + 1)（従来の geom_utils.create_polygon_geom と同じ）"""
+    starts = table.ring_offsets[table.polygon_offsets[:-1]]
+    counts = np.maximum(table.vertex_counts() - 2, 0)
+    fan = ragged_arange(np.ones(len(table), dtype=np.int64), counts)
+    base = np.repeat(starts, counts)
+    triangles = np.stack([base, base + fan, base + fan + 1], axis=1)
+    offsets = np.zeros(len(table) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return triangles, offsets
+
+
+def ear_clip_triangles(table):
+    """ビルごとに triangulate_rings で分割"""
+    triangles = []
+    counts = np.zeros(len(table), dtype=np.int64)
+    for i in range(len(table)):
+        local = triangulate_rings(table.rings(i))
+        counts[i] = len(local)
+        triangles.append(local + table.ring_offsets[table.polygon_offsets[i]])
+    offsets = np.zeros(len(table) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return np.concatenate(triangles), offsets
+
+
+def batch_triangles(table):
+    return triangulate_polygons(table.vertices, table.ring_offsets, table.polygon_offsets)
+
+
+def wrong_area_count(table, triangles, offsets, areas):
+    """三角形の面積（絶対値）の合計がポリゴンの面積と一致しないビルの数"""
+    a, b, c = (table.vertices[triangles[:, k]].astype(np.float64) for k in range(3))
+    triangle_areas = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])) / 2
+    building = np.repeat(np.arange(len(table)), np.diff(offsets))
+    sums = np.bincount(building, triangle_areas, minlength=len(table))
+    return int(np.count_nonzero(~np.isclose(sums, areas, rtol=1e-3, atol=1)))
+
+
+def polygon_areas(table):
+    polygons = [shapely.Polygon(rings[0], rings[1:]) for rings in map(table.rings, range(len(table)))]
+    return shapely.area(np.array(polygons, dtype=object))
+
+
+if __name__ == '__main__':
+    # 渋谷駅周辺のズームレベル 16 のタイル (8 x 8)
+    tiles = tiles_in_range(16, range(58195, 58203), range(25807, 25815))
+    tables = [DataLoader(z, x, y, None).load_building_table() for z, x, y in tiles]
+    building_count = sum(len(table) for table in tables)
+    hole_count = sum(int(np.count_nonzero(np.diff(table.polygon_offsets) > 1)) for table in tables)
+    areas = [polygon_areas(table) for table in tables]
+    print(f"tiles: {len(tiles)}, buildings: {building_count}, buildings with holes: {hole_count}")
+
+    print(f"{'method':>10}  {'time [ms]':>10}  {'triangles':>10}  {'wrong area':>10}")
+    for name, method in (('fan', fan_triangles), ('ear-clip', ear_clip_triangles), ('batch', batch_triangles)):
+        start = time.perf_counter()
+        results = [method(table) for table in tables]
+        elapsed = time.perf_counter() - start
+        triangle_count = sum(len(triangles) for triangles, _ in results)
+        wrong = sum(wrong_area_count(table, triangles, offsets, area)
+                    for table, (triangles, offsets), area in zip(tables, results, areas))
+        print(f"{name:>10}  {elapsed * 1000:>10.1f}  {triangle_count:>10}  {wrong:>10}")
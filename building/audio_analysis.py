@@ -0,0 +1,169 @@
+import os
+import hashlib
+import numpy as np
+from .tile_cache import read_arrays, write_arrays
+
+# 解析の結果が変わる変更をしたら上げる（キャッシュのキーに使用）
+ANALYSIS_VERSION = 1
+# int16 の最大値（振幅を 0〜1 に正規化する）
+MAX_AMPLITUDE = 32768
+# 解析を一度に行うフレーム数（FFT の作業用配列の大きさを抑える）
+FRAMES_PER_PASS = 4096
+
+
+def decode_audio(file_path, sample_rate=44100):
+    """
+    音声ファイルをモノラル・int16 の PCM の配列にデコードします。
+    pydub（と ffmpeg）はキャッシュがない場合だけ必要なので、ここで読み込みます。
+    """
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(file_path)
+    audio = audio.set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype=np.int16)
+
+
+def band_edges(sample_rate, frame_size, band_count, min_frequency=40.0):
+    """
+    FFT のビンを band_count 個の帯域に分ける境界（ビンの番号、band_count + 1 個）を返します。
+    帯域は min_frequency からナイキスト周波数まで対数で等間隔にし、各帯域に 1 ビン以上を割り当てます。
+    """
+    bin_count = frame_size // 2 + 1
+    frequencies = np.geomspace(min_frequency, sample_rate / 2, band_count + 1)
+    edges = np.searchsorted(np.fft.rfftfreq(frame_size, 1 / sample_rate), frequencies)
+    edges[0] = 1  # 直流成分は含めない
+    for i in range(1, len(edges)):
+        edges[i] = max(edges[i], edges[i - 1] + 1)
+    edges[-1] = bin_count
+    return np.minimum(edges, bin_count)
+
+
+def analyze_pcm(pcm, sample_rate, frame_size=1024, band_count=16):
+    """
+    PCM の配列を frame_size サンプルごとのフレームに分け、全フレームの RMS と帯域ごとの強さをまとめて計算します。
+
+    戻り値の辞書:
+    - rms: 各フレームの RMS (F,)（int16 の単位、従来の audio_callback と同じ）
+    - bands: 各フレームの帯域ごとの強さ (F, band_count)（ハン窓をかけたスペクトルの帯域内の RMS）
+    - band_edges: 帯域の境界のビンの番号 (band_count + 1,)
+    """
+    pcm = np.asarray(pcm)
+    frame_count = -(-len(pcm) // frame_size)
+    edges = band_edges(sample_rate, frame_size, band_count)
+    window = np.hanning(frame_size).astype(np.float32)
+    bin_counts = np.diff(edges)
+
+    rms = np.zeros(frame_count, dtype=np.float32)
+    bands = np.zeros((frame_count, band_count), dtype=np.float32)
+    for first in range(0, frame_count, FRAMES_PER_PASS):
+        last = min(first + FRAMES_PER_PASS, frame_count)
+        samples = pcm[first * frame_size:last * frame_size].astype(np.float32)
+        # 最後のフレームの足りない分は 0 で埋める
+        frames = np.zeros(((last - first) * frame_size), dtype=np.float32)
+        frames[:len(samples)] = samples
+        frames = frames.reshape(-1, frame_size)
+
+        rms[first:last] = np.sqrt(np.mean(np.square(frames), axis=1))
+        power = np.square(np.abs(np.fft.rfft(frames * window, axis=1))) / frame_size
+        bands[first:last] = np.sqrt(np.add.reduceat(power, edges[:-1], axis=1) / bin_counts)
+    return {'rms': rms, 'bands': bands, 'band_edges': edges}
+
+
+class AudioAnalysis:
+    """
+    曲全体の PCM と、フレームごとの RMS・帯域ごとの強さ。
+    再生位置（秒）から振幅や帯域の強さを引くので、描画側はキューを待たずに値を取得できます。
+    """
+
+    def __init__(self, pcm, sample_rate, frame_size, rms, bands, band_edges):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.rms = rms
+        self.bands = bands
+        self.band_edges = band_edges
+        # 帯域ごとの曲全体の最大値（bands_at で 0〜1 に正規化する）
+        self.band_peaks = np.maximum(bands.max(axis=0), 1e-6) if len(bands) else np.ones(bands.shape[1])
+
+    def __len__(self):
+        return len(self.rms)
+
+    @property
+    def duration(self):
+        return len(self.pcm) / self.sample_rate
+
+    @property
+    def band_count(self):
+        return self.bands.shape[1]
+
+    def frame_at(self, playback_time):
+        """再生位置（秒）のフレームの番号（範囲外は端のフレーム）"""
+        frame = int(playback_time * self.sample_rate) // self.frame_size
+        return min(max(frame, 0), len(self.rms) - 1)
+
+    def amplitude_at(self, playback_time):
+        """再生位置（秒）の振幅 (0〜1)"""
+        if not len(self.rms):
+            return 0.0
+        return float(self.rms[self.frame_at(playback_time)]) / MAX_AMPLITUDE
+
+    def bands_at(self, playback_time):
+        """再生位置（秒）の帯域ごとの強さ（帯域ごとの曲全体の最大値で 0〜1 に正規化）"""
+        if not len(self.bands):
+            return np.zeros(self.band_count, dtype=np.float32)
+        return self.bands[self.frame_at(playback_time)] / self.band_peaks
+
+
+class AudioCache:
+    """
+    デコードした PCM と解析結果をディスクに保存するキャッシュ。
+
+    キーは音声ファイルの内容のハッシュとサンプリングレート（解析結果はさらにフレームの大きさ、
+    帯域の数、ANALYSIS_VERSION）で、ファイルは TileCache と同じ形式で保存します。
+    2 回目以降の起動では PCM をメモリマップするだけで、デコードも解析も行いません。
+    """
+
+    def __init__(self, cache_dir='.audio_cache'):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def file_hash(file_path):
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()[:16]
+
+    def load(self, file_path, sample_rate=44100, frame_size=1024, band_count=16):
+        """音声ファイルの AudioAnalysis を返します（キャッシュがなければデコード・解析して保存します）。"""
+        source = AudioCache.file_hash(file_path)
+        pcm_path = os.path.join(self.cache_dir, f'{source}-{sample_rate}.pcm.bin')
+        analysis_path = os.path.join(
+            self.cache_dir, f'{source}-{sample_rate}-{frame_size}-{band_count}-v{ANALYSIS_VERSION}.analysis.bin')
+
+        pcm = self._read(pcm_path, 'pcm')
+        if pcm is None:
+            pcm = decode_audio(file_path, sample_rate)
+            self._write(pcm_path, {'pcm': pcm}, file_path)
+
+        analysis = self._read(analysis_path)
+        if analysis is None:
+            analysis = analyze_pcm(pcm, sample_rate, frame_size, band_count)
+            self._write(analysis_path, analysis, file_path)
+
+        return AudioAnalysis(pcm, sample_rate, frame_size, analysis['rms'], analysis['bands'],
+                             analysis['band_edges'])
+
+    def _read(self, path, name=None):
+        try:
+            arrays, _ = read_arrays(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays[name] if name is not None else arrays
+
+    def _write(self, path, arrays, file_path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_arrays(path, dict(arrays), meta={'source': os.path.basename(file_path)})
@@ -0,0 +1,137 @@
+import numpy as np
+import shapely
+
+
+def process_polygon_batch(vertices, offsets, tolerance=30, polygon_offsets=None, sliver_ratio=None):
+    """
+    タイル内のポリゴンをまとめて処理します。
+    DataLoader.process_coordinates を全ポリゴンに対して一度に行うバッチ版です。
+
+    vertices: 全リングの頂点を連結した (V, 2) 配列
+    offsets: リング i の頂点が vertices[offsets[i]:offsets[i + 1]] となるオフセット配列
+    polygon_offsets: ポリゴン p のリングが offsets の p 番目の範囲となるオフセット配列
+        （先頭が外周、残りが穴）。省略した場合は各リングを穴のないポリゴンとします。
+    tolerance: 簡略化の許容誤差（数値、またはポリゴンごとの配列）
+    sliver_ratio: 指定すると、各ポリゴンの許容誤差をその幅（polygon_widths）のこの割合までに抑えます
+        （小さいビルや細いビルが簡略化で細い三角形に潰れないように）
+
+    戻り値は以下の配列を持つ辞書です。
+    - vertices, ring_offsets, polygon_offsets: 簡略化後のリング（閉じた形、外周が先頭）
+    - centroids: 簡略化後ポリゴンの重心 (N, 2)
+    - radii: 重心から最も遠い頂点までの距離 (N,)
+    - rect_width, rect_height, rect_angle: 穴のない四辺形の長方形パラメータ（それ以外は NaN）
+    - vertex_count, simplified_vertex_count: 簡略化前後の外周の頂点数の合計
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ring_count = len(offsets) - 1
+    if polygon_offsets is None:
+        polygon_offsets = np.arange(ring_count + 1)
+    polygon_offsets = np.asarray(polygon_offsets, dtype=np.int64)
+    polygon_count = len(polygon_offsets) - 1
+
+    # シェイプリーのポリゴンをまとめて作成（各ポリゴンの最初のリングが外周）
+    vertex_ring = np.repeat(np.arange(ring_count), np.diff(offsets))
+    linear_rings = shapely.linearrings(vertices, indices=vertex_ring)
+    ring_polygon = np.repeat(np.arange(polygon_count), np.diff(polygon_offsets))
+    polygons = np.empty(polygon_count, dtype=object)
+    polygons[:] = shapely.polygons(linear_rings, indices=ring_polygon)
+
+    # ポリゴンの簡略化
+    if sliver_ratio is not None:
+        tolerance = np.minimum(tolerance, sliver_ratio * polygon_widths(polygons))
+    simplified = shapely.simplify(polygons, tolerance, preserve_topology=True)
+
+    # 簡略化したリング（外周と穴）の座標を取得
+    rings, rings_polygon = shapely.get_rings(simplified, return_index=True)
+    simplified_vertices, vertex_index = shapely.get_coordinates(rings, return_index=True)
+    ring_counts = np.bincount(vertex_index, minlength=len(rings))
+    simplified_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum(ring_counts, out=simplified_offsets[1:])
+    simplified_polygon_offsets = np.zeros(polygon_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rings_polygon, minlength=polygon_count), out=simplified_polygon_offsets[1:])
+
+    # 外周の頂点数
+    exterior_rings = simplified_polygon_offsets[:-1]
+    counts = ring_counts[exterior_rings]
+    has_holes = np.diff(simplified_polygon_offsets) > 1
+
+    # 重心の計算
+    centroids = shapely.get_coordinates(shapely.centroid(simplified))
+
+    # 包含円の半径（重心から各頂点までの距離の最大値）
+    vertex_polygon = rings_polygon[vertex_index]
+    distances = np.hypot(*(simplified_vertices - centroids[vertex_polygon]).T)
+    radii = np.zeros(polygon_count)
+    np.maximum.at(radii, vertex_polygon, distances)
+
+    # 穴のない四辺形（最後の点が閉じるため 5 点）の場合、長方形パラメータを計算
+    rect_width = np.full(polygon_count, np.nan)
+    rect_height = np.full(polygon_count, np.nan)
+    rect_angle = np.full(polygon_count, np.nan)
+    quads = np.flatnonzero((counts == 5) & ~has_holes)
+    if len(quads):
+        min_rects = shapely.oriented_envelope(simplified[quads])
+        # 潰れた四辺形は長方形にならないため除外
+        is_polygon = shapely.get_type_id(min_rects) == 3
+        quads, min_rects = quads[is_polygon], min_rects[is_polygon]
+        rect_points = shapely.get_coordinates(
+            shapely.get_exterior_ring(min_rects)).reshape(-1, 5, 2)[:, :4]
+
+        # 4 辺の長さを計算し、短い順に幅と高さを割り当て
+        edges = np.roll(rect_points, -1, axis=1) - rect_points
+        sorted_lengths = np.sort(np.hypot(edges[..., 0], edges[..., 1]), axis=1)
+        rect_width[quads] = sorted_lengths[:, 0]
+        rect_height[quads] = sorted_lengths[:, 1]
+
+        # 回転角度を計算（最初のエッジの角度）
+        rect_angle[quads] = np.degrees(np.arctan2(edges[:, 0, 1], edges[:, 0, 0]))
+
+    return {
+        'vertices': simplified_vertices,
+        'ring_offsets': simplified_offsets,
+        'polygon_offsets': simplified_polygon_offsets,
+        'centroids': centroids,
+        'radii': radii,
+        'rect_width': rect_width,
+        'rect_height': rect_height,
+        'rect_angle': rect_angle,
+        'vertex_count': int(np.diff(offsets)[polygon_offsets[:-1]].sum()),
+        'simplified_vertex_count': int(counts.sum()),
+    }
+
+
+def polygon_bounds(vertices, ring_offsets, polygon_offsets):
+    """
+    各ポリゴンの頂点を囲む矩形 (x_min, y_min, x_max, y_max) の配列 (N, 4) を返します。
+    ポリゴンのリングは vertices の連続した範囲なので、reduceat でまとめて計算します。
+    """
+    vertices = np.asarray(vertices).reshape(-1, 2)
+    starts = np.asarray(ring_offsets)[np.asarray(polygon_offsets)]
+    counts = np.diff(starts)
+    bounds = np.zeros((len(counts), 4), dtype=np.float64)
+    nonempty = counts > 0
+    if np.any(nonempty):
+        indices = starts[:-1][nonempty]
+        bounds[nonempty, :2] = np.minimum.reduceat(vertices, indices, axis=0)
+        bounds[nonempty, 2:] = np.maximum.reduceat(vertices, indices, axis=0)
+    return bounds
+
+
+def polygon_widths(polygons):
+    """
+    shapely のポリゴンの配列の各ポリゴンのおおよその幅（2 × 面積 / 周長）。
+    細長い長方形では短い辺の長さに近くなります。
+    """
+    return 2 * shapely.area(polygons) / np.maximum(shapely.length(polygons), 1e-12)
+
+
+def polygon_arrays(polygons):
+    """shapely のポリゴンの配列を (vertices, ring_offsets, polygon_offsets) に変換します。"""
+    rings, ring_polygon = shapely.get_rings(polygons, return_index=True)
+    vertices, vertex_ring = shapely.get_coordinates(rings, return_index=True)
+    ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(vertex_ring, minlength=len(rings)), out=ring_offsets[1:])
+    polygon_offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ring_polygon, minlength=len(polygons)), out=polygon_offsets[1:])
+    return vertices, ring_offsets, polygon_offsets
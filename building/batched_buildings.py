@@ -0,0 +1,363 @@
+import numpy as np
+from panda3d.core import (GeomVertexArrayFormat, GeomVertexFormat, GeomVertexData, GeomTriangles,
+                          Geom, GeomNode, InternalName, Texture, Shader, GeomEnums)
+from .mvt_decoder import ragged_arange
+from .triangulate import triangulate_polygons
+
+# 1 つの Geom に入れる頂点数の上限（16 ビットのインデックスに収める）
+MAX_VERTICES_PER_GEOM = 65535
+
+# 箱型ビルの 8 頂点（幅・奥行きは後で掛ける）と 12 個の三角形（geom_utils.create_box_geom と同じ）
+BOX_CORNERS = np.array([
+    (-0.5, -0.5, 0), (0.5, -0.5, 0), (0.5, 0.5, 0), (-0.5, 0.5, 0),
+    (-0.5, -0.5, 1), (0.5, -0.5, 1), (0.5, 0.5, 1), (-0.5, 0.5, 1),
+], dtype=np.float32)
+BOX_TRIANGLES = np.array([
+    (0, 1, 2), (0, 2, 3),  # 下面
+    (4, 6, 5), (4, 7, 6),  # 上面
+    (0, 4, 5), (0, 5, 1),  # 前面
+    (3, 2, 6), (3, 6, 7),  # 背面
+    (0, 3, 7), (0, 7, 4),  # 左面
+    (1, 5, 6), (1, 6, 2),  # 右面
+], dtype=np.int64)
+
+# 頂点の色はビルの番号で色のテーブル（バッファテクスチャ）から読む
+BATCHED_VERTEX_SHADER = """
+#version 150
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform samplerBuffer building_colors;
+in vec4 p3d_Vertex;
+in float building;
+out vec4 vertex_color;
+
+void main() {
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    vertex_color = texelFetch(building_colors, int(building));
+}
+"""
+
+BATCHED_FRAGMENT_SHADER = """
+#version 150
+in vec4 vertex_color;
+out vec4 p3d_FragColor;
+
+void main() {
+    p3d_FragColor = vertex_color;
+}
+"""
+
+
+def make_batched_format():
+    """
+    位置 (float32 x3)、ビルの番号 (float32 x1)、波の属性 (float32 x2) を 1 つの配列に持つ頂点フォーマット。
+    色は頂点に持たず、ビルの番号で色のテーブルから読みます。
+    波の属性は (波の位相の基準値, 単位の高さ) で、シェーダーで高さを計算するときに使います。
+    """
+    array_format = GeomVertexArrayFormat()
+    array_format.add_column(InternalName.make('vertex'), 3, Geom.NT_float32, Geom.C_point)
+    array_format.add_column(InternalName.make('building'), 1, Geom.NT_float32, Geom.C_index)
+    array_format.add_column(InternalName.make('wave'), 2, Geom.NT_float32, Geom.C_other)
+    return GeomVertexFormat.register_format(GeomVertexFormat(array_format))
+
+
+class BatchedBuildings:
+    """
+    タイル内の全ビルを少数の大きな GeomVertexData にまとめて描画します。
+
+    ビルごとの頂点・インデックスの範囲 (vertex_ranges, index_ranges) を保持しているので、
+    三角形からビルを特定するピッキングができます。
+    頂点の z は「単位の高さ (0 または 1) × ビルの高さ」で、set_heights でまとめて更新します。
+    色はビルごとに 1 テクセルの色のテーブル（バッファテクスチャ）に持つので、set_colors は
+    頂点を書き換えずにビル数分のテクセルを書き込むだけで済みます。
+
+    lod (BuildingLod) を指定すると、各ビルの全ての詳細度のポリゴンの行を頂点データに持ち、
+    set_visible_buildings で行を選んでインデックスを作り直すことで詳細度を切り替えます。
+    頂点・インデックスの範囲は行ごと、高さ・色・波の属性はビルごとです。
+    """
+
+    def __init__(self, table, parent_node, min_height=0, wireframe=False,
+                 max_vertices_per_geom=MAX_VERTICES_PER_GEOM, include_rect=True, lod=None):
+        self.table = table
+        self.lod = lod
+        self.node = parent_node.attachNewNode('batched_buildings')
+        self.format = make_batched_format()
+        self.stride = self.format.getArray(0).getStride() // 4
+
+        # 行（LOD がない場合はビル）ごとの頂点数・三角形数を決めて、頂点とインデックスを組み立てる
+        mesh_table = table if lod is None else lod.mesh_table(table)
+        self.row_buildings = np.arange(len(table)) if lod is None else lod.row_buildings
+        self.row_count = len(mesh_table)
+        positions, unit_z, triangles, vertex_counts, triangle_counts = \
+            BatchedBuildings.build_mesh(mesh_table, min_height, include_rect)
+        self.vertex_ranges = BatchedBuildings.ranges(vertex_counts)
+        self.index_ranges = BatchedBuildings.ranges(3 * triangle_counts)
+        self.vertex_building = np.repeat(self.row_buildings, vertex_counts).astype(np.int32)
+        self.unit_z = unit_z
+        # 全ビルのインデックス（グローバルな頂点番号）。表示するビルを絞り込むときに使う
+        self.indices = triangles.ravel()
+        self.heights = table.heights.copy()
+
+        # 頂点数の上限ごとに行を分割して Geom を作成
+        self.chunks = []
+        vertex_ends = self.vertex_ranges[:, 1]
+        start = 0
+        while start < self.row_count:
+            limit = self.vertex_ranges[start, 0] + max_vertices_per_geom
+            end = max(start + 1, int(np.searchsorted(vertex_ends, limit, side='right')))
+            self.chunks.append(self.create_chunk(len(self.chunks), start, end, positions, triangles))
+            start = end
+
+        # ビルごとの色のテーブル
+        self.color_texture = Texture('building_colors')
+        self.color_texture.setupBufferTexture(max(1, len(table)), Texture.T_float, Texture.F_rgba32,
+                                              GeomEnums.UH_dynamic)
+        self.node.setShader(Shader.make(Shader.SL_GLSL, BATCHED_VERTEX_SHADER, BATCHED_FRAGMENT_SHADER))
+        self.node.setShaderInput('building_colors', self.color_texture)
+
+        # ワイヤーフレームと面の切り替え
+        if wireframe:
+            self.node.setRenderModeWireframe()
+            self.node.setTwoSided(True)
+        else:
+            self.node.setRenderModeFilled()
+
+        self.set_colors(table.colors)
+        self.set_heights(self.heights)
+        if lod is not None:
+            # 各ビルの基本の詳細度の行だけを描画する
+            self.set_visible_buildings()
+
+    @staticmethod
+    def ranges(counts):
+        """個数の配列から [start, end) の範囲の配列 (N, 2) を作ります。"""
+        ends = np.cumsum(counts)
+        return np.stack([ends - counts, ends], axis=1)
+
+    @staticmethod
+    def build_mesh(table, min_height=0, include_rect=True):
+        """
+        全ビルの頂点位置・単位の高さ・三角形（グローバルな頂点番号）を作ります。
+        長方形のビルは回転した箱、それ以外は上面（穴を含めて三角形分割）と、外周・穴の側面で構成します。
+        include_rect=False の場合、長方形のビルは含めません（InstancedBoxes で描画する場合）。
+        """
+        ring_counts = np.diff(table.polygon_offsets)
+        has_rings = ring_counts > 0
+        exterior_lengths = np.zeros(len(table), dtype=np.int64)
+        exterior_lengths[has_rings] = np.diff(table.ring_offsets)[table.polygon_offsets[:-1][has_rings]]
+        visible = table.heights >= min_height
+        is_rect = table.is_rect & visible & include_rect
+        is_polygon = ~table.is_rect & visible & (exterior_lengths >= 4)
+
+        # ポリゴンのビルの頂点数 n（全リングの合計）と側面の辺の数（リングごとに頂点数 - 1）
+        polygon_vertex_offsets = table.ring_offsets[table.polygon_offsets]
+        polygon_lengths = np.diff(polygon_vertex_offsets)
+        n = np.where(is_polygon, polygon_lengths, 0)
+        edges = np.where(is_polygon, polygon_lengths - ring_counts, 0)
+        vertex_counts = np.where(is_rect, 8, n + 4 * edges)
+        vertex_starts = np.cumsum(vertex_counts) - vertex_counts
+
+        total_vertices = int(vertex_counts.sum())
+        positions = np.zeros((total_vertices, 2), dtype=np.float32)
+        unit_z = np.zeros(total_vertices, dtype=np.float32)
+        triangles = []
+        top_triangle_counts = np.zeros(len(table), dtype=np.int64)
+
+        # 長方形のビル: 単位の箱を拡大・回転して重心に移動
+        rect_index = np.flatnonzero(is_rect)
+        if len(rect_index):
+            size = np.stack([table.rect_width[rect_index], table.rect_height[rect_index]], axis=1)
+            angle = np.radians(table.rect_angle[rect_index])
+            cos, sin = np.cos(angle)[:, None], np.sin(angle)[:, None]
+            local = BOX_CORNERS[None, :, :2] * size[:, None, :]
+            rotated = np.stack([local[..., 0] * cos - local[..., 1] * sin,
+                                local[..., 0] * sin + local[..., 1] * cos], axis=2)
+            rows = (vertex_starts[rect_index][:, None] + np.arange(8)).ravel()
+            positions[rows] = (rotated + table.centroids[rect_index][:, None, :]).reshape(-1, 2)
+            unit_z[rows] = np.tile(BOX_CORNERS[:, 2], len(rect_index))
+            triangles.append((vertex_starts[rect_index][:, None, None] + BOX_TRIANGLES).reshape(-1, 3))
+
+        polygon_index = np.flatnonzero(is_polygon)
+        if len(polygon_index):
+            counts = n[polygon_index]
+            starts = vertex_starts[polygon_index]
+            # 対象のビルのリングと頂点（リングの順に連結）
+            rings = ragged_arange(table.polygon_offsets[polygon_index], ring_counts[polygon_index])
+            ring_lengths = table.ring_offsets[rings + 1] - table.ring_offsets[rings]
+            ring_points = ragged_arange(table.ring_offsets[rings], ring_lengths)
+
+            # 上面: リングの頂点をそのまま z=1 に置く
+            top_rows = ragged_arange(starts, counts)
+            positions[top_rows] = table.vertices[ring_points]
+            unit_z[top_rows] = 1
+            # 上面の三角形: 穴を含めてまとめて三角形分割し、上面の頂点の行番号に変換
+            ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+            np.cumsum(ring_lengths, out=ring_offsets[1:])
+            polygon_offsets = np.zeros(len(polygon_index) + 1, dtype=np.int64)
+            np.cumsum(ring_counts[polygon_index], out=polygon_offsets[1:])
+            top_triangles, triangle_offsets = \
+                triangulate_polygons(table.vertices[ring_points], ring_offsets, polygon_offsets)
+            top_triangle_counts[polygon_index] = np.diff(triangle_offsets)
+            triangles.append(top_rows[top_triangles])
+
+            # 側面: 各リングの各辺について 4 頂点（下 2 つ、上 2 つ）と 2 つの三角形
+            ring_edges = ring_lengths - 1
+            edge_local = ragged_arange(np.zeros(len(rings), dtype=np.int64), ring_edges)
+            edge_points = np.repeat(table.ring_offsets[rings], ring_edges) + edge_local
+            # ビル内での辺の通し番号から側面の頂点の行番号を求める
+            building_edges = edges[polygon_index]
+            edge_number = ragged_arange(np.zeros(len(polygon_index), dtype=np.int64), building_edges)
+            edge_base = np.repeat(starts + counts, building_edges) + 4 * edge_number
+            p1 = table.vertices[edge_points]
+            p2 = table.vertices[edge_points + 1]
+            for corner, (point, z) in enumerate(((p1, 0), (p2, 0), (p1, 1), (p2, 1))):
+                positions[edge_base + corner] = point
+                unit_z[edge_base + corner] = z
+            triangles.append(np.stack([edge_base, edge_base + 2, edge_base + 1], axis=1))
+            triangles.append(np.stack([edge_base + 1, edge_base + 2, edge_base + 3], axis=1))
+
+        triangle_counts = np.where(is_rect, 12, top_triangle_counts + 2 * edges)
+
+        # 三角形をビルの順に並べ替える
+        triangles = np.concatenate(triangles) if triangles else np.zeros((0, 3), dtype=np.int64)
+        order = np.argsort(np.searchsorted(np.cumsum(vertex_counts), triangles[:, 0], side='right'),
+                           kind='stable')
+        return positions, unit_z, triangles[order], vertex_counts, triangle_counts
+
+    def create_chunk(self, chunk_index, start, end, positions, triangles):
+        vertex_start, vertex_end = self.vertex_ranges[start, 0], self.vertex_ranges[end - 1, 1]
+        index_start, index_end = self.index_ranges[start, 0], self.index_ranges[end - 1, 1]
+        vertex_count = vertex_end - vertex_start
+
+        vdata = GeomVertexData('buildings', self.format, Geom.UHDynamic)
+        vdata.uncleanSetNumRows(int(vertex_count))
+        rows = self.vertex_rows(vdata)
+        rows[:, :2] = positions[vertex_start:vertex_end]
+        rows[:, 3] = self.vertex_building[vertex_start:vertex_end]
+        rows[:, 5] = self.unit_z[vertex_start:vertex_end]
+
+        tris = GeomTriangles(Geom.UHStatic)
+        tris.setIndexType(Geom.NT_uint16 if vertex_count <= 0xffff else Geom.NT_uint32)
+        index_dtype = np.uint16 if vertex_count <= 0xffff else np.uint32
+        indices = triangles.ravel()[index_start:index_end] - vertex_start
+        index_array = tris.modifyVertices()
+        index_array.uncleanSetNumRows(len(indices))
+        if len(indices):
+            np.frombuffer(memoryview(index_array), dtype=index_dtype)[:] = indices
+
+        geom = Geom(vdata)
+        geom.addPrimitive(tris)
+        geom_node = GeomNode(f'buildings_{chunk_index}')
+        geom_node.addGeom(geom)
+        node_path = self.node.attachNewNode(geom_node)
+        # ピッキング時にチャンクを特定するためのタグ
+        node_path.setTag('building_chunk', str(chunk_index))
+        return {'node': node_path, 'vdata': vdata, 'geom_node': geom_node, 'start': start, 'end': end,
+                'vertex_start': vertex_start, 'index_dtype': index_dtype, 'visible': None}
+
+    def vertex_rows(self, vdata):
+        """GeomVertexData の頂点配列を (行数, stride) の float32 配列として参照します。"""
+        array = vdata.modifyArray(0)
+        return np.frombuffer(memoryview(array), dtype=np.float32).reshape(-1, self.stride)
+
+    def set_heights(self, heights, buildings=None):
+        """
+        ビルの高さをまとめて更新します。
+        buildings（昇順のビルの番号）を指定した場合は、そのビルの高さだけを heights で置き換え、
+        そのビルの頂点だけを書き換えます。
+        """
+        if buildings is None:
+            self.heights[:] = heights
+            for chunk in self.chunks:
+                start, end = chunk['vertex_start'], chunk['vertex_start'] + chunk['vdata'].getNumRows()
+                rows = self.vertex_rows(chunk['vdata'])
+                rows[:, 2] = self.unit_z[start:end] * self.heights[self.vertex_building[start:end]]
+            return
+
+        buildings = np.asarray(buildings, dtype=np.int64)
+        self.heights[buildings] = heights
+        rows = buildings
+        if self.lod is not None:
+            # ビルの全ての詳細度の行を書き換える
+            rows = np.flatnonzero(np.isin(self.row_buildings, buildings))
+        for chunk, chunk_rows in self.split_by_chunk(rows):
+            if not len(chunk_rows):
+                continue
+            ranges = self.vertex_ranges[chunk_rows]
+            vertices = ragged_arange(ranges[:, 0], ranges[:, 1] - ranges[:, 0])
+            z = self.unit_z[vertices] * self.heights[self.vertex_building[vertices]]
+            self.vertex_rows(chunk['vdata'])[vertices - chunk['vertex_start'], 2] = z
+
+    def set_visible_buildings(self, buildings=None, levels=None):
+        """
+        描画するビル（昇順のビルの番号）だけの三角形でインデックスを作り直します。
+        None の場合は全ビルを描画します。
+        levels: LOD がある場合の各ビルの詳細度の段階（省略時は基本の段階、BuildingLod.rows を参照）
+        """
+        all_buildings = buildings is None
+        if all_buildings:
+            buildings = np.arange(len(self.table))
+        rows = np.asarray(buildings, dtype=np.int64)
+        if self.lod is not None:
+            rows = self.lod.rows(rows, levels)
+            all_buildings = False
+        for chunk, chunk_rows in self.split_by_chunk(rows):
+            # ピッキングで三角形の番号からビルを求めるために記録
+            chunk['visible'] = None if all_buildings else chunk_rows
+            ranges = self.index_ranges[chunk_rows]
+            indices = self.indices[ragged_arange(ranges[:, 0], ranges[:, 1] - ranges[:, 0])] - chunk['vertex_start']
+            tris = chunk['geom_node'].modifyGeom(0).modifyPrimitive(0)
+            index_array = tris.modifyVertices()
+            index_array.uncleanSetNumRows(len(indices))
+            if len(indices):
+                np.frombuffer(memoryview(index_array), dtype=chunk['index_dtype'])[:] = indices
+
+    def split_by_chunk(self, rows):
+        """昇順の行（LOD がない場合はビル）の番号を、チャンクごとの (チャンク, そのチャンクの行の番号) に分けます。"""
+        bounds = np.searchsorted(rows, [chunk['start'] for chunk in self.chunks] + [self.row_count])
+        for chunk, start, end in zip(self.chunks, bounds[:-1].tolist(), bounds[1:].tolist()):
+            yield chunk, rows[start:end]
+
+    def color_rows(self):
+        """色のテーブルを (ビル数, 4) の float32 配列として参照します。"""
+        ram_image = self.color_texture.modifyRamImage()
+        return np.frombuffer(memoryview(ram_image), dtype=np.float32).reshape(-1, 4)[:len(self.table)]
+
+    def set_colors(self, colors):
+        """全ビルの色 (N, 4) をまとめて更新します。"""
+        self.color_rows()[:] = colors
+
+    def set_phase_bases(self, phase_bases):
+        """
+        ビルごとの波の位相の基準値 (N,) を頂点の波の属性に書き込みます（シェーダー用）。
+        """
+        phase_bases = np.asarray(phase_bases, dtype=np.float32)
+        for chunk in self.chunks:
+            start, end = chunk['vertex_start'], chunk['vertex_start'] + chunk['vdata'].getNumRows()
+            self.vertex_rows(chunk['vdata'])[:, 4] = phase_bases[self.vertex_building[start:end]]
+
+    def set_building_color(self, index, color):
+        """ビル index の色だけを変更します。"""
+        self.color_rows()[index] = color
+
+    def chunk_of_building(self, index):
+        """ビル index（LOD がある場合は基本の詳細度の行）のチャンクの番号"""
+        if self.lod is not None:
+            index = int(self.lod.rows([index])[0])
+        starts = [chunk['start'] for chunk in self.chunks]
+        return int(np.searchsorted(starts, index, side='right')) - 1
+
+    def building_from_vertex(self, chunk_index, vertex_index):
+        """チャンク内の頂点番号からビルの番号を返します。"""
+        return int(self.vertex_building[self.chunks[chunk_index]['vertex_start'] + vertex_index])
+
+    def building_from_triangle(self, chunk_index, triangle_index):
+        """チャンク内の三角形の番号からビルの番号を返します。"""
+        chunk = self.chunks[chunk_index]
+        if chunk['visible'] is not None:
+            # 描画するビルを絞り込んでいる場合は、描画中のビルの三角形の通し番号から求める
+            ranges = self.index_ranges[chunk['visible']]
+            ends = np.cumsum(ranges[:, 1] - ranges[:, 0])
+            row = chunk['visible'][np.searchsorted(ends, 3 * triangle_index, side='right')]
+            return int(self.row_buildings[row])
+        index = self.index_ranges[chunk['start'], 0] + 3 * triangle_index
+        return int(self.row_buildings[np.searchsorted(self.index_ranges[:, 1], index, side='right')])
@@ -0,0 +1,256 @@
+import numpy as np
+import shapely
+from .spatial_grid import CentroidGrid
+from .triangulate import make_polygons
+
+
+class IndexedTile:
+    """BuildingIndex に登録した 1 タイル分のビルとその CentroidGrid"""
+
+    def __init__(self, key, table, cell_size):
+        self.key = key
+        self.table = table
+        self.centroids = np.asarray(table.centroids, dtype=np.float64)
+        self.radii = np.asarray(table.radii, dtype=np.float64)
+        self.grid = CentroidGrid(self.centroids, self.radii, cell_size=cell_size)
+        # 包含円を囲む矩形 (x_min, y_min, x_max, y_max)
+        if len(table):
+            self.bounds = np.concatenate([(self.centroids - self.radii[:, None]).min(axis=0),
+                                          (self.centroids + self.radii[:, None]).max(axis=0)])
+        else:
+            self.bounds = np.array([np.inf, np.inf, -np.inf, -np.inf])
+
+    def polygons(self, buildings):
+        """ビルの番号の配列に対応する shapely のポリゴンの配列（同じビルは 1 回だけ作成）"""
+        unique, inverse = np.unique(buildings, return_inverse=True)
+        table = self.table
+        return make_polygons(table.vertices, table.ring_offsets, table.polygon_offsets, unique)[inverse]
+
+
+class BuildingIndex:
+    """
+    読み込んだタイルのビルをまとめて検索する空間インデックス。
+
+    タイル（BuildingTable）ごとに CentroidGrid を作って保持するので、タイルの追加・削除は
+    そのタイルのビル数に比例するコストで済み、全体を作り直す必要はありません。
+    検索は複数の点や矩形を配列でまとめて受け取り、結果のビルは
+    (タイルの番号, タイル内のビルの番号) の組で返します。
+    タイルの番号は add_tile の戻り値で、tile(tile_id) で登録したテーブルを取り出せます。
+
+    座標は登録したテーブルの座標（centroids, vertices と同じ座標系）です。
+    ズームの異なるタイルを同時に登録した場合、同じ建物が両方のタイルから返ります。
+    """
+
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        # タイルの番号 -> IndexedTile
+        self.tiles = {}
+        # タイルのキー -> タイルの番号
+        self.tile_ids = {}
+        self._next_tile_id = 0
+
+    def __len__(self):
+        """登録しているビルの数"""
+        return sum(len(tile.table) for tile in self.tiles.values())
+
+    def __contains__(self, key):
+        return key in self.tile_ids
+
+    def add_tile(self, key, table):
+        """
+        タイル key のビルを登録し、タイルの番号を返します。
+        同じキーのタイルが登録済みの場合は置き換えます。
+        """
+        self.remove_tile(key)
+        tile_id = self._next_tile_id
+        self._next_tile_id += 1
+        self.tiles[tile_id] = IndexedTile(key, table, self.cell_size)
+        self.tile_ids[key] = tile_id
+        return tile_id
+
+    def remove_tile(self, key):
+        """タイル key のビルを検索の対象から外します。登録されていた場合は True を返します。"""
+        tile_id = self.tile_ids.pop(key, None)
+        if tile_id is None:
+            return False
+        del self.tiles[tile_id]
+        return True
+
+    def tile(self, tile_id):
+        """タイルの番号から登録したテーブルを返します。"""
+        return self.tiles[tile_id].table
+
+    def building(self, tile_id, building):
+        """検索結果の (タイルの番号, ビルの番号) から BuildingView を返します。"""
+        return self.tiles[tile_id].table[int(building)]
+
+    def query_bbox(self, x_min, y_min, x_max, y_max, footprint=False):
+        """
+        矩形ごとに、重心が矩形の中にあるビルを探します。
+        footprint=True の場合は、ビルの形（ポリゴン）が矩形と交わるビルを探します。
+
+        戻り値は (query_index, tile_ids, buildings) の配列の組で、矩形の番号順に並びます。
+        """
+        x_min, y_min, x_max, y_max = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=np.float64))
+                                                           for v in (x_min, y_min, x_max, y_max)))
+        results = []
+        for tile_id, tile, queries, buildings in self._candidates(x_min, y_min, x_max, y_max, expand=footprint):
+            cx, cy = tile.centroids[buildings].T
+            if footprint:
+                # 包含円を囲む矩形で絞り込んでからポリゴンで判定
+                radii = tile.radii[buildings]
+                hit = ((cx + radii >= x_min[queries]) & (cx - radii <= x_max[queries]) &
+                       (cy + radii >= y_min[queries]) & (cy - radii <= y_max[queries]))
+                queries, buildings = queries[hit], buildings[hit]
+                boxes = shapely.box(x_min[queries], y_min[queries], x_max[queries], y_max[queries])
+                hit = shapely.intersects(tile.polygons(buildings), boxes)
+            else:
+                hit = ((cx >= x_min[queries]) & (cx <= x_max[queries]) &
+                       (cy >= y_min[queries]) & (cy <= y_max[queries]))
+            results.append((queries[hit], tile_id, buildings[hit]))
+        return self._merge(results)
+
+    def query_radius(self, x, y, radius, footprint=False):
+        """
+        点 (x, y) ごとに、重心が radius 以内にあるビルを探します。
+        footprint=True の場合は、ビルの形（ポリゴン）までの距離が radius 以内のビルを探します。
+
+        戻り値は (query_index, tile_ids, buildings) の配列の組で、点の番号順に並びます。
+        """
+        x, y, radius = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (x, y, radius)))
+        results = []
+        for tile_id, tile, queries, buildings in self._candidates(x - radius, y - radius, x + radius, y + radius,
+                                                                  expand=footprint):
+            distances = np.hypot(tile.centroids[buildings, 0] - x[queries], tile.centroids[buildings, 1] - y[queries])
+            if footprint:
+                hit = distances - tile.radii[buildings] <= radius[queries]
+                queries, buildings = queries[hit], buildings[hit]
+                hit = shapely.dwithin(tile.polygons(buildings), shapely.points(x[queries], y[queries]),
+                                      radius[queries])
+            else:
+                hit = distances <= radius[queries]
+            results.append((queries[hit], tile_id, buildings[hit]))
+        return self._merge(results)
+
+    def query_nearest(self, x, y, k=1):
+        """
+        点 (x, y) ごとに、重心が近い順に k 個のビルを探します。
+
+        戻り値は (tile_ids, buildings, distances) で、それぞれ (点の数, k) の配列です。
+        登録しているビルが k 個より少ない場合、足りない分は tile_ids, buildings が -1、distances が inf です。
+
+        点ごとに検索の半径を cell_size から倍にしながら広げ、半径内に k 個以上のビルが
+        見つかった点から順に確定します（半径の外のビルは半径内のビルより必ず遠いため）。
+        """
+        x, y = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (x, y)))
+        count = len(x)
+        tile_ids = np.full((count, k), -1, dtype=np.int64)
+        buildings = np.full((count, k), -1, dtype=np.int64)
+        distances = np.full((count, k), np.inf)
+        if not self.tiles or k <= 0:
+            return tile_ids, buildings, distances
+
+        # この半径まで広げれば全ビルが入る（全タイルの重心を囲む矩形の最も遠い角まで）
+        bounds = np.array([tile.bounds for tile in self.tiles.values()])
+        x_min, y_min = bounds[:, :2].min(axis=0)
+        x_max, y_max = bounds[:, 2:].max(axis=0)
+        max_radius = np.hypot(np.maximum(np.abs(x - x_min), np.abs(x - x_max)),
+                              np.maximum(np.abs(y - y_min), np.abs(y - y_max)))
+
+        radius = np.full(count, float(self.cell_size))
+        pending = np.arange(count)
+        while len(pending):
+            queries, hit_tiles, hit_buildings, hit_distances = self._within_radius(
+                x[pending], y[pending], radius[pending])
+            found = np.bincount(queries, minlength=len(pending))
+            done = (found >= k) | (radius[pending] >= max_radius[pending])
+
+            keep = done[queries]
+            queries, hit_tiles, hit_buildings, hit_distances = (
+                queries[keep], hit_tiles[keep], hit_buildings[keep], hit_distances[keep])
+            order = np.lexsort((hit_buildings, hit_tiles, hit_distances, queries))
+            queries, hit_tiles, hit_buildings, hit_distances = (
+                queries[order], hit_tiles[order], hit_buildings[order], hit_distances[order])
+            # 点ごとの近い順の順位
+            starts = np.searchsorted(queries, queries, side='left')
+            rank = np.arange(len(queries)) - starts
+            selected = rank < k
+            rows, columns = pending[queries[selected]], rank[selected]
+            tile_ids[rows, columns] = hit_tiles[selected]
+            buildings[rows, columns] = hit_buildings[selected]
+            distances[rows, columns] = hit_distances[selected]
+
+            radius[pending] *= 2
+            pending = pending[~done]
+        return tile_ids, buildings, distances
+
+    def query_point(self, x, y):
+        """
+        点 (x, y) ごとに、その点を含む（境界上を含む）ビルを探します。
+
+        戻り値は (tile_ids, buildings) で、それぞれ点の数の配列です。
+        点を含むビルがない場合は -1、複数ある場合はタイルの番号、ビルの番号が小さいものを返します。
+        """
+        x, y = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (x, y)))
+        tile_ids = np.full(len(x), -1, dtype=np.int64)
+        buildings = np.full(len(x), -1, dtype=np.int64)
+        results = []
+        for tile_id, tile, queries, candidates in self._candidates(x, y, x, y, expand=True):
+            # 包含円に入るビルに絞り込んでからポリゴンで判定
+            distances = np.hypot(tile.centroids[candidates, 0] - x[queries], tile.centroids[candidates, 1] - y[queries])
+            hit = distances <= tile.radii[candidates] * (1 + 1e-6)
+            queries, candidates = queries[hit], candidates[hit]
+            hit = shapely.intersects_xy(tile.polygons(candidates), x[queries], y[queries])
+            results.append((queries[hit], tile_id, candidates[hit]))
+
+        queries, hit_tiles, hit_buildings = self._merge(results)
+        first = np.ones(len(queries), dtype=bool)
+        first[1:] = queries[1:] != queries[:-1]
+        tile_ids[queries[first]] = hit_tiles[first]
+        buildings[queries[first]] = hit_buildings[first]
+        return tile_ids, buildings
+
+    def _within_radius(self, x, y, radius):
+        """重心が radius 以内のビルの (query_index, tile_ids, buildings, distances)（順不同）"""
+        results = []
+        for tile_id, tile, queries, buildings in self._candidates(x - radius, y - radius, x + radius, y + radius,
+                                                                  expand=False):
+            distances = np.hypot(tile.centroids[buildings, 0] - x[queries], tile.centroids[buildings, 1] - y[queries])
+            hit = distances <= radius[queries]
+            results.append((queries[hit], np.full(np.count_nonzero(hit), tile_id), buildings[hit], distances[hit]))
+        if not results:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, np.zeros(0)
+        return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+    def _candidates(self, x_min, y_min, x_max, y_max, expand):
+        """
+        矩形と範囲が重なるタイルごとに、CentroidGrid の候補 (tile_id, tile, query_index, buildings) を返します。
+        expand=True の場合は重心ではなく包含円が矩形にかかるビルを候補にします。
+        """
+        for tile_id, tile in self.tiles.items():
+            if expand:
+                tx_min, ty_min, tx_max, ty_max = tile.bounds
+            else:
+                tx_min, ty_min = tile.grid.origin
+                tx_max = tx_min + tile.grid.nx * tile.grid.cell_size
+                ty_max = ty_min + tile.grid.ny * tile.grid.cell_size
+            overlaps = np.flatnonzero((x_max >= tx_min) & (x_min <= tx_max) & (y_max >= ty_min) & (y_min <= ty_max))
+            if not len(overlaps):
+                continue
+            queries, buildings = tile.grid.query_bbox_batch(x_min[overlaps], y_min[overlaps],
+                                                            x_max[overlaps], y_max[overlaps], expand=expand)
+            if len(buildings):
+                yield tile_id, tile, overlaps[queries], buildings
+
+    @staticmethod
+    def _merge(results):
+        """タイルごとの (query_index, tile_id, buildings) を連結し、(検索, タイル, ビル) の番号順に並べます。"""
+        if not results:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        queries = np.concatenate([queries for queries, _, _ in results])
+        tile_ids = np.concatenate([np.full(len(queries), tile_id) for queries, tile_id, _ in results])
+        buildings = np.concatenate([buildings for _, _, buildings in results])
+        order = np.lexsort((buildings, tile_ids, queries))
+        return queries[order], tile_ids[order], buildings[order]
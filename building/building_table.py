@@ -0,0 +1,289 @@
+import numpy as np
+from .mvt_decoder import ragged_arange
+
+
+class BuildingTable:
+    """
+    ビルのデータを NumPy 配列の列としてまとめて保持するテーブル。
+
+    1 行が 1 つのポリゴン（従来の Building インスタンス 1 つ）に対応します。
+    頂点は全ビル分をひとつの float32 バッファに詰め、
+    ring_offsets / polygon_offsets で各リング・各ビルの範囲を表します。
+
+    - ビル i のリング: polygon_offsets[i] 〜 polygon_offsets[i + 1]
+    - リング r の頂点: vertices[ring_offsets[r]:ring_offsets[r + 1]]
+    """
+
+    def __init__(self, ids, heights, vertices, ring_offsets, polygon_offsets,
+                 centroids, radii, rect_width, rect_height, rect_angle, colors):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.float32)
+        self.vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 2)
+        self.ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+        self.polygon_offsets = np.asarray(polygon_offsets, dtype=np.int64)
+        self.centroids = np.asarray(centroids, dtype=np.float32).reshape(-1, 2)
+        self.radii = np.asarray(radii, dtype=np.float32)
+        # 長方形ではないビルは NaN
+        self.rect_width = np.asarray(rect_width, dtype=np.float32)
+        self.rect_height = np.asarray(rect_height, dtype=np.float32)
+        self.rect_angle = np.asarray(rect_angle, dtype=np.float32)
+        self.colors = np.asarray(colors, dtype=np.float32).reshape(-1, 4)
+
+        # ビルノード（シーングラフ側の参照、必要になるまで作らない）
+        self._nodes = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"building index out of range: {index}")
+        return BuildingView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield BuildingView(self, index)
+
+    def __repr__(self):
+        return (f"BuildingTable(buildings={len(self)}, vertices={len(self.vertices)}, "
+                f"nbytes={self.nbytes})")
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            self._nodes = [None] * len(self)
+        return self._nodes
+
+    @property
+    def is_rect(self):
+        """長方形パラメータを持つビルのマスク"""
+        return ~np.isnan(self.rect_width)
+
+    @property
+    def nbytes(self):
+        """配列が占めるバイト数の合計"""
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def arrays(self):
+        """テーブルを構成する配列を名前付きで返します。"""
+        return {
+            'ids': self.ids,
+            'heights': self.heights,
+            'vertices': self.vertices,
+            'ring_offsets': self.ring_offsets,
+            'polygon_offsets': self.polygon_offsets,
+            'centroids': self.centroids,
+            'radii': self.radii,
+            'rect_width': self.rect_width,
+            'rect_height': self.rect_height,
+            'rect_angle': self.rect_angle,
+            'colors': self.colors,
+        }
+
+    def rings(self, index):
+        """ビル index のリングを (M, 2) 配列のリストで返します。"""
+        ring_start, ring_end = self.polygon_offsets[index], self.polygon_offsets[index + 1]
+        return [self.vertices[self.ring_offsets[r]:self.ring_offsets[r + 1]]
+                for r in range(ring_start, ring_end)]
+
+    def exterior(self, index):
+        """ビル index の外周リングを (M, 2) 配列で返します。"""
+        ring = self.polygon_offsets[index]
+        return self.vertices[self.ring_offsets[ring]:self.ring_offsets[ring + 1]]
+
+    def vertex_counts(self):
+        """各ビルの頂点数"""
+        return np.diff(self.ring_offsets[self.polygon_offsets])
+
+    def take(self, indices):
+        """indices の行（ビル）をその順に並べた新しいテーブルを返します。"""
+        indices = np.asarray(indices, dtype=np.int64)
+        ring_starts = self.polygon_offsets[indices]
+        ring_counts = self.polygon_offsets[indices + 1] - ring_starts
+        rings = ragged_arange(ring_starts, ring_counts)
+        lengths = self.ring_offsets[rings + 1] - self.ring_offsets[rings]
+        points = ragged_arange(self.ring_offsets[rings], lengths)
+        ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=ring_offsets[1:])
+        polygon_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(ring_counts, out=polygon_offsets[1:])
+        return BuildingTable(self.ids[indices], self.heights[indices], self.vertices[points],
+                             ring_offsets, polygon_offsets, self.centroids[indices], self.radii[indices],
+                             self.rect_width[indices], self.rect_height[indices], self.rect_angle[indices],
+                             self.colors[indices])
+
+    def to_dicts(self):
+        """export_building_dicts と同じ形式の辞書のリストに変換します。"""
+        return [{'id': int(self.ids[i]),
+                 'coordinates': [ring.tolist() for ring in self.rings(i)],
+                 'height': float(self.heights[i])}
+                for i in range(len(self))]
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.empty((0, 2)), [0], [0], np.empty((0, 2)),
+                   [], [], [], [], np.empty((0, 4)))
+
+    @classmethod
+    def from_buildings(cls, building_list):
+        """Building インスタンスのリストからテーブルを作成します。"""
+        builder = BuildingTableBuilder()
+        for building in building_list:
+            rect_params = (building.rect_width, building.rect_height, building.rect_angle)
+            builder.append(building.id, building.height, building.simplified_coordinates,
+                           building.centroid, building.bounding_circle_radius,
+                           rect_params, building.color)
+        return builder.build()
+
+    @classmethod
+    def concatenate(cls, tables):
+        """複数のテーブルを 1 つに連結します（オフセットは付け直します）。"""
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls.empty()
+
+        ring_offsets = [np.zeros(1, dtype=np.int64)]
+        polygon_offsets = [np.zeros(1, dtype=np.int64)]
+        vertex_base = ring_base = 0
+        for table in tables:
+            ring_offsets.append(table.ring_offsets[1:] + vertex_base)
+            polygon_offsets.append(table.polygon_offsets[1:] + ring_base)
+            vertex_base += len(table.vertices)
+            ring_base += len(table.ring_offsets) - 1
+
+        def stack(name):
+            return np.concatenate([getattr(table, name) for table in tables])
+
+        return cls(stack('ids'), stack('heights'), stack('vertices'),
+                   np.concatenate(ring_offsets), np.concatenate(polygon_offsets),
+                   stack('centroids'), stack('radii'),
+                   stack('rect_width'), stack('rect_height'), stack('rect_angle'),
+                   stack('colors'))
+
+
+class BuildingTableBuilder:
+    """
+    ポリゴンを 1 つずつ追加して BuildingTable を組み立てるヘルパー。
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.heights = []
+        self.vertex_chunks = []
+        self.ring_offsets = [0]
+        self.polygon_offsets = [0]
+        self.centroids = []
+        self.radii = []
+        self.rect_params = []
+        self.colors = []
+        self._vertex_count = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, id_value, height, rings, centroid, radius, rect_params, color):
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float32).reshape(-1, 2)
+            self.vertex_chunks.append(ring)
+            self._vertex_count += len(ring)
+            self.ring_offsets.append(self._vertex_count)
+        self.polygon_offsets.append(len(self.ring_offsets) - 1)
+
+        self.ids.append(-1 if id_value is None else id_value)
+        self.heights.append(height)
+        self.centroids.append(centroid)
+        self.radii.append(radius)
+        # None は NaN として保持
+        self.rect_params.append([np.nan if v is None else v for v in rect_params])
+        self.colors.append(color)
+
+    def build(self):
+        if not self.ids:
+            return BuildingTable.empty()
+        rect_params = np.asarray(self.rect_params, dtype=np.float32)
+        return BuildingTable(self.ids, self.heights, np.concatenate(self.vertex_chunks),
+                             self.ring_offsets, self.polygon_offsets,
+                             self.centroids, self.radii,
+                             rect_params[:, 0], rect_params[:, 1], rect_params[:, 2],
+                             self.colors)
+
+
+class BuildingView:
+    """
+    BuildingTable の 1 行を Building と同じ属性名で参照するための軽量ビュー。
+    main.MyApp など Building を前提にしたコードとの互換用です。
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def id(self):
+        return int(self.table.ids[self.index])
+
+    @property
+    def height(self):
+        return float(self.table.heights[self.index])
+
+    @property
+    def original_height(self):
+        return self.height
+
+    @property
+    def simplified_coordinates(self):
+        return [[tuple(point) for point in ring.tolist()] for ring in self.table.rings(self.index)]
+
+    @property
+    def coordinates(self):
+        # テーブルは簡略化後の座標だけを保持する
+        return self.simplified_coordinates
+
+    @property
+    def centroid(self):
+        x, y = self.table.centroids[self.index].tolist()
+        return x, y
+
+    @property
+    def bounding_circle_radius(self):
+        return float(self.table.radii[self.index])
+
+    @property
+    def rect_width(self):
+        return self._rect_value(self.table.rect_width)
+
+    @property
+    def rect_height(self):
+        return self._rect_value(self.table.rect_height)
+
+    @property
+    def rect_angle(self):
+        return self._rect_value(self.table.rect_angle)
+
+    @property
+    def color(self):
+        return tuple(self.table.colors[self.index].tolist())
+
+    @property
+    def node(self):
+        return self.table.nodes[self.index]
+
+    @node.setter
+    def node(self, value):
+        self.table.nodes[self.index] = value
+
+    def _rect_value(self, array):
+        value = float(array[self.index])
+        return None if np.isnan(value) else value
+
+    def __str__(self):
+        return (f"Building(id={self.id}, height={self.height}, "
+                f"centroid={self.centroid}, "
+                f"bounding_circle_radius={self.bounding_circle_radius})"
+                f"Rectangle - Width: {self.rect_width}, Height: {self.rect_height}, Angle: {self.rect_angle}")
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,99 @@
+import numpy as np
+from .spatial_grid import CentroidGrid
+
+
+class BuildingCuller:
+    """
+    ビルの重心と包含円の半径を使い、視錐台の外やカメラから遠いビルを選び出します。
+
+    ビルは「包含円 × 高さ 0〜max_height」の円柱とみなして判定します。
+    候補のビルは CentroidGrid で視錐台（と距離の範囲）を囲む矩形から取り出すので、
+    毎フレームのコストは全ビル数ではなく、ほぼ見えているビルの数に比例します。
+    lod (BuildingLod) を指定すると、表示するビルごとにカメラからの距離で詳細度の段階も選びます（levels）。
+    """
+
+    def __init__(self, table, max_distance=None, max_height=None, cell_size=256, lod=None):
+        """
+        table: BuildingTable
+        max_distance: カメラからこの距離より遠いビルを隠す（None で距離のカリングをしない）
+        max_height: 判定に使うビルの高さ（波のアニメーションで高くなる場合は最大の高さを指定）
+        lod: ビルの詳細度ごとのポリゴン (BuildingLod)
+        """
+        self.count = len(table)
+        self.centroids = np.asarray(table.centroids, dtype=np.float64)
+        self.radii = np.asarray(table.radii, dtype=np.float64)
+        self.grid = CentroidGrid(self.centroids, self.radii, cell_size=cell_size)
+        self.max_distance = max_distance
+        if max_height is None:
+            max_height = max(float(table.heights.max()), 1.0) if self.count else 1.0
+        self.max_height = max_height
+
+        # 現在表示しているビルの番号（昇順）
+        self.visible = np.arange(self.count)
+        self.drawn_count = self.count
+        self.culled_count = 0
+        # 表示しているビルの詳細度の段階（LOD がない場合は None）
+        self.lod = lod
+        self.levels = None if lod is None else lod.base_levels.copy()
+
+    def update(self, camera, lens_node, world_node):
+        """
+        カメラの位置と視錐台から表示するビルを選び直します。
+        表示するビルが変わった場合は True を返します（結果は visible, drawn_count, culled_count）。
+
+        camera: カメラの NodePath（位置の取得に使用）
+        lens_node: レンズを持つ NodePath（base.cam）
+        world_node: ビルの座標系のノード
+        """
+        camera_pos = camera.getPos(world_node)
+        frustum = lens_node.node().getLens().makeBounds()
+        frustum.xform(lens_node.getMat(world_node))
+        visible = self.query(camera_pos, frustum)
+
+        changed = not np.array_equal(visible, self.visible)
+        if self.lod is not None:
+            levels = self.lod_levels(camera_pos, visible)
+            changed = changed or not np.array_equal(levels, self.levels)
+            self.levels = levels
+        self.visible = visible
+        self.drawn_count = len(visible)
+        self.culled_count = self.count - len(visible)
+        return changed
+
+    def lod_levels(self, camera_pos, buildings):
+        """カメラからビル（包含円の最も近い点）までの距離で選んだ詳細度の段階"""
+        cx, cy = self.centroids[buildings].T
+        horizontal = np.maximum(np.hypot(cx - camera_pos.x, cy - camera_pos.y) - self.radii[buildings], 0)
+        return self.lod.levels_for_distances(np.hypot(horizontal, camera_pos.z))
+
+    def query(self, camera_pos, frustum):
+        """視錐台 (BoundingHexahedron) に入り、カメラから max_distance 以内のビルの番号（昇順）を返します。"""
+        # 視錐台を囲む矩形（距離の範囲があればその範囲と重ねる）
+        corners = np.array([tuple(frustum.getPoint(i)) for i in range(frustum.getNumPoints())])
+        x_min, y_min = corners[:, :2].min(axis=0)
+        x_max, y_max = corners[:, :2].max(axis=0)
+        if self.max_distance is not None:
+            x_min, x_max = max(x_min, camera_pos.x - self.max_distance), min(x_max, camera_pos.x + self.max_distance)
+            y_min, y_max = max(y_min, camera_pos.y - self.max_distance), min(y_max, camera_pos.y + self.max_distance)
+            if x_min > x_max or y_min > y_max:
+                return np.zeros(0, dtype=np.int64)
+        candidates = self.grid.query_bbox(x_min, y_min, x_max, y_max)
+        if not len(candidates):
+            return candidates
+
+        cx, cy = self.centroids[candidates].T
+        radii = self.radii[candidates]
+        inside = np.ones(len(candidates), dtype=bool)
+
+        # 各平面（法線は外向き）について、円柱の最も内側の点が平面の外にあれば視錐台の外
+        for i in range(frustum.getNumPlanes()):
+            a, b, c, d = frustum.getPlane(i)
+            nearest = a * cx + b * cy + d - radii * np.hypot(a, b) + min(0.0, c * self.max_height)
+            inside &= nearest <= 0
+
+        # 包含円までの水平距離
+        if self.max_distance is not None:
+            distances = np.hypot(cx - camera_pos.x, cy - camera_pos.y) - radii
+            inside &= distances <= self.max_distance
+
+        return np.sort(candidates[inside])
@@ -1,47 +1,235 @@
 from mapbox_vector_tile import decode
 import os
 import math
-from PIL import Image
+import numpy as np
 from .building import Building
+from .building_table import BuildingTable, BuildingTableBuilder
+from .batch_geometry import process_polygon_batch, polygon_bounds
+from .image_sampler import ImageColorSampler
+from .mvt_decoder import decode_polygons
+from .lod import BuildingLod, MAX_ZOOM, SLIVER_RATIO, LOD_LEVELS, LOD_STEP, zoom_tolerance
 # 必要なインポートを追加
 from shapely.geometry import Polygon, LinearRing, Point
 
+# タイルのローカル座標の範囲 (0〜4096)
+TILE_EXTENT = 4096
+# 画像がない場合のビルの色（白）
+DEFAULT_COLOR = (1.0, 1.0, 1.0, 1.0)
+# タイルごとに加算する DataLoader の統計情報（キャッシュにも保存し、読み込んだときに加算する）
+STAT_NAMES = ('vertex_count', 'simplified_vertex_count', 'all_building_count',
+              'rect_building_count', 'not_rect_building_count')
+
 
 class DataLoader:
+    # 簡略化の度合い（値が大きいほど頂点数が減少）。None の場合はズームレベルと画面上の誤差から決める
+    # （building.lod.zoom_tolerance を参照）
+    SIMPLIFY_TOLERANCE = None
+    # 処理結果が変わる変更をしたら上げる（キャッシュのキーに使用）
+    LOADER_VERSION = 4
+
     vertex_count = 0
     simplified_vertex_count = 0
     all_building_count = 0
     rect_building_count = 0
     not_rect_building_count = 0
 
-    def __init__(self, z, x, y, image_path):
+    def __init__(self, z, x, y, image_path, color_bounds=(0, 0, TILE_EXTENT, TILE_EXTENT), cache=None,
+                 color_sampling='nearest', archive=None, lod=False, vertex_budget=None):
+        """
+        lod: True にすると、ビルごとの複数の詳細度のポリゴン (BuildingLod) も作り、self.lod に保持します
+        vertex_budget: タイルの描画する頂点数の上限。超える場合は頂点が多く減るビルから粗い詳細度にします
+        """
         self.z = z
         self.x = x
         self.y = y
-        self.flag_image = Image.open(image_path)
-        self.image_width, self.image_height = self.flag_image.size
-
-    def load_building_list(self):
         # PBFファイルのパス
-        pbf_file = f'{self.z}/{self.x}/{self.y}.pbf'
+        self.pbf_file = f'{z}/{x}/{y}.pbf'
+        # 画像を対応させる座標範囲 (x_min, y_min, x_max, y_max)
+        self.color_bounds = color_bounds
+        # image_path が None の場合は色を付けない（デフォルトの白）
+        # 画像の取り出し方 color_sampling は 'nearest', 'bilinear', 'area'（ImageColorSampler を参照）
+        self.sampler = ImageColorSampler(image_path, color_bounds, color_sampling) if image_path else None
+        # 処理済みタイルのキャッシュ (TileCache)
+        self.cache = cache
+        # pbf をファイルではなくアーカイブ (TileArchive) から読む場合
+        self.archive = archive
+        self.use_lod = lod
+        self.vertex_budget = vertex_budget
+        # 読み込んだビルの詳細度ごとのポリゴン（lod=True か vertex_budget を指定した場合）
+        self.lod = None
+
+    @staticmethod
+    def simplify_tolerance(z):
+        """ズームレベル z のタイルの簡略化の許容誤差"""
+        if DataLoader.SIMPLIFY_TOLERANCE is not None:
+            return DataLoader.SIMPLIFY_TOLERANCE
+        return zoom_tolerance(z, TILE_EXTENT)
+
+    def simplify_key(self):
+        """簡略化の設定を表す文字列（キャッシュのキーに使用）"""
+        key = f'{DataLoader.simplify_tolerance(self.z)}|{SLIVER_RATIO}'
+        if self.use_lod or self.vertex_budget is not None:
+            key += f'|lod={self.use_lod}|{LOD_LEVELS}x{LOD_STEP}|{self.vertex_budget}'
+        return key
+
+    def tile_exists(self):
+        if self.archive is not None:
+            return (self.z, self.x, self.y) in self.archive
+        return os.path.isfile(self.pbf_file)
+
+    def read_tile(self):
+        """
+        pbf のバイト列を返します（ない場合は None）。
+        アーカイブから読む場合はメモリマップの memoryview で、データはコピーしません。
+        """
+        if self.archive is not None:
+            data = self.archive.get(self.z, self.x, self.y)
+            if data is None:
+                print(f"Tile not found in {self.archive.path}: {self.z}/{self.x}/{self.y}")
+            return data
 
         # ファイルの存在確認
-        if not os.path.isfile(pbf_file):
-            print(f"PBF file not found: {pbf_file}")
-            return []
+        if not os.path.isfile(self.pbf_file):
+            print(f"PBF file not found: {self.pbf_file}")
+            return None
 
-        building_list = []
+        with open(self.pbf_file, 'rb') as f:
+            return f.read()
 
+    def load_building_list(self):
+        """
+        ビルのリストを返します。
+        要素は BuildingTable の行ビューで、Building と同じ属性で参照できます。
+        """
+        return list(self.load_building_table())
+
+    def load_building_table(self, batch=True):
+        """
+        タイル内の全ビルを BuildingTable として読み込みます。
+        batch=True の場合はタイル内の全ポリゴンをまとめて処理します。
+        キャッシュがある場合は、デコードと簡略化を行わずにキャッシュから読み込みます。
+        """
+        cache_key = None
+        if self.cache is not None and self.tile_exists():
+            source = self.archive.tile_key(self.z, self.x, self.y) if self.archive is not None else None
+            cache_key = self.cache.cache_key(self.z, self.x, self.y, self.pbf_file,
+                                             self.simplify_key(), DataLoader.LOADER_VERSION, source)
+            arrays = self.cache.get(self.z, self.x, self.y, cache_key)
+            if arrays is not None:
+                # 処理したときの統計情報を加算する
+                stats = arrays.pop('loader_stats', None)
+                if stats is not None:
+                    for name, value in zip(STAT_NAMES, stats.tolist()):
+                        setattr(DataLoader, name, getattr(DataLoader, name) + value)
+                self.lod = BuildingLod.from_arrays(arrays)
+                # 色は画像に依存するのでキャッシュせず、読み込み時に付ける
+                return BuildingTable(colors=self.get_table_colors(arrays), **arrays)
+
+        before = [getattr(DataLoader, name) for name in STAT_NAMES]
+        if batch:
+            table = self.load_building_table_batch()
+        else:
+            builder = BuildingTableBuilder()
+            tolerance = DataLoader.simplify_tolerance(self.z)
+            for id_value, coordinates, height in self.iter_polygons():
+                simplified_coords, centroid, radius, rect_params = \
+                    DataLoader.process_coordinates(coordinates, tolerance)
+                builder.append(id_value, height, simplified_coords, centroid, radius, rect_params, DEFAULT_COLOR)
+            table = builder.build()
+            # ビルの重心（と範囲）から色をまとめて取得
+            table.colors[:] = self.get_table_colors(table.arrays())
+
+        if cache_key is not None:
+            arrays = table.arrays()
+            del arrays['colors']
+            if self.lod is not None:
+                arrays.update(self.lod.arrays())
+            arrays['loader_stats'] = np.array([getattr(DataLoader, name) - value
+                                               for name, value in zip(STAT_NAMES, before)], dtype=np.int64)
+            self.cache.put(self.z, self.x, self.y, cache_key, arrays)
+
+        return table
+
+    def load_building_table_batch(self):
+        """
+        process_coordinates をタイル単位でまとめて行うバッチ版の読み込み。
+        pbf は mvt_decoder で直接配列にデコードします。
+        lod=True か vertex_budget を指定した場合は BuildingLod を作り、ビルのポリゴンは基本の詳細度にします。
+        """
+        polygons = self.decode_polygons()
+        if polygons is None or polygons.polygon_count == 0:
+            return BuildingTable.empty()
+
+        # 外周と穴のリングを使用
+        tolerance = DataLoader.simplify_tolerance(self.z)
+        result = process_polygon_batch(polygons.vertices, polygons.ring_offsets, tolerance,
+                                       polygon_offsets=polygons.polygon_offsets, sliver_ratio=SLIVER_RATIO)
+        table = self.build_table(polygons.polygon_ids(), polygons.polygon_heights(), result)
+        if not self.use_lod and self.vertex_budget is None:
+            return table
+
+        self.lod = BuildingLod.build(table, tolerance, vertex_budget=self.vertex_budget)
+        base_table = self.lod.base_table(table)
+        # 予算で粗くした分を簡略化後の頂点数に反映
+        DataLoader.simplified_vertex_count += \
+            int(DataLoader.exterior_lengths(base_table).sum() - DataLoader.exterior_lengths(table).sum())
+        return base_table
+
+    @staticmethod
+    def exterior_lengths(table):
+        """各ビルの外周の頂点数"""
+        return np.diff(table.ring_offsets)[table.polygon_offsets[:-1]]
+
+    def decode_polygons(self):
+        """
+        'bldg' レイヤーのポリゴンを PolygonArrays としてデコードします。
+        ファイルやレイヤーがない場合は None を返します。
+        """
+        data = self.read_tile()
+        if data is None:
+            return None
+
+        polygons = decode_polygons(data, 'bldg')
+        if polygons is None:
+            print("The 'bldg' layer is not available in this tile.")
+        return polygons
+
+    def build_table(self, ids, heights, result):
+        """
+        process_polygon_batch の結果から BuildingTable を作成します。
+        """
+        centroids = result['centroids']
+        colors = self.get_table_colors(result)
+
+        # 統計情報を記録
+        rect_count = int(np.count_nonzero(~np.isnan(result['rect_width'])))
+        DataLoader.vertex_count += result['vertex_count']
+        DataLoader.simplified_vertex_count += result['simplified_vertex_count']
+        DataLoader.rect_building_count += rect_count
+        DataLoader.not_rect_building_count += len(ids) - rect_count
+        DataLoader.all_building_count += len(ids)
+
+        return BuildingTable(ids, heights, result['vertices'], result['ring_offsets'],
+                             result['polygon_offsets'], centroids, result['radii'],
+                             result['rect_width'], result['rect_height'], result['rect_angle'],
+                             colors)
+
+    def iter_polygons(self):
+        """
+        タイル内のポリゴンを (id, coordinates, height) の形で順に返します。
+        MultiPolygon は同じ id を持つ複数のポリゴンに分割されます。
+        """
         # PBFファイルの読み込み
-        with open(pbf_file, 'rb') as f:
-            data = f.read()
-            tile = decode(data)
+        data = self.read_tile()
+        if data is None:
+            return
+        tile = decode(bytes(data))
 
         # レイヤーの取得
         buildings = tile.get('bldg', {})
         if not buildings:
             print("The 'bldg' layer is not available in this tile.")
-            return []
+            return
 
         for feature in buildings.get('features', []):
             id_value = feature.get('id', None)
@@ -53,25 +241,19 @@ class DataLoader:
             # coordinates の深さを取得
             depth = DataLoader.get_list_depth(coordinates)
 
-            # Buildingインスタンスの作成
             if depth == 3:
-                building = self.instancing_building(id_value, coordinates, height)
-                building_list.append(building)
+                yield id_value, coordinates, height
             elif depth == 4:
                 # print(f"depth 4 coordinates len: {len(coordinates)}")
                 for coords in coordinates:
-                    building = self.instancing_building(id_value, coords, height)
-                    building_list.append(building)
+                    yield id_value, coords, height
             else:
                 print(f"Unexpected coordinates depth ({depth}) for building ID {id_value}")
-                # building = Building(id_value, height=height)
-
-        return building_list
 
     def instancing_building(self, id_value, coordinates, height):
         building = Building(id_value, coordinates=coordinates, height=height)
         simplified_coords, centroid, radius, rect_params = \
-            DataLoader.process_coordinates(building.coordinates)
+            DataLoader.process_coordinates(building.coordinates, DataLoader.simplify_tolerance(self.z))
         building.simplified_coordinates = simplified_coords
         building.centroid = centroid
         building.bounding_circle_radius = radius
@@ -84,61 +266,73 @@ class DataLoader:
 
         return building
 
+    def get_colors(self, centroids, bounds=None):
+        """
+        重心座標の配列 (N, 2) から各ビルの色 (N, 4) をまとめて取得します。
+        bounds: color_sampling='area' で平均する各ビルの範囲 (N, 4)
+        """
+        centroids = np.asarray(centroids).reshape(-1, 2)
+        if self.sampler is None:
+            return np.tile(np.asarray(DEFAULT_COLOR, dtype=np.float32), (len(centroids), 1))
+        return self.sampler.sample(centroids, bounds)
+
+    def get_table_colors(self, arrays, part_offsets=None):
+        """
+        BuildingTable の配列（centroids, vertices, ring_offsets, polygon_offsets）から各ビルの色を取得します。
+        part_offsets（building.stitching.stitch_buildings の戻り値）を指定すると、1 つのビルの部分の行は
+        ビルごとに 1 回だけ（部分の範囲を合わせた範囲で）取り出した同じ色になります。
+        """
+        centroids = arrays['centroids']
+        bounds = None
+        if self.sampler is not None and self.sampler.sampling == 'area':
+            bounds = polygon_bounds(arrays['vertices'], arrays['ring_offsets'], arrays['polygon_offsets'])
+        if part_offsets is None:
+            return self.get_colors(centroids, bounds)
+
+        # 部分は重心を共有しているので、最初の部分の重心と部分の範囲の和で取り出す
+        starts = part_offsets[:-1]
+        if bounds is not None:
+            bounds = np.concatenate([np.minimum.reduceat(bounds[:, :2], starts),
+                                     np.maximum.reduceat(bounds[:, 2:], starts)], axis=1)
+        colors = self.get_colors(np.asarray(centroids)[starts], bounds)
+        return np.repeat(colors, np.diff(part_offsets), axis=0)
+
     def get_color_from_image(self, x, y):
         """
         ビルの重心座標（x, y）から画像の対応する色を取得します。
         座標系は左下が原点で、画像の左下が原点であると仮定します。
         """
-        # 例：ビルの座標範囲を取得し、画像のサイズにマッピングする
-        x_min, x_max = 0, 4096
-        y_min, y_max = 0, 4096
-
-        # 座標をピクセル座標にマッピング
-        pixel_x = int((x - x_min) / (x_max - x_min) * self.image_width)
-        pixel_y = int((y - y_min) / (y_max - y_min) * self.image_height)
-
-        # 画像の範囲内に収まるように調整
-        pixel_x = max(0, min(self.image_width - 1, pixel_x))
-        pixel_y = max(0, min(self.image_height - 1, pixel_y))
-
-        # 画像のY軸は上が0なので、上下反転する必要がある
-        pixel_y = self.image_height - pixel_y - 1
-
-        # ピクセルの色を取得
-        color = self.flag_image.getpixel((pixel_x, pixel_y))
-
-        # RGBA値を0〜1の範囲に正規化
-        if len(color) == 4:
-            r, g, b, a = color
-        else:
-            r, g, b = color
-            a = 255
-
-        return r / 255.0, g / 255.0, b / 255.0, a / 255.0
+        if self.sampler is None:
+            return DEFAULT_COLOR
+        return tuple(self.get_colors([(x, y)])[0].tolist())
 
     @staticmethod
-    def process_coordinates(coords):
-        # シェイプリーのポリゴンを作成
+    def process_coordinates(coords, tolerance=None):
+        # シェイプリーのポリゴンを作成（coords[0] が外周、残りが穴）
         linear_ring = LinearRing(coords[0])
-        polygon = Polygon(linear_ring)
+        polygon = Polygon(linear_ring, [LinearRing(ring) for ring in coords[1:]])
 
         # 簡略化の度合いを設定（値が大きいほど頂点数が減少）
-        tolerance = 30  # 必要に応じて調整
+        if tolerance is None:
+            tolerance = DataLoader.simplify_tolerance(MAX_ZOOM)
+        # 小さいビルや細いビルが潰れないように、ビルの幅の SLIVER_RATIO 倍までに抑える
+        tolerance = min(tolerance, SLIVER_RATIO * 2 * polygon.area / max(polygon.length, 1e-12))
 
         # ポリゴンの簡略化
         # simplified_polygon = polygon
         simplified_polygon = polygon.simplify(tolerance, preserve_topology=True)
         # simplified_polygon = polygon.convex_hull
 
-        # 簡略化した座標を取得
+        # 簡略化した座標を取得（外周と穴）
         simplified_coords = [list(simplified_polygon.exterior.coords)]
+        simplified_coords += [list(interior.coords) for interior in simplified_polygon.interiors]
 
         # 重心の計算
         centroid = simplified_polygon.centroid
         centroid_coords = (centroid.x, centroid.y)
 
         # 包含円の半径を計算
-        all_points = [Point(pt) for pt in simplified_polygon.exterior.coords]
+        all_points = [Point(pt) for ring in simplified_coords for pt in ring]
         radius = DataLoader.calculate_bounding_circle_radius(all_points, centroid)
 
         # 元の頂点数と簡略化後の頂点数を記録
@@ -147,9 +341,10 @@ class DataLoader:
         DataLoader.vertex_count += len(polygon.exterior.coords)
         DataLoader.simplified_vertex_count += len(simplified_polygon.exterior.coords)
 
-        # 四辺形の場合、長方形パラメータを計算
+        # 穴のない四辺形の場合、長方形パラメータを計算
         rect_width = rect_height = rect_angle = None
-        if len(simplified_polygon.exterior.coords) == 5:  # 最後の点が閉じるため4つの頂点
+        # 最後の点が閉じるため4つの頂点
+        if len(simplified_polygon.exterior.coords) == 5 and not simplified_polygon.interiors:
             min_rect = simplified_polygon.minimum_rotated_rectangle
             rect_coords = list(min_rect.exterior.coords)
             # 最小外接長方形の4つの頂点
@@ -0,0 +1,140 @@
+import numpy as np
+from panda3d.core import Shader, PTA_float
+
+EQUALIZER_VERTEX_SHADER = """
+#version 150
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform float amplitude;
+uniform float wave_time;
+uniform vec4 wave_params;  // (速度, 高さのスケール, 基準の高さ, 最低の高さ)
+uniform samplerBuffer building_colors;
+in vec4 p3d_Vertex;
+in float building;
+in vec2 wave;  // (波の位相の基準値, 単位の高さ)
+out vec4 vertex_color;
+
+void main() {
+    float height = max(amplitude * sin(wave.x - wave_params.x * wave_time) * wave_params.y + wave_params.z,
+                       wave_params.w);
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(p3d_Vertex.xy, wave.y * height, 1.0);
+    vertex_color = texelFetch(building_colors, int(building));
+}
+"""
+
+EQUALIZER_FRAGMENT_SHADER = """
+#version 150
+in vec4 vertex_color;
+out vec4 p3d_FragColor;
+
+void main() {
+    p3d_FragColor = vertex_color;
+}
+"""
+
+# スペクトルモードで使える帯域の数の上限（シェーダーのユニフォーム配列の大きさ）
+MAX_SPECTRUM_BANDS = 64
+
+SPECTRUM_VERTEX_SHADER = """
+#version 150
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform float band_heights[64];
+uniform samplerBuffer building_colors;
+in vec4 p3d_Vertex;
+in float building;
+in vec2 wave;  // (帯域の番号, 単位の高さ)
+out vec4 vertex_color;
+
+void main() {
+    float height = band_heights[int(wave.x)];
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(p3d_Vertex.xy, wave.y * height, 1.0);
+    vertex_color = texelFetch(building_colors, int(building));
+}
+"""
+
+
+class EqualizerShader:
+    """
+    イコライザーの波のアニメーションを頂点シェーダーで行います。
+
+    ビルごとの波の位相の基準値 (WaveAnimator.phase_bases) は最初に一度だけ頂点属性に書き込み、
+    毎回の更新では振幅と時間のユニフォームを設定するだけなので、CPU の負荷はビル数によらず一定です。
+    高さは WaveAnimator.heights と同じ式で計算します。
+    """
+
+    def __init__(self, wave_animator, batched_buildings=None, instanced_boxes=None):
+        self.wave_animator = wave_animator
+        self.batched_buildings = batched_buildings
+        self.instanced_boxes = instanced_boxes
+        self.wave_params = (wave_animator.wave_speed, wave_animator.wave_height_scale,
+                            wave_animator.base_height, wave_animator.min_height)
+        max_height = wave_animator.max_height
+
+        # シェーダーが設定されるノード
+        self.nodes = []
+        if batched_buildings is not None:
+            batched_buildings.set_phase_bases(wave_animator.phase_bases)
+            # 頂点の z を最大の高さにして、バウンディングボックスが波の高さ全体を含むようにする
+            batched_buildings.set_heights(np.full(len(wave_animator), max_height, dtype=np.float32))
+            shader = Shader.make(Shader.SL_GLSL, EQUALIZER_VERTEX_SHADER, EQUALIZER_FRAGMENT_SHADER)
+            batched_buildings.node.setShader(shader)
+            self.nodes.append(batched_buildings.node)
+        if instanced_boxes is not None:
+            instanced_boxes.set_phase_bases(wave_animator.phase_bases)
+            instanced_boxes.update_bounds(max_height=max_height)
+            instanced_boxes.node.setShaderInput('wave_enabled', 1.0)
+            self.nodes.append(instanced_boxes.node)
+
+        for node in self.nodes:
+            node.setShaderInput('wave_params', self.wave_params)
+        self.update(0.0, 0.0)
+
+    def update(self, amplitude, current_time):
+        """振幅 (0〜1) と現在の時間をシェーダーに渡します。"""
+        for node in self.nodes:
+            node.setShaderInput('amplitude', float(amplitude))
+            node.setShaderInput('wave_time', float(current_time))
+
+
+class SpectrumShader:
+    """
+    スペクトルモード（帯域ごとの強さで場所ごとのビルの高さを変える）を頂点シェーダーで行います。
+
+    ビルの帯域の番号 (SpectrumAnimator.phase_bases) は最初に一度だけ頂点属性に書き込み、
+    毎回の更新では帯域ごとの高さ（帯域の数だけの配列）をユニフォームに設定するだけです。
+    """
+
+    def __init__(self, spectrum_animator, batched_buildings=None, instanced_boxes=None):
+        if spectrum_animator.band_count > MAX_SPECTRUM_BANDS:
+            raise ValueError(f"Too many spectrum bands: {spectrum_animator.band_count} (max {MAX_SPECTRUM_BANDS})")
+        self.spectrum_animator = spectrum_animator
+        self.batched_buildings = batched_buildings
+        self.instanced_boxes = instanced_boxes
+        max_height = spectrum_animator.max_height
+        # ユニフォームの配列（update で書き換える）
+        self.band_heights = PTA_float.emptyArray(MAX_SPECTRUM_BANDS)
+
+        # シェーダーが設定されるノード
+        self.nodes = []
+        if batched_buildings is not None:
+            batched_buildings.set_phase_bases(spectrum_animator.phase_bases)
+            # 頂点の z を最大の高さにして、バウンディングボックスが高さの範囲全体を含むようにする
+            batched_buildings.set_heights(np.full(len(spectrum_animator), max_height, dtype=np.float32))
+            shader = Shader.make(Shader.SL_GLSL, SPECTRUM_VERTEX_SHADER, EQUALIZER_FRAGMENT_SHADER)
+            batched_buildings.node.setShader(shader)
+            self.nodes.append(batched_buildings.node)
+        if instanced_boxes is not None:
+            instanced_boxes.set_phase_bases(spectrum_animator.phase_bases)
+            instanced_boxes.update_bounds(max_height=max_height)
+            instanced_boxes.node.setShaderInput('spectrum_enabled', 1.0)
+            self.nodes.append(instanced_boxes.node)
+
+        for node in self.nodes:
+            node.setShaderInput('band_heights', self.band_heights)
+        self.update(np.zeros(spectrum_animator.band_count, dtype=np.float32))
+
+    def update(self, levels):
+        """帯域ごとの強さ (0〜1) から帯域ごとの高さを計算してシェーダーに渡します。"""
+        heights = self.spectrum_animator.band_heights(levels)
+        np.frombuffer(memoryview(self.band_heights), dtype=np.float32)[:len(heights)] = heights
+        for node in self.nodes:
+            node.setShaderInput('band_heights', self.band_heights)
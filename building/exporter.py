@@ -0,0 +1,308 @@
+import os
+import json
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from .data_loader import DataLoader
+from .geo_transform import extent_to_lonlat
+from .tile_archive import find_tile_files, hilbert_tile_id
+from .triangulate import make_polygons
+
+# 出力の形式
+EXPORT_FORMATS = ('parquet', 'arrow', 'ndjson')
+# 出力の座標系: 'lonlat' は経度・緯度 (OGC:CRS84)、'tile' はタイルのローカル座標 (0〜extent、y は上向き)
+COORDINATE_SYSTEMS = ('lonlat', 'tile')
+# 出力する列
+COLUMNS = ('id', 'height', 'tile_z', 'tile_x', 'tile_y', 'geometry')
+# ファイルに書き込むまでためる行数（Parquet の行グループ、Arrow のレコードバッチの大きさ）
+BATCH_ROWS = 65536
+# 1 つのファイルの行数の上限（超えると同じパーティションの次のファイルに書く）
+MAX_ROWS_PER_FILE = 1 << 20
+
+
+def _pyarrow():
+    # pyarrow はオプションの依存パッケージなので、Parquet / Arrow で書き出す場合だけ読み込む
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("parquet and arrow output require the 'pyarrow' package (pip install pyarrow); "
+                          "use format='ndjson' otherwise") from None
+    return pyarrow
+
+
+def tile_columns(tile, archive=None, crs='lonlat', clip=False):
+    """
+    1 タイルのビルを列の辞書（COLUMNS）として返します。1 行が 1 つのフィーチャで、
+    複数のポリゴンを持つフィーチャは MultiPolygon です。geometry は WKB の bytes のオブジェクト配列です。
+
+    タイルはバッファを含むので、タイルの境界にかかるビルは隣のタイルにも出力されます（tile_* と id で区別できます）。
+    clip=True の場合はタイルの範囲で切り取り、範囲外の部分を出力しません。
+    """
+    z, x, y = tile
+    polygons = DataLoader(z, x, y, None, archive=archive).decode_polygons()
+    if polygons is None or polygons.polygon_count == 0:
+        return empty_columns()
+
+    vertices = polygons.vertices.astype(np.float64)
+    if crs == 'lonlat' and not clip:
+        vertices = extent_to_lonlat(vertices, z, x, y, polygons.extent)
+    geometries = make_polygons(vertices, polygons.ring_offsets, polygons.polygon_offsets,
+                               np.arange(polygons.polygon_count))
+
+    # ポリゴンが 2 つ以上のフィーチャは MultiPolygon にまとめる
+    counts = np.diff(polygons.feature_offsets)
+    features = np.flatnonzero(counts > 0)
+    feature_geometries = geometries[polygons.feature_offsets[features]]
+    multi = counts[features] > 1
+    if multi.any():
+        polygon_feature = np.repeat(np.arange(len(counts)), counts)
+        is_multi = np.repeat(counts > 1, counts)
+        _, multi_index = np.unique(polygon_feature[is_multi], return_inverse=True)
+        feature_geometries[multi] = shapely.multipolygons(geometries[is_multi], indices=multi_index)
+
+    if clip:
+        feature_geometries = shapely.clip_by_rect(feature_geometries, 0, 0, polygons.extent, polygons.extent)
+        keep = ~shapely.is_empty(feature_geometries)
+        features, feature_geometries = features[keep], feature_geometries[keep]
+        if crs == 'lonlat':
+            feature_geometries = shapely.transform(
+                feature_geometries, lambda points: extent_to_lonlat(points, z, x, y, polygons.extent))
+
+    return {
+        'id': polygons.ids[features],
+        'height': np.asarray(polygons.heights, dtype=np.float64)[features],
+        'tile_z': np.full(len(features), z, dtype=np.int32),
+        'tile_x': np.full(len(features), x, dtype=np.int32),
+        'tile_y': np.full(len(features), y, dtype=np.int32),
+        'geometry': shapely.to_wkb(feature_geometries),
+    }
+
+
+def empty_columns():
+    return {
+        'id': np.zeros(0, dtype=np.int64),
+        'height': np.zeros(0, dtype=np.float64),
+        'tile_z': np.zeros(0, dtype=np.int32),
+        'tile_x': np.zeros(0, dtype=np.int32),
+        'tile_y': np.zeros(0, dtype=np.int32),
+        'geometry': np.empty(0, dtype=object),
+    }
+
+
+def concatenate_columns(batches):
+    if not batches:
+        return empty_columns()
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in COLUMNS}
+
+
+def partition_key(tile, partition_zoom=None):
+    """タイルのパーティションのディレクトリ名（partition_zoom の祖先のタイルごと、None ならズームレベルごと）"""
+    z, x, y = tile
+    if partition_zoom is None or partition_zoom >= z:
+        return f'zoom={z}'
+    shift = z - partition_zoom
+    return os.path.join(f'zoom={z}', f'partition={partition_zoom}-{x >> shift}-{y >> shift}')
+
+
+def geo_metadata(crs):
+    """GeoParquet 1.0 の geo メタデータ（crs を省略した場合は OGC:CRS84）"""
+    column = {'encoding': 'WKB', 'geometry_types': ['Polygon', 'MultiPolygon']}
+    if crs == 'tile':
+        # タイルのローカル座標は地理座標系ではない
+        column['crs'] = None
+    return {'version': '1.0.0', 'primary_column': 'geometry', 'columns': {'geometry': column}}
+
+
+class NdjsonFileWriter:
+    """1 行が 1 つのビルの JSON（geometry は 16 進数の WKB）のファイルに書き込みます。"""
+    extension = '.ndjson'
+
+    def __init__(self, path, crs):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, columns):
+        ids, heights = columns['id'].tolist(), columns['height'].tolist()
+        tile_z, tile_x, tile_y = columns['tile_z'].tolist(), columns['tile_x'].tolist(), columns['tile_y'].tolist()
+        lines = [json.dumps({'id': ids[i], 'height': heights[i], 'tile_z': tile_z[i], 'tile_x': tile_x[i],
+                             'tile_y': tile_y[i], 'geometry': columns['geometry'][i].hex()}) + '\n'
+                 for i in range(len(ids))]
+        self.file.writelines(lines)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowFileWriter:
+    """Arrow IPC (Feather v2) のファイルに、列をレコードバッチとして書き込みます。"""
+    extension = '.arrow'
+
+    def __init__(self, path, crs):
+        pa = _pyarrow()
+        self.schema = ArrowFileWriter.make_schema(crs)
+        self.writer = pa.ipc.new_file(path, self.schema)
+
+    @staticmethod
+    def make_schema(crs):
+        pa = _pyarrow()
+        return pa.schema([('id', pa.int64()), ('height', pa.float64()), ('tile_z', pa.int32()),
+                          ('tile_x', pa.int32()), ('tile_y', pa.int32()), ('geometry', pa.binary())],
+                         metadata={b'geo': json.dumps(geo_metadata(crs)).encode('utf-8')})
+
+    def to_table(self, columns):
+        pa = _pyarrow()
+        return pa.Table.from_arrays([pa.array(columns[name], type=self.schema.field(name).type)
+                                     for name in COLUMNS], schema=self.schema)
+
+    def write(self, columns):
+        self.writer.write_table(self.to_table(columns))
+
+    def close(self):
+        self.writer.close()
+
+
+class ParquetFileWriter(ArrowFileWriter):
+    """GeoParquet のファイルに、列を行グループとして書き込みます。"""
+    extension = '.parquet'
+
+    def __init__(self, path, crs, compression='zstd'):
+        pa = _pyarrow()
+        self.schema = ArrowFileWriter.make_schema(crs)
+        self.writer = pa.parquet.ParquetWriter(path, self.schema, compression=compression)
+
+    def write(self, columns):
+        self.writer.write_table(self.to_table(columns), row_group_size=BATCH_ROWS)
+
+
+FILE_WRITERS = {'parquet': ParquetFileWriter, 'arrow': ArrowFileWriter, 'ndjson': NdjsonFileWriter}
+
+
+class PartitionedWriter:
+    """
+    パーティションごとのディレクトリに part-00000.parquet のようなファイルを書き込みます。
+
+    行は BATCH_ROWS 行たまるごとに書き込み、1 つのファイルが MAX_ROWS_PER_FILE 行を超えると次のファイルにします。
+    パーティションが変わると前のパーティションのファイルを閉じるので、開いているファイルは常に 1 つです
+    （パーティションの順にタイルを渡してください）。
+    """
+
+    def __init__(self, output_dir, file_format='parquet', crs='lonlat', batch_rows=BATCH_ROWS,
+                 max_rows_per_file=MAX_ROWS_PER_FILE):
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {file_format} (available: {', '.join(EXPORT_FORMATS)})")
+        self.output_dir = output_dir
+        self.writer_class = FILE_WRITERS[file_format]
+        self.crs = crs
+        self.batch_rows = batch_rows
+        self.max_rows_per_file = max_rows_per_file
+        self.partition = None
+        self.file = None
+        self.file_rows = 0
+        self.file_index = 0
+        self.pending = []
+        self.pending_rows = 0
+        # 書き込んだファイルのパスと行数
+        self.files = []
+        self.row_count = 0
+
+    def write(self, partition, columns):
+        if partition != self.partition:
+            self.close()
+            self.partition = partition
+            self.file_index = 0
+        if len(columns['id']):
+            self.pending.append(columns)
+            self.pending_rows += len(columns['id'])
+        if self.pending_rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """ためた行をファイルに書き込みます。"""
+        if not self.pending_rows:
+            return
+        columns = concatenate_columns(self.pending)
+        self.pending, self.pending_rows = [], 0
+        start = 0
+        while start < len(columns['id']):
+            if self.file is None or self.file_rows >= self.max_rows_per_file:
+                self.open_next_file()
+            end = min(len(columns['id']), start + self.max_rows_per_file - self.file_rows)
+            self.file.write({name: values[start:end] for name, values in columns.items()})
+            self.file_rows += end - start
+            self.files[-1][1] += end - start
+            self.row_count += end - start
+            start = end
+
+    def open_next_file(self):
+        if self.file is not None:
+            self.file.close()
+        directory = os.path.join(self.output_dir, self.partition)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'part-{self.file_index:05d}{self.writer_class.extension}')
+        self.file = self.writer_class(path, self.crs)
+        self.file_rows = 0
+        self.file_index += 1
+        self.files.append([path, 0])
+
+    def close(self):
+        """ためた行を書き込み、開いているファイルを閉じます。"""
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def find_export_tiles(zoom, archive=None, root='.'):
+    """ズームレベル zoom の全タイル（アーカイブを指定した場合はアーカイブのタイル）"""
+    if archive is not None:
+        return archive.tiles(zoom)
+    return [tile for tile, _ in find_tile_files(root, [zoom])]
+
+
+def iter_tile_columns(tiles, max_workers=None, max_pending=None, **options):
+    """
+    tiles の順に (タイル, 列の辞書) を返します。タイルはプロセスプールで並列に処理し、
+    処理中と受け取り待ちのタイルを max_pending 個（省略時はワーカー数の 4 倍）までにしてメモリを抑えます。
+    """
+    load = functools.partial(tile_columns, **options)
+    if max_workers == 1:
+        for tile in tiles:
+            yield tile, load(tile)
+        return
+
+    workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 4 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for tile in tiles:
+            pending.append((tile, executor.submit(load, tile)))
+            if len(pending) >= max_pending:
+                done_tile, future = pending.pop(0)
+                yield done_tile, future.result()
+        for done_tile, future in pending:
+            yield done_tile, future.result()
+
+
+def export_buildings(tiles, output_dir, file_format='parquet', crs='lonlat', clip=False, partition_zoom=None,
+                     archive=None, max_workers=None, batch_rows=BATCH_ROWS, max_rows_per_file=MAX_ROWS_PER_FILE):
+    """
+    tiles のビルを output_dir にパーティションに分けて書き出し、書き込んだ (パス, 行数) のリストを返します。
+
+    file_format: 'parquet'（GeoParquet）, 'arrow'（Arrow IPC）, 'ndjson'
+    crs: 'lonlat'（経度・緯度）か 'tile'（タイルのローカル座標）
+    clip: True にするとタイルの範囲で切り取る（タイルのバッファによる重複を除く）
+    partition_zoom: このズームレベルの祖先のタイルごとにディレクトリを分ける（None ならズームレベルごと）
+    """
+    if crs not in COORDINATE_SYSTEMS:
+        raise ValueError(f"Unknown coordinate system: {crs} (available: {', '.join(COORDINATE_SYSTEMS)})")
+    # パーティションの順（同じパーティションの中はヒルベルト曲線の順）に処理する
+    tiles = sorted(tiles, key=lambda tile: (partition_key(tile, partition_zoom), hilbert_tile_id(*tile)))
+    writer = PartitionedWriter(output_dir, file_format, crs, batch_rows, max_rows_per_file)
+    try:
+        for tile, columns in iter_tile_columns(tiles, max_workers, archive=archive, crs=crs, clip=clip):
+            writer.write(partition_key(tile, partition_zoom), columns)
+    finally:
+        writer.close()
+    return [tuple(entry) for entry in writer.files]
@@ -0,0 +1,86 @@
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_mb():
+    """プロセスの最大の常駐メモリ (MB)。取得できない環境では None。"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class FrameProfiler:
+    """
+    読み込みなどの段階ごとの時間と、フレームごとの更新・描画の時間、メモリを記録します。
+
+    段階は stage で囲んで計測し、フレームは frame_times に更新と描画の時間（秒）を追加します。
+    summary の結果は JSON にそのまま書き出せる辞書なので、ベンチマークの結果の比較に使えます。
+    """
+
+    def __init__(self, frame_count=0):
+        self.stages = {}
+        self.memory = {}
+        # フレームごとの (更新, 描画) の時間（秒）
+        self.frame_times = np.zeros((frame_count, 2), dtype=np.float64)
+        self.frame_count = 0
+
+    @contextmanager
+    def stage(self, name):
+        """with で囲んだ処理の時間を name の段階として記録し、終了時のメモリも記録します。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            self.memory[name] = peak_memory_mb()
+
+    def record_frame(self, update_time, draw_time):
+        if self.frame_count == len(self.frame_times):
+            self.frame_times = np.resize(self.frame_times, (max(self.frame_count * 2, 16), 2))
+        self.frame_times[self.frame_count] = (update_time, draw_time)
+        self.frame_count += 1
+
+    @staticmethod
+    def frame_summary(times):
+        """フレームの時間の配列（秒）の平均・中央値・95 パーセンタイル・最大（ミリ秒）"""
+        if not len(times):
+            return None
+        times = times * 1000
+        return {'mean_ms': float(times.mean()), 'p50_ms': float(np.percentile(times, 50)),
+                'p95_ms': float(np.percentile(times, 95)), 'max_ms': float(times.max())}
+
+    def summary(self):
+        times = self.frame_times[:self.frame_count]
+        return {
+            'stages_ms': {name: seconds * 1000 for name, seconds in self.stages.items()},
+            'frames': self.frame_count,
+            'update': FrameProfiler.frame_summary(times[:, 0]),
+            'draw': FrameProfiler.frame_summary(times[:, 1]),
+            'frame': FrameProfiler.frame_summary(times.sum(axis=1)),
+            'peak_memory_mb': self.memory,
+        }
+
+    def report(self):
+        """summary を読みやすい文字列にします。"""
+        summary = self.summary()
+        lines = [f"{name}: {ms:.1f} ms" for name, ms in summary['stages_ms'].items()]
+        for name in ('update', 'draw', 'frame'):
+            values = summary[name]
+            if values is not None:
+                lines.append(f"{name}: mean {values['mean_ms']:.2f} ms, p50 {values['p50_ms']:.2f} ms, "
+                             f"p95 {values['p95_ms']:.2f} ms, max {values['max_ms']:.2f} ms "
+                             f"({summary['frames']} frames)")
+        for name, mb in summary['peak_memory_mb'].items():
+            if mb is not None:
+                lines.append(f"peak memory after {name}: {mb:.1f} MB")
+        return '\n'.join(lines)
+
@@ -1,4 +1,5 @@
 from panda3d.core import GeomVertexFormat, GeomVertexData, GeomVertexWriter, GeomTriangles, Geom, GeomNode, NodePath
+from building.triangulate import triangulate_rings
 
 
 def create_box_geom(rect_params, color=(1, 1, 1, 1)):
@@ -67,17 +68,16 @@ def create_polygon_geom(coords_list, color=(1, 1, 1, 1)):
     vertex = GeomVertexWriter(vdata, 'vertex')
     color_writer = GeomVertexWriter(vdata, 'color')
 
-    # 頂点の追加
-    coords = coords_list[0]
-    for x, y in coords:
-        vertex.addData3f(x, y, 0)
-        color_writer.addData4f(*color)
+    # 頂点の追加（外周と穴の全リング）
+    for coords in coords_list:
+        for x, y in coords:
+            vertex.addData3f(x, y, 0)
+            color_writer.addData4f(*color)
 
-    # ポリゴンを構成するプリミティブの作成
+    # ポリゴンを構成するプリミティブの作成（穴を含めて三角形分割）
     tris = GeomTriangles(Geom.UHStatic)
-    num_vertices = len(coords)
-    for i in range(1, num_vertices - 1):
-        tris.addVertices(0, i, i + 1)
+    for i, j, k in triangulate_rings(coords_list).tolist():
+        tris.addVertices(i, j, k)
         tris.closePrimitive()
 
     # ジオメトリの作成
@@ -95,39 +95,36 @@ def create_side_geom(coords_list, color=(1, 1, 1, 1)):
     vertex = GeomVertexWriter(vdata, 'vertex')
     color_writer = GeomVertexWriter(vdata, 'color')
 
-    # 側面の作成
-    coords = coords_list[0]
-    num_vertices = len(coords)
-    # ポリゴンが閉じていない場合は、最初の頂点を末尾に追加
-    if coords[0] != coords[-1]:
-        print("Closing polygon")
-        coords.append(coords[0])
-    else:
-        print("Polygon is closed")
-
     idx = 0
     tris = GeomTriangles(Geom.UHStatic)
 
-    for i in range(num_vertices - 1):
-        x1, y1 = coords[i]
-        x2, y2 = coords[i + 1]
-
-        # 底面の頂点
-        vertex.addData3f(x1, y1, 0)
-        color_writer.addData4f(*color)
-        vertex.addData3f(x2, y2, 0)
-        color_writer.addData4f(*color)
-        # 上面の頂点
-        vertex.addData3f(x1, y1, 1)
-        color_writer.addData4f(*color)
-        vertex.addData3f(x2, y2, 1)
-        color_writer.addData4f(*color)
-
-        # 二つの三角形で四角形を構成
-        tris.addVertices(idx, idx + 2, idx + 1)
-        tris.addVertices(idx + 1, idx + 2, idx + 3)
-        tris.closePrimitive()
-        idx += 4
+    # 外周と穴の各リングについて側面を作成
+    for coords in coords_list:
+        num_vertices = len(coords)
+        # ポリゴンが閉じていない場合は、最初の頂点を末尾に追加
+        if coords[0] != coords[-1]:
+            coords.append(coords[0])
+
+        for i in range(num_vertices - 1):
+            x1, y1 = coords[i]
+            x2, y2 = coords[i + 1]
+
+            # 底面の頂点
+            vertex.addData3f(x1, y1, 0)
+            color_writer.addData4f(*color)
+            vertex.addData3f(x2, y2, 0)
+            color_writer.addData4f(*color)
+            # 上面の頂点
+            vertex.addData3f(x1, y1, 1)
+            color_writer.addData4f(*color)
+            vertex.addData3f(x2, y2, 1)
+            color_writer.addData4f(*color)
+
+            # 二つの三角形で四角形を構成
+            tris.addVertices(idx, idx + 2, idx + 1)
+            tris.addVertices(idx + 1, idx + 2, idx + 3)
+            tris.closePrimitive()
+            idx += 4
 
     geom = Geom(vdata)
     geom.addPrimitive(tris)
@@ -1,5 +1,8 @@
+import numpy as np
 from panda3d.core import GeomNode
 from building.geom_utils import create_box_geom, create_polygon_geom, create_side_geom
+from building.batched_buildings import BatchedBuildings
+from building.instanced_boxes import InstancedBoxes
 
 
 class GeometryGenerator:
@@ -60,3 +63,22 @@ class GeometryGenerator:
 
         # ビルノードの高さを設定
         building_node.setSz(height)
+
+    @staticmethod
+    def create_batched_buildings(parent_node, building_table, min_height=0, wireframe=False, include_rect=True,
+                                 lod=None):
+        """
+        BuildingTable の全ビルを少数の Geom にまとめて作成します。
+        ビルごとに NodePath を作らないので、ノード数と描画コール数が大幅に減ります。
+        lod (BuildingLod) を指定すると、全ての詳細度のポリゴンを持ち、描画時に切り替えられます。
+        """
+        return BatchedBuildings(building_table, parent_node, min_height=min_height, wireframe=wireframe,
+                                include_rect=include_rect, lod=lod)
+
+    @staticmethod
+    def create_instanced_rect_buildings(parent_node, building_table, min_height=0, wireframe=False):
+        """
+        長方形のビルを、共有の単位立方体のインスタンス描画で作成します。
+        """
+        indices = np.flatnonzero(building_table.is_rect & (building_table.heights >= min_height))
+        return InstancedBoxes(building_table, parent_node, indices=indices, wireframe=wireframe)
@@ -0,0 +1,129 @@
+import os
+import threading
+import numpy as np
+from PIL import Image
+
+# 色の取り出し方
+SAMPLING_MODES = ('nearest', 'bilinear', 'area')
+
+
+class ImageColorSampler:
+    """
+    画像を RGBA の float32 配列 (H, W, 4)（0〜1、行 0 が画像の下端）に変換し、
+    座標の配列から色をまとめて取り出します。
+
+    変換した配列はクラスで共有してキャッシュする（ファイルの更新時刻が変わるまで再利用）ので、
+    タイルごとにサンプラーを作っても、画像を切り替えて戻しても読み込みは 1 回だけです。
+
+    sampling:
+    - 'nearest': 座標のピクセルの色（従来の getpixel と同じ）
+    - 'bilinear': 周囲の 4 ピクセルを線形補間した色
+    - 'area': ビルの範囲 (x_min, y_min, x_max, y_max) に入るピクセルの平均（範囲がない場合は bilinear）
+    """
+
+    _images = {}  # (画像のパス, 更新時刻) -> RGBA 配列
+    _summed_areas = {}  # (画像のパス, 更新時刻) -> 累積和の配列 (H + 1, W + 1, 4)
+    _lock = threading.Lock()
+
+    def __init__(self, image_path, color_bounds, sampling='nearest'):
+        if sampling not in SAMPLING_MODES:
+            raise ValueError(f"unknown sampling: {sampling!r} (expected one of {SAMPLING_MODES})")
+        self.image_path = image_path
+        self.color_bounds = color_bounds
+        self.sampling = sampling
+        self._key = ImageColorSampler.cache_key(image_path)
+        self.image = ImageColorSampler.load_image(image_path)
+        self.height, self.width = self.image.shape[:2]
+
+    @staticmethod
+    def cache_key(image_path):
+        path = os.path.realpath(image_path)
+        return path, os.stat(path).st_mtime_ns
+
+    @classmethod
+    def load_image(cls, image_path):
+        """画像を RGBA の float32 配列に変換します（変換済みならキャッシュを返します）。"""
+        key = cls.cache_key(image_path)
+        with cls._lock:
+            image = cls._images.get(key)
+        if image is None:
+            with Image.open(image_path) as source:
+                pixels = np.asarray(source.convert('RGBA'), dtype=np.float32)
+            # 画像の Y 軸は上が 0 なので、行 0 が下端になるように上下反転する
+            image = np.ascontiguousarray(pixels[::-1] / 255.0)
+            image.flags.writeable = False
+            with cls._lock:
+                image = cls._images.setdefault(key, image)
+        return image
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._images.clear()
+            cls._summed_areas.clear()
+
+    def summed_area(self):
+        """画像の累積和 S[i, j] = image[:i, :j] の合計（area の平均に使用、画像ごとにキャッシュ）"""
+        with ImageColorSampler._lock:
+            table = ImageColorSampler._summed_areas.get(self._key)
+        if table is None:
+            table = np.zeros((self.height + 1, self.width + 1, 4), dtype=np.float64)
+            np.cumsum(np.cumsum(self.image, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+            with ImageColorSampler._lock:
+                table = ImageColorSampler._summed_areas.setdefault(self._key, table)
+        return table
+
+    def to_pixels(self, x, y):
+        """座標をピクセル単位の連続座標 (u, v) に変換します（左下が原点）。"""
+        x_min, y_min, x_max, y_max = self.color_bounds
+        u = (np.asarray(x, dtype=np.float64) - x_min) / (x_max - x_min) * self.width
+        v = (np.asarray(y, dtype=np.float64) - y_min) / (y_max - y_min) * self.height
+        return u, v
+
+    def sample(self, centroids, bounds=None):
+        """
+        重心座標の配列 (N, 2) から色の配列 (N, 4) を取り出します。
+        bounds: sampling='area' で使う各ビルの範囲 (N, 4)
+        """
+        centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        if self.sampling == 'area' and bounds is not None:
+            return self.sample_area(np.asarray(bounds, dtype=np.float64).reshape(-1, 4))
+        u, v = self.to_pixels(centroids[:, 0], centroids[:, 1])
+        if self.sampling == 'nearest':
+            return self.sample_nearest(u, v)
+        return self.sample_bilinear(u, v)
+
+    def sample_nearest(self, u, v):
+        columns = np.clip(np.trunc(u), 0, self.width - 1).astype(np.intp)
+        rows = np.clip(np.trunc(v), 0, self.height - 1).astype(np.intp)
+        return self.image[rows, columns]
+
+    def sample_bilinear(self, u, v):
+        # ピクセルの中心を格子点として補間（画像の外は端のピクセルの色）
+        u = np.clip(u - 0.5, 0, self.width - 1)
+        v = np.clip(v - 0.5, 0, self.height - 1)
+        c0 = np.minimum(np.floor(u).astype(np.intp), self.width - 2) if self.width > 1 else np.zeros(len(u), np.intp)
+        r0 = np.minimum(np.floor(v).astype(np.intp), self.height - 2) if self.height > 1 else np.zeros(len(v), np.intp)
+        c1 = np.minimum(c0 + 1, self.width - 1)
+        r1 = np.minimum(r0 + 1, self.height - 1)
+        fu = (u - c0)[:, None]
+        fv = (v - r0)[:, None]
+        image = self.image
+        bottom = image[r0, c0] * (1 - fu) + image[r0, c1] * fu
+        top = image[r1, c0] * (1 - fu) + image[r1, c1] * fu
+        return (bottom * (1 - fv) + top * fv).astype(np.float32)
+
+    def sample_area(self, bounds):
+        """範囲 (N, 4) に中心が入るピクセルの平均（入るピクセルがなければ最も近いピクセル）"""
+        u0, v0 = self.to_pixels(bounds[:, 0], bounds[:, 1])
+        u1, v1 = self.to_pixels(bounds[:, 2], bounds[:, 3])
+        c0 = np.clip(np.ceil(u0 - 0.5), 0, self.width - 1).astype(np.intp)
+        r0 = np.clip(np.ceil(v0 - 0.5), 0, self.height - 1).astype(np.intp)
+        c1 = np.clip(np.floor(u1 - 0.5), 0, self.width - 1).astype(np.intp)
+        r1 = np.clip(np.floor(v1 - 0.5), 0, self.height - 1).astype(np.intp)
+        c1, r1 = np.maximum(c1, c0), np.maximum(r1, r0)
+
+        table = self.summed_area()
+        total = (table[r1 + 1, c1 + 1] - table[r0, c1 + 1] - table[r1 + 1, c0] + table[r0, c0])
+        count = ((r1 - r0 + 1) * (c1 - c0 + 1))[:, None]
+        return (total / count).astype(np.float32)
@@ -0,0 +1,213 @@
+import numpy as np
+from panda3d.core import Texture, Shader, GeomEnums, BoundingBox, Point3, PTA_float
+from building.geom_utils import create_box_geom
+
+# インスタンス 1 つあたりのテクセル数
+# [重心 x, 重心 y, 幅, 奥行き], [cos(角度), sin(角度), 高さ, 波の位相の基準値], [r, g, b, a]
+TEXELS_PER_INSTANCE = 3
+
+INSTANCED_BOX_VERTEX_SHADER = """
+#version 150
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform samplerBuffer instance_data;
+// 波のアニメーション（EqualizerShader が設定する）
+uniform float wave_enabled;
+uniform float amplitude;
+uniform float wave_time;
+uniform vec4 wave_params;  // (速度, 高さのスケール, 基準の高さ, 最低の高さ)
+// スペクトルモード（SpectrumShader が設定する）。rotation.w は帯域の番号
+uniform float spectrum_enabled;
+uniform float band_heights[64];
+in vec4 p3d_Vertex;
+out vec4 instance_color;
+
+void main() {
+    int base = gl_InstanceID * 3;
+    vec4 placement = texelFetch(instance_data, base);
+    vec4 rotation = texelFetch(instance_data, base + 1);
+    instance_color = texelFetch(instance_data, base + 2);
+
+    float height = rotation.z;
+    if (spectrum_enabled > 0.5) {
+        height = band_heights[int(rotation.w)];
+    } else if (wave_enabled > 0.5) {
+        height = max(amplitude * sin(rotation.w - wave_params.x * wave_time) * wave_params.y + wave_params.z,
+                     wave_params.w);
+    }
+
+    // 単位の箱を拡大・回転して重心に移動し、高さを掛ける
+    vec2 local = p3d_Vertex.xy * placement.zw;
+    vec2 rotated = vec2(local.x * rotation.x - local.y * rotation.y,
+                        local.x * rotation.y + local.y * rotation.x);
+    vec4 position = vec4(rotated + placement.xy, p3d_Vertex.z * height, 1.0);
+    gl_Position = p3d_ModelViewProjectionMatrix * position;
+}
+"""
+
+INSTANCED_BOX_FRAGMENT_SHADER = """
+#version 150
+in vec4 instance_color;
+out vec4 p3d_FragColor;
+
+void main() {
+    p3d_FragColor = instance_color;
+}
+"""
+
+
+class InstancedBoxes:
+    """
+    長方形のビルを、共有の単位立方体 1 つとインスタンスデータのテーブルで描画します。
+
+    インスタンスデータ（重心、幅、奥行き、角度、高さ、色）はバッファテクスチャに入れて
+    頂点シェーダーで読むので、何万個の箱でも描画コールは 1 回です。
+    """
+
+    def __init__(self, table, parent_node, indices=None, wireframe=False):
+        """
+        table: BuildingTable
+        indices: 描画するビルの番号（省略時は長方形パラメータを持つ全ビル）
+        """
+        if indices is None:
+            indices = np.flatnonzero(table.is_rect)
+        self.table = table
+        self.indices = np.asarray(indices, dtype=np.int64)
+        count = len(self.indices)
+        # ビルの番号 -> インスタンスの番号（描画しないビルは -1）
+        self.slot_of = np.full(len(table), -1, dtype=np.int64)
+        self.slot_of[self.indices] = np.arange(count)
+        # 描画するインスタンスの番号（None の場合は全インスタンス）
+        self.visible_slots = None
+        # バウンディングボックスの高さ（None の場合はインスタンスの高さの最大値）
+        self.bounds_height = None
+
+        # 単位の箱（幅・奥行き 1、高さ 0〜1）を全インスタンスで共有
+        self.node = create_box_geom((1, 1))
+        self.node.setName('instanced_boxes')
+        self.node.reparentTo(parent_node)
+        self.node.setInstanceCount(count)
+
+        # 全インスタンスのデータ（描画するインスタンスだけをテクスチャに詰めて書き込む）
+        self.data = np.zeros((count, TEXELS_PER_INSTANCE, 4), dtype=np.float32)
+        angle = np.radians(table.rect_angle[self.indices])
+        self.data[:, 0, :2] = table.centroids[self.indices]
+        self.data[:, 0, 2] = table.rect_width[self.indices]
+        self.data[:, 0, 3] = table.rect_height[self.indices]
+        self.data[:, 1, 0] = np.cos(angle)
+        self.data[:, 1, 1] = np.sin(angle)
+        self.data[:, 1, 2] = table.heights[self.indices]
+        self.data[:, 2] = table.colors[self.indices]
+
+        # インスタンスデータのテーブル
+        self.texture = Texture('instance_data')
+        self.texture.setupBufferTexture(max(1, count * TEXELS_PER_INSTANCE), Texture.T_float,
+                                        Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.upload()
+
+        shader = Shader.make(Shader.SL_GLSL, INSTANCED_BOX_VERTEX_SHADER, INSTANCED_BOX_FRAGMENT_SHADER)
+        self.node.setShader(shader)
+        self.node.setShaderInput('instance_data', self.texture)
+        self.node.setShaderInput('wave_enabled', 0.0)
+        self.node.setShaderInput('amplitude', 0.0)
+        self.node.setShaderInput('wave_time', 0.0)
+        self.node.setShaderInput('wave_params', (0, 0, 0, 0))
+        self.node.setShaderInput('spectrum_enabled', 0.0)
+        self.node.setShaderInput('band_heights', PTA_float.emptyArray(64))
+
+        # 単位の箱のバウンディングボックスでは視錐台カリングされてしまうので、全インスタンスを含む範囲を設定
+        self.update_bounds()
+
+        if wireframe:
+            self.node.setRenderModeWireframe()
+            self.node.setTwoSided(True)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def instance_data(self):
+        """
+        テクスチャに書き込んだ描画中のインスタンスデータを (描画するインスタンス数, 3, 4) の float32 配列として参照します。
+        """
+        count = len(self.indices) if self.visible_slots is None else len(self.visible_slots)
+        ram_image = self.texture.modifyRamImage()
+        data = np.frombuffer(memoryview(ram_image), dtype=np.float32)
+        return data[:count * TEXELS_PER_INSTANCE * 4].reshape(-1, TEXELS_PER_INSTANCE, 4)
+
+    def upload(self, slots=None):
+        """
+        全インスタンスのデータのうち、描画するものをテクスチャに書き込みます。
+        slots を指定した場合は、そのインスタンスのうち描画中のものだけを書き込みます。
+        """
+        data = self.instance_data()
+        if self.visible_slots is None:
+            if slots is None:
+                data[:] = self.data
+            else:
+                data[slots] = self.data[slots]
+        elif slots is None:
+            data[:] = self.data[self.visible_slots]
+        elif len(self.visible_slots):
+            # 描画中のインスタンスのテクスチャ上の位置
+            positions = np.minimum(np.searchsorted(self.visible_slots, slots), len(self.visible_slots) - 1)
+            drawn = self.visible_slots[positions] == slots
+            data[positions[drawn]] = self.data[slots[drawn]]
+
+    def set_visible_buildings(self, buildings=None):
+        """
+        描画するビル（昇順のビルの番号）を設定します。描画するインスタンスだけをテクスチャに詰めて書き込みます。
+        None の場合は全インスタンスを描画します。
+        """
+        if buildings is None:
+            self.visible_slots = None
+        else:
+            slots = self.slot_of[np.asarray(buildings, dtype=np.int64)]
+            self.visible_slots = slots[slots >= 0]
+        self.node.setInstanceCount(len(self.indices) if self.visible_slots is None else len(self.visible_slots))
+        self.upload()
+        self.update_bounds()
+
+    def update_bounds(self, max_height=None):
+        """
+        描画中のインスタンスを含むバウンディングボックスを設定します。
+        max_height を指定した場合は、以後もその高さを使います（シェーダーで高さが変わる場合）。
+        """
+        if max_height is not None:
+            self.bounds_height = max_height
+        data = self.instance_data()
+        if not len(data):
+            return
+        radius = np.hypot(data[:, 0, 2], data[:, 0, 3]).max() / 2
+        x_min, y_min = data[:, 0, :2].min(axis=0) - radius
+        x_max, y_max = data[:, 0, :2].max(axis=0) + radius
+        height = self.bounds_height
+        if height is None:
+            height = max(float(data[:, 1, 2].max()), 1.0)
+        geom_node = self.node.node()
+        geom_node.setBounds(BoundingBox(Point3(x_min, y_min, 0), Point3(x_max, y_max, height)))
+        geom_node.setFinal(True)
+
+    def set_heights(self, heights, buildings=None):
+        """
+        全ビルの高さ（BuildingTable の行順）から、描画している箱の高さをまとめて更新します。
+        buildings（昇順のビルの番号）を指定した場合は、heights はそのビルの高さで、そのビルだけを更新します。
+        """
+        if buildings is None:
+            self.data[:, 1, 2] = np.asarray(heights)[self.indices]
+            self.upload()
+        else:
+            slots = self.slot_of[np.asarray(buildings, dtype=np.int64)]
+            is_box = slots >= 0
+            slots = slots[is_box]
+            self.data[slots, 1, 2] = np.asarray(heights)[is_box]
+            self.upload(slots)
+        self.update_bounds()
+
+    def set_phase_bases(self, phase_bases):
+        """全ビルの波の位相の基準値（BuildingTable の行順）を書き込みます（シェーダー用）。"""
+        self.data[:, 1, 3] = np.asarray(phase_bases)[self.indices]
+        self.upload()
+
+    def set_colors(self, colors):
+        """全ビルの色（BuildingTable の行順）から、描画している箱の色をまとめて更新します。"""
+        self.data[:, 2] = np.asarray(colors)[self.indices]
+        self.upload()
@@ -0,0 +1,223 @@
+import math
+import numpy as np
+import shapely
+from .building_table import BuildingTable
+from .batch_geometry import polygon_arrays, polygon_widths
+from .triangulate import make_polygons
+
+# 画面上で許容する簡略化の誤差（ピクセル）
+PIXEL_ERROR = 2.0
+# 既定のウインドウ（幅 1600 ピクセル、水平の画角 40 度）の焦点距離（ピクセル）
+FOCAL_PX = 800 / math.tan(math.radians(20))
+# 同梱のタイルの最大のズームレベル
+MAX_ZOOM = 16
+# TileStreamer が子のタイルに細分化する距離（タイルの大きさの倍数、TileStreamer の lod_factor）
+LOD_FACTOR = 2.0
+# 最大のズームレベルのタイルに近づける最も近い距離（タイルのローカル座標の単位）
+NEAR_DISTANCE = 2048
+# 詳細度の段階の数（最も粗い段階は向きのある外接矩形）と、1 段階ごとに許容誤差を何倍にするか
+LOD_LEVELS = 4
+LOD_STEP = 4.0
+# 許容誤差をビルの幅（polygon_widths）のこの割合までに抑える
+SLIVER_RATIO = 0.25
+
+
+def distance_tolerance(distance, pixel_error=PIXEL_ERROR, focal_px=FOCAL_PX):
+    """距離 distance から見たときに、画面上の誤差が pixel_error ピクセルになる許容誤差"""
+    return pixel_error * distance / focal_px
+
+
+def tolerance_distance(tolerance, pixel_error=PIXEL_ERROR, focal_px=FOCAL_PX):
+    """許容誤差 tolerance の簡略化の画面上の誤差が pixel_error ピクセル以下になる最も近い距離"""
+    return tolerance * focal_px / pixel_error
+
+
+def zoom_tolerance(z, tile_extent, pixel_error=PIXEL_ERROR, focal_px=FOCAL_PX):
+    """
+    ズームレベル z のタイルの簡略化の許容誤差（タイルのローカル座標の単位）。
+
+    TileStreamer は粗いズームのタイルを拡大して配置し、タイルの大きさの LOD_FACTOR 倍より近づくと
+    子のタイルに切り替えるので、MAX_ZOOM より粗いタイルはローカル座標で LOD_FACTOR × tile_extent より
+    近くでは表示されません。その距離（MAX_ZOOM のタイルは NEAR_DISTANCE）で画面上の誤差が
+    pixel_error ピクセルになる値を使います。
+    """
+    distance = NEAR_DISTANCE if z >= MAX_ZOOM else LOD_FACTOR * tile_extent
+    return distance_tolerance(distance, pixel_error, focal_px)
+
+
+def mesh_vertex_counts(vertex_counts, ring_counts, is_rect):
+    """
+    ポリゴンの頂点数とリングの数から、BatchedBuildings / InstancedBoxes で描画する頂点数を求めます。
+    ポリゴンは上面の n 頂点と側面の辺ごとの 4 頂点、長方形は箱の 8 頂点です。
+    """
+    return np.where(is_rect, 8, vertex_counts + 4 * (vertex_counts - ring_counts))
+
+
+class BuildingLod:
+    """
+    ビルごとの複数の詳細度（LOD）のポリゴン。
+
+    段階 l は許容誤差 tolerances[l] で、1 つ前の段階をさらに簡略化したものです（頂点は前の段階の一部）。
+    最も粗い段階は向きのある外接矩形で、前の段階からのずれ（ハウスドルフ距離）が許容誤差以下のビルだけが持ちます。
+    頂点数が前の段階から減らない段階と、ビルの基本の段階 base_levels より細かい段階は持ちません。
+    ポリゴンの行はビルの順（同じビルの中は段階の順）で、行 r はビル row_buildings[r] の段階 row_levels[r] です。
+    描画時は rows で各ビルの段階の行を選ぶので、Shapely で簡略化し直さずに詳細度を切り替えられます。
+    """
+
+    def __init__(self, vertices, ring_offsets, polygon_offsets, row_buildings, row_levels, tolerances,
+                 base_levels):
+        self.vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 2)
+        self.ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+        self.polygon_offsets = np.asarray(polygon_offsets, dtype=np.int64)
+        self.row_buildings = np.asarray(row_buildings, dtype=np.int64)
+        self.row_levels = np.asarray(row_levels, dtype=np.int64)
+        self.tolerances = np.asarray(tolerances, dtype=np.float64)
+        self.base_levels = np.asarray(base_levels, dtype=np.int64)
+        # (ビル, 段階) の昇順のキー（rows の検索用）
+        self._row_keys = self.row_buildings * len(self.tolerances) + self.row_levels
+
+    def __len__(self):
+        return len(self.row_buildings)
+
+    def __repr__(self):
+        return (f"BuildingLod(buildings={len(self.base_levels)}, rows={len(self)}, "
+                f"tolerances={np.round(self.tolerances, 2).tolist()})")
+
+    @property
+    def level_count(self):
+        return len(self.tolerances)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def arrays(self):
+        """キャッシュに保存する配列（BuildingTable の配列と区別するため名前に lod_ を付けます）"""
+        return {
+            'lod_vertices': self.vertices,
+            'lod_ring_offsets': self.ring_offsets,
+            'lod_polygon_offsets': self.polygon_offsets,
+            'lod_row_buildings': self.row_buildings,
+            'lod_row_levels': self.row_levels,
+            'lod_tolerances': self.tolerances,
+            'lod_base_levels': self.base_levels,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        arrays から lod_ の配列を取り除いて BuildingLod を作ります（ない場合は None）。
+        """
+        names = [name for name in list(arrays) if name.startswith('lod_')]
+        if not names:
+            return None
+        lod_arrays = {name[len('lod_'):]: arrays.pop(name) for name in names}
+        return cls(**lod_arrays)
+
+    def vertex_counts(self):
+        """各行の頂点数"""
+        return np.diff(self.ring_offsets[self.polygon_offsets])
+
+    def rows(self, buildings=None, levels=None):
+        """
+        ビル buildings（省略時は全ビル）の段階 levels の行。
+        levels を省略した場合や基本の段階より細かい場合は基本の段階、持っていない段階はそれより細かい最も近い段階の行です。
+        """
+        if buildings is None:
+            buildings = np.arange(len(self.base_levels))
+        buildings = np.asarray(buildings, dtype=np.int64)
+        base = self.base_levels[buildings]
+        levels = base if levels is None else np.maximum(np.asarray(levels, dtype=np.int64), base)
+        keys = buildings * self.level_count + np.minimum(levels, self.level_count - 1)
+        return np.searchsorted(self._row_keys, keys, side='right') - 1
+
+    def levels_for_distances(self, distances, pixel_error=PIXEL_ERROR, focal_px=FOCAL_PX):
+        """カメラからの距離ごとに、画面上の誤差が pixel_error ピクセル以下になる最も粗い段階"""
+        thresholds = tolerance_distance(self.tolerances, pixel_error, focal_px)
+        return np.maximum(np.searchsorted(thresholds, distances, side='right') - 1, 0)
+
+    def mesh_table(self, table):
+        """
+        全ての行を持つ BuildingTable（描画用）。ポリゴン以外の列は table のビルの値を使います。
+        """
+        b = self.row_buildings
+        return BuildingTable(table.ids[b], table.heights[b], self.vertices, self.ring_offsets, self.polygon_offsets,
+                             table.centroids[b], table.radii[b], table.rect_width[b], table.rect_height[b],
+                             table.rect_angle[b], table.colors[b])
+
+    def base_table(self, table):
+        """table のポリゴンを各ビルの基本の段階に置き換えた BuildingTable"""
+        return self.mesh_table(table).take(self.rows())
+
+    @classmethod
+    def build(cls, table, tolerance, level_count=LOD_LEVELS, step=LOD_STEP, sliver_ratio=SLIVER_RATIO,
+              vertex_budget=None):
+        """
+        table のポリゴン（許容誤差 tolerance で簡略化済み）を段階 0 として、段階ごとに許容誤差を step 倍にして
+        簡略化した LOD を作ります。sliver_ratio を指定すると各ビルの許容誤差をその幅の割合までに抑えます。
+        最も粗い段階は簡略化ではなく向きのある外接矩形です（細くならずに頂点数を 5 にできる）。
+
+        vertex_budget を指定すると、描画する頂点数（mesh_vertex_counts）の合計がそれ以下になるように、
+        次の段階で最も頂点が減るビルから順に基本の段階を粗くします（全て最も粗くしても超える場合はそのまま）。
+        """
+        building_count = len(table)
+        tolerances = tolerance * step ** np.arange(level_count)
+        polygons = make_polygons(table.vertices.astype(np.float64), table.ring_offsets, table.polygon_offsets,
+                                 np.arange(building_count))
+        widths = polygon_widths(polygons)
+
+        # 前の段階をさらに簡略化する
+        levels = [polygons]
+        for level_tolerance in tolerances[1:-1]:
+            level_tolerance = np.full(building_count, level_tolerance)
+            if sliver_ratio is not None:
+                level_tolerance = np.minimum(level_tolerance, sliver_ratio * widths)
+            levels.append(shapely.simplify(levels[-1], level_tolerance, preserve_topology=True))
+        # 最も粗い段階は外接矩形（元のデータと同じく外周を時計回りにする）
+        envelopes = shapely.oriented_envelope(levels[-1])
+        is_envelope = shapely.get_type_id(envelopes) == shapely.GeometryType.POLYGON
+        is_envelope[is_envelope] = \
+            shapely.hausdorff_distance(levels[-1][is_envelope], envelopes[is_envelope]) <= tolerances[-1]
+        envelopes[is_envelope] = shapely.orient_polygons(envelopes[is_envelope], exterior_cw=True)
+        envelopes[~is_envelope] = levels[-1][~is_envelope]
+        levels.append(envelopes)
+        levels = np.stack(levels, axis=1)
+
+        # 頂点数が前の段階から減った段階だけを持つ
+        counts = shapely.get_num_coordinates(levels)
+        keep = np.ones(counts.shape, dtype=bool)
+        keep[:, 1:] = counts[:, 1:] < counts[:, :-1]
+        costs = mesh_vertex_counts(counts, shapely.get_num_interior_rings(levels) + 1, table.is_rect[:, None])
+
+        base_levels = np.zeros(building_count, dtype=np.int64)
+        if vertex_budget is not None:
+            base_levels = cls.budget_levels(costs, keep, vertex_budget)
+            keep &= np.arange(level_count) >= base_levels[:, None]
+
+        row_buildings, row_levels = np.nonzero(keep)
+        vertices, ring_offsets, polygon_offsets = polygon_arrays(levels[row_buildings, row_levels])
+        return cls(vertices, ring_offsets, polygon_offsets, row_buildings, row_levels, tolerances, base_levels)
+
+    @staticmethod
+    def budget_levels(costs, keep, vertex_budget):
+        """
+        各ビルの段階の描画する頂点数 costs (N, L) と持っている段階 keep から、合計が vertex_budget 以下になる
+        基本の段階を選びます。1 回ごとに全てのビルを 1 段階ずつ候補にし、頂点が多く減るビルから必要な数だけ粗くします。
+        """
+        building_count, level_count = costs.shape
+        levels = np.zeros(building_count, dtype=np.int64)
+        total = int(costs[:, 0].sum())
+        while total > vertex_budget:
+            # 各ビルの次に持っている段階（なければ level_count）
+            later = np.where(keep & (np.arange(level_count) > levels[:, None]), np.arange(level_count), level_count)
+            next_levels = later.min(axis=1)
+            candidates = np.flatnonzero(next_levels < level_count)
+            if not len(candidates):
+                break
+            savings = costs[candidates, levels[candidates]] - costs[candidates, next_levels[candidates]]
+            order = np.argsort(-savings, kind='stable')
+            count = int(np.searchsorted(np.cumsum(savings[order]), total - vertex_budget)) + 1
+            chosen = candidates[order[:count]]
+            levels[chosen] = next_levels[chosen]
+            total -= int(savings[order[:count]].sum())
+        return levels
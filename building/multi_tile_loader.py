@@ -0,0 +1,175 @@
+import os
+import functools
+import numpy as np
+import mercantile
+from concurrent.futures import ProcessPoolExecutor
+from .data_loader import DataLoader, TILE_EXTENT, STAT_NAMES
+from .building_table import BuildingTable
+from .geo_transform import MetricFrame
+from .stitching import MIN_PART_AREA, stitch_tables
+
+
+def load_tile_payload(tile, cache=None, archive=None, vertex_budget=None):
+    """
+    ワーカープロセスで 1 タイルを読み込み、配列の辞書として返します。
+    Building のリストではなく配列だけを返すので、プロセス間の転送量が小さくなります。
+    """
+    z, x, y = tile
+    before = {name: getattr(DataLoader, name) for name in STAT_NAMES}
+    table = DataLoader(z, x, y, None, cache=cache, archive=archive,
+                       vertex_budget=vertex_budget).load_building_table()
+    stats = {name: getattr(DataLoader, name) - before[name] for name in STAT_NAMES}
+    return tile, table.arrays(), stats
+
+
+class MultiTileLoader:
+    """
+    複数のタイルをプロセスプールで並列に読み込み、1 つの BuildingTable にまとめます。
+
+    各タイルのローカル座標 (0〜4096) は共通のワールド座標系に移動します。
+    ワールド座標の原点は、読み込むタイル群の左下（x 最小、y 最大）のタイルの左下です。
+    metric=True の場合、ワールド座標はその原点から東・北へのメートルです（building.geo_transform.MetricFrame）。
+    """
+
+    def __init__(self, tiles=None, bbox=None, zoom=None, image_path=None, max_workers=None, cache=None,
+                 color_sampling='nearest', stitch=False, archive=None, vertex_budget=None,
+                 metric=False):
+        """
+        tiles: (z, x, y) のリスト
+        bbox: (west, south, east, north) の経度・緯度。zoom と一緒に指定します。
+        cache: 各ワーカーが使う TileCache
+        color_sampling: 画像から色を取り出す方法（'nearest', 'bilinear', 'area'）
+        stitch: True にすると、隣のタイルのバッファに重複したビルや MultiPolygon の各部分を
+            id ごとに 1 つのビルにまとめます（building.stitching を参照）
+        archive: pbf を読むアーカイブ (TileArchive)。各ワーカーはパスから開き直します
+        vertex_budget: タイルごとに描画する頂点数の上限（DataLoader を参照）
+        metric: True にすると、タイルごとの地表の縮尺でワールド座標をメートルにします
+            （ビルの高さと同じ単位になり、緯度の違うタイルの大きさも正しくなります）
+        """
+        if tiles is None:
+            if bbox is None or zoom is None:
+                raise ValueError("Either tiles or bbox and zoom must be given")
+            tiles = MultiTileLoader.tiles_from_bbox(bbox, zoom, archive=archive)
+        tiles = [tuple(tile) for tile in tiles]
+        if not tiles:
+            raise ValueError("No tiles to load")
+        if len({z for z, _, _ in tiles}) != 1:
+            raise ValueError("All tiles must have the same zoom level")
+
+        self.tiles = tiles
+        self.z = tiles[0][0]
+        self.image_path = image_path
+        self.color_sampling = color_sampling
+        self.max_workers = max_workers
+        self.cache = cache
+        self.archive = archive
+        self.vertex_budget = vertex_budget
+        self.stitch = stitch
+        # stitch=True の場合の、ビル b の部分の行の範囲 part_offsets[b] 〜 part_offsets[b + 1]
+        self.part_offsets = None
+
+        # ワールド座標の原点となるタイル
+        self.origin_x = min(x for _, x, _ in tiles)
+        self.origin_y = max(y for _, _, y in tiles)
+        # metric=True の場合のメートルの座標系（原点はワールド座標の原点と同じ）
+        self.frame = MetricFrame.from_tile(self.z, self.origin_x, self.origin_y, 'southwest') if metric else None
+
+    @staticmethod
+    def tiles_from_bbox(bbox, zoom, existing_only=True, archive=None):
+        """
+        経度・緯度の範囲に含まれるタイルのリストを返します。
+        existing_only=True の場合は pbf ファイル（archive を指定した場合はアーカイブのタイル）が存在するタイルのみを返します。
+        """
+        west, south, east, north = bbox
+        tiles = [(tile.z, tile.x, tile.y) for tile in mercantile.tiles(west, south, east, north, zooms=[zoom])]
+        if existing_only and archive is not None:
+            tiles = [tile for tile in tiles if tile in archive]
+        elif existing_only:
+            tiles = [(z, x, y) for z, x, y in tiles if os.path.isfile(f'{z}/{x}/{y}.pbf')]
+        return tiles
+
+    def tile_offset(self, x, y):
+        """タイル (x, y) のローカル座標をワールド座標に移すためのオフセット"""
+        return (x - self.origin_x) * TILE_EXTENT, (self.origin_y - y) * TILE_EXTENT
+
+    def tile_box(self, x, y):
+        """タイル (x, y) のバッファを除いた範囲のワールド座標 (x_min, y_min, x_max, y_max)"""
+        if self.frame is not None:
+            return self.frame.tile_box(self.z, x, y)
+        x_min, y_min = self.tile_offset(x, y)
+        return x_min, y_min, x_min + TILE_EXTENT, y_min + TILE_EXTENT
+
+    def world_bounds(self):
+        """読み込むタイル群全体のワールド座標の範囲 (x_min, y_min, x_max, y_max)"""
+        if self.frame is not None:
+            boxes = np.array([self.tile_box(x, y) for _, x, y in self.tiles])
+            return 0, 0, float(boxes[:, 2].max()), float(boxes[:, 3].max())
+        x_max = (max(x for _, x, _ in self.tiles) - self.origin_x + 1) * TILE_EXTENT
+        y_max = (self.origin_y - min(y for _, _, y in self.tiles) + 1) * TILE_EXTENT
+        return 0, 0, x_max, y_max
+
+    def load(self):
+        """
+        全タイルを読み込み、ワールド座標系の BuildingTable を返します。
+        """
+        load_payload = functools.partial(load_tile_payload, cache=self.cache, archive=self.archive,
+                                         vertex_budget=self.vertex_budget)
+        if self.max_workers == 1:
+            # 同じプロセスで順に読み込む（統計情報はそのまま DataLoader に加算される）
+            payloads = map(load_payload, self.tiles)
+            tables, loaded_tiles = [], []
+            for tile, arrays, _ in payloads:
+                tables.append(self.to_world_table(tile, arrays))
+                loaded_tiles.append(tile)
+        else:
+            workers = self.max_workers or os.cpu_count() or 1
+            chunksize = max(1, len(self.tiles) // (4 * workers))
+            tables, loaded_tiles = [], []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for tile, arrays, stats in executor.map(load_payload, self.tiles, chunksize=chunksize):
+                    for name, value in stats.items():
+                        setattr(DataLoader, name, getattr(DataLoader, name) + value)
+                    tables.append(self.to_world_table(tile, arrays))
+                    loaded_tiles.append(tile)
+
+        if self.stitch:
+            boxes = [self.tile_box(x, y) for _, x, y in loaded_tiles]
+            min_part_area = MIN_PART_AREA
+            if self.frame is not None:
+                min_part_area *= np.prod(self.frame.tile_transform(self.z, self.origin_x, self.origin_y)[0])
+            table, self.part_offsets = stitch_tables(tables, boxes, min_part_area)
+        else:
+            table = BuildingTable.concatenate(tables)
+
+        # 画像はタイル群全体に対応させて色を付ける
+        if self.image_path and len(table):
+            painter = DataLoader(self.z, self.origin_x, self.origin_y, self.image_path,
+                                 color_bounds=self.world_bounds(), color_sampling=self.color_sampling)
+            table.colors[:] = painter.get_table_colors(table.arrays(), self.part_offsets)
+
+        return table
+
+    def to_world_table(self, tile, arrays):
+        """ワーカーの結果をワールド座標に移した BuildingTable に変換します。"""
+        _, x, y = tile
+        if self.frame is not None:
+            return self.to_metric_table(tile, arrays)
+        offset = np.array(self.tile_offset(x, y), dtype=np.float32)
+        # キャッシュから読んだ配列は読み取り専用なので新しい配列を作る
+        arrays['vertices'] = arrays['vertices'] + offset
+        arrays['centroids'] = arrays['centroids'] + offset
+        return BuildingTable(**arrays)
+
+    def to_metric_table(self, tile, arrays):
+        """ワーカーの結果をメートルのワールド座標に移した BuildingTable に変換します。"""
+        scale, offset = self.frame.tile_transform(*tile)
+        arrays['vertices'] = arrays['vertices'] * scale + offset
+        arrays['centroids'] = arrays['centroids'] * scale + offset
+        # 東西と南北の縮尺はわずかに違うので、長方形の辺は向きに合わせて拡大する
+        angle = np.radians(arrays['rect_angle'])
+        cos, sin = np.cos(angle), np.sin(angle)
+        arrays['rect_width'] = arrays['rect_width'] * np.hypot(scale[0] * cos, scale[1] * sin)
+        arrays['rect_height'] = arrays['rect_height'] * np.hypot(scale[0] * sin, scale[1] * cos)
+        arrays['rect_angle'] = np.degrees(np.arctan2(scale[1] * sin, scale[0] * cos))
+        arrays['radii'] = arrays['radii'] * scale.max()
+        return BuildingTable(**arrays)
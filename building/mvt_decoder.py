@@ -0,0 +1,384 @@
+import struct
+import numpy as np
+
+# Mapbox Vector Tile の geometry コマンド
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+# Feature の geometry type
+GEOM_POLYGON = 3
+
+
+class PolygonArrays:
+    """
+    デコードしたポリゴンのフィーチャを CSR 形式の配列で保持します。
+
+    - フィーチャ f のポリゴン: feature_offsets[f] 〜 feature_offsets[f + 1]
+    - ポリゴン p のリング: polygon_offsets[p] 〜 polygon_offsets[p + 1]（先頭が外周、残りが穴）
+    - リング r の頂点: vertices[ring_offsets[r]:ring_offsets[r + 1]]（閉じた形）
+    """
+
+    def __init__(self, ids, heights, vertices, ring_offsets, polygon_offsets, feature_offsets, extent):
+        self.ids = ids
+        self.heights = heights
+        self.vertices = vertices
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.feature_offsets = feature_offsets
+        self.extent = extent
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def polygon_count(self):
+        return len(self.polygon_offsets) - 1
+
+    def polygon_ids(self):
+        """各ポリゴンが属するフィーチャの id"""
+        return np.repeat(self.ids, np.diff(self.feature_offsets))
+
+    def polygon_heights(self):
+        """各ポリゴンが属するフィーチャの高さ"""
+        return np.repeat(self.heights, np.diff(self.feature_offsets))
+
+    def exteriors(self):
+        """
+        各ポリゴンの外周リングだけを取り出し、(vertices, offsets) で返します。
+        """
+        exterior_rings = self.polygon_offsets[:-1]
+        starts = self.ring_offsets[exterior_rings]
+        lengths = self.ring_offsets[exterior_rings + 1] - starts
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return self.vertices[ragged_arange(starts, lengths)], offsets
+
+    def feature(self, index):
+        """フィーチャ index のポリゴンを、リング配列のリストのリストで返します。"""
+        polygons = []
+        for p in range(self.feature_offsets[index], self.feature_offsets[index + 1]):
+            polygons.append([self.vertices[self.ring_offsets[r]:self.ring_offsets[r + 1]]
+                             for r in range(self.polygon_offsets[p], self.polygon_offsets[p + 1])])
+        return polygons
+
+
+def decode_polygons(data, layer_name='bldg', y_coord_down=False):
+    """
+    pbf のバイト列（bytes やアーカイブのメモリマップの memoryview）から
+    layer_name レイヤーのポリゴンをまとめてデコードします。
+    レイヤーがない場合は None を返します。
+    """
+    chunks = list(iter_polygon_chunks(data, layer_name, chunk_size=None, y_coord_down=y_coord_down))
+    return chunks[0] if chunks else None
+
+
+def iter_polygon_chunks(data, layer_name='bldg', chunk_size=4096, y_coord_down=False):
+    """
+    layer_name レイヤーのフィーチャを chunk_size 個ずつデコードし、PolygonArrays を順に返します。
+    大きなタイルでも一度に確保する配列のサイズを抑えられます。
+    """
+    layer = _find_layer(data, layer_name)
+    if layer is None:
+        return
+    keys, values, extent, features = layer
+
+    # 高さとして使う属性（z がなければ height）
+    height_keys = [keys.index(name) for name in ('z', 'height') if name in keys]
+
+    if chunk_size is None:
+        chunk_size = max(1, len(features))
+    for start in range(0, len(features), chunk_size):
+        yield _decode_features(data, features[start:start + chunk_size], values,
+                               height_keys, extent, y_coord_down)
+
+
+def iter_features(data, layer_name='bldg', chunk_size=4096, y_coord_down=False):
+    """
+    フィーチャを 1 つずつ (id, height, polygons) の形で返すジェネレータ。
+    polygons はリング配列のリストのリストです。
+    """
+    for chunk in iter_polygon_chunks(data, layer_name, chunk_size, y_coord_down):
+        for index in range(len(chunk)):
+            yield int(chunk.ids[index]), float(chunk.heights[index]), chunk.feature(index)
+
+
+def ragged_arange(starts, lengths):
+    """
+    [starts[i], starts[i] + lengths[i]) の連番を連結した配列を返します。
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return (np.arange(total, dtype=np.int64)
+            - np.repeat(ends - lengths, lengths)
+            + np.repeat(np.asarray(starts, dtype=np.int64), lengths))
+
+
+def decode_varints(buffer):
+    """
+    packed varint のバイト列 (uint8 配列) をまとめて uint64 配列にデコードします。
+    """
+    is_last = buffer < 0x80
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    payload = (buffer & 0x7f).astype(np.uint64)
+
+    values = payload[starts]
+    for shift in range(1, int(lengths.max(initial=1))):
+        longer = lengths > shift
+        values[longer] |= payload[starts[longer] + shift] << np.uint64(7 * shift)
+    return values
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(data, pos, end):
+    """
+    protobuf メッセージのフィールドを (field_number, wire_type, value) の形で返します。
+    length-delimited の場合 value は (start, end)、それ以外は値そのものです。
+    """
+    while pos < end:
+        tag, pos = _read_varint(data, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type: {wire_type}")
+        yield field_number, wire_type, value
+
+
+def _parse_value(data, start, end):
+    """Tile.Value メッセージを Python の値に変換します。"""
+    for field_number, _, value in _iter_fields(data, start, end):
+        if field_number == 1:
+            return str(data[value[0]:value[1]], 'utf-8')
+        if field_number == 2:
+            return struct.unpack('<f', value)[0]
+        if field_number == 3:
+            return struct.unpack('<d', value)[0]
+        if field_number == 4:
+            return value - (1 << 64) if value >= 1 << 63 else value
+        if field_number == 5:
+            return value
+        if field_number == 6:
+            return (value >> 1) ^ -(value & 1)
+        if field_number == 7:
+            return bool(value)
+    return None
+
+
+def _find_layer(data, layer_name):
+    """
+    レイヤーを探し、(keys, values, extent, features) を返します。
+    features は (id, tags の範囲, type, geometry の範囲) のリストで、中身はまだデコードしません。
+    """
+    for field_number, _, value in _iter_fields(data, 0, len(data)):
+        if field_number != 3:
+            continue
+        layer_start, layer_end = value
+
+        # 名前が一致するレイヤーだけを読む
+        name = None
+        for layer_field, _, layer_value in _iter_fields(data, layer_start, layer_end):
+            if layer_field == 1:
+                name = str(data[layer_value[0]:layer_value[1]], 'utf-8')
+                break
+        if name != layer_name:
+            continue
+
+        keys = []
+        values = []
+        extent = 4096
+        features = []
+        for layer_field, _, layer_value in _iter_fields(data, layer_start, layer_end):
+            if layer_field == 2:
+                features.append(_parse_feature(data, *layer_value))
+            elif layer_field == 3:
+                keys.append(str(data[layer_value[0]:layer_value[1]], 'utf-8'))
+            elif layer_field == 4:
+                values.append(_parse_value(data, *layer_value))
+            elif layer_field == 5:
+                extent = layer_value
+        return keys, values, extent, features
+    return None
+
+
+def _parse_feature(data, start, end):
+    # フィーチャ数が多いので _iter_fields を使わずに読む
+    # id のないフィーチャは BuildingTableBuilder と同じく -1（stitch_buildings はまとめない）
+    feature_id = -1
+    tags = (0, 0)
+    geometry_type = 0
+    geometry = (0, 0)
+    pos = start
+    while pos < end:
+        tag = data[pos]
+        pos += 1
+        if tag >= 0x80:
+            tag, pos = _read_varint(data, pos - 1)
+        if tag & 0x7 == 0:
+            value, pos = _read_varint(data, pos)
+            if tag == 0x08:
+                feature_id = value
+            elif tag == 0x18:
+                geometry_type = value
+        elif tag & 0x7 == 2:
+            length, pos = _read_varint(data, pos)
+            if tag == 0x12:
+                tags = (pos, pos + length)
+            elif tag == 0x22:
+                geometry = (pos, pos + length)
+            pos += length
+        elif tag & 0x7 == 1:
+            pos += 8
+        elif tag & 0x7 == 5:
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type: {tag & 0x7}")
+    return feature_id, tags, geometry_type, geometry
+
+
+def _feature_height(data, tags, values, height_keys):
+    """tags から高さの属性を探します（DataLoader と同じく z → height → 0 の順）。"""
+    pos, end = tags
+    found = {}
+    while pos < end:
+        key, pos = _read_varint(data, pos)
+        value, pos = _read_varint(data, pos)
+        found[key] = values[value]
+    for key in height_keys:
+        if found.get(key):
+            return found[key]
+    return 0
+
+
+def _decode_features(data, features, values, height_keys, extent, y_coord_down):
+    features = [feature for feature in features if feature[2] == GEOM_POLYGON]
+    ids = np.array([feature[0] for feature in features], dtype=np.int64)
+    heights = np.array([_feature_height(data, feature[1], values, height_keys) for feature in features],
+                       dtype=np.float64)
+
+    # 全フィーチャの geometry をまとめて varint デコード
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    geometry_starts = np.array([feature[3][0] for feature in features], dtype=np.int64)
+    geometry_lengths = np.array([feature[3][1] - feature[3][0] for feature in features], dtype=np.int64)
+    geometry_bytes = buffer[ragged_arange(geometry_starts, geometry_lengths)]
+    commands = decode_varints(geometry_bytes) if len(geometry_bytes) else np.zeros(0, dtype=np.uint64)
+    # 各フィーチャの varint の終わりの位置
+    varint_ends = np.concatenate(([0], np.cumsum(geometry_bytes < 0x80)))
+    feature_varint_ends = varint_ends[np.cumsum(geometry_lengths)]
+
+    # コマンド列をたどり、MoveTo / LineTo の座標パラメータの位置と点の数を記録する
+    command_list = commands.tolist()
+    segment_starts = []
+    segment_counts = []
+    segment_rings = []
+    ring_features = []
+    i = 0
+    for feature_index, feature_end in enumerate(feature_varint_ends.tolist()):
+        while i < feature_end:
+            command = command_list[i]
+            command_id, count = command & 0x7, command >> 3
+            i += 1
+            if command_id == CMD_MOVE_TO:
+                # 新しいリングの開始
+                ring_features.append(feature_index)
+            elif command_id != CMD_LINE_TO:
+                if command_id != CMD_CLOSE_PATH:
+                    raise ValueError(f"Unknown geometry command: {command_id}")
+                continue
+            segment_starts.append(i)
+            segment_counts.append(count)
+            segment_rings.append(len(ring_features) - 1)
+            i += 2 * count
+
+    segment_starts = np.array(segment_starts, dtype=np.int64)
+    segment_counts = np.array(segment_counts, dtype=np.int64)
+    ring_features = np.array(ring_features, dtype=np.int64)
+    ring_point_counts = np.bincount(np.array(segment_rings, dtype=np.int64), weights=segment_counts,
+                                    minlength=len(ring_features)).astype(np.int64)
+
+    # 座標パラメータ (dx, dy) を取り出して zigzag デコード
+    local_points = ragged_arange(np.zeros(len(segment_counts), dtype=np.int64), segment_counts)
+    point_positions = np.repeat(segment_starts, segment_counts) + 2 * local_points
+    deltas = commands[np.stack([point_positions, point_positions + 1], axis=1)].astype(np.int64)
+    deltas = (deltas >> 1) ^ -(deltas & 1)
+
+    # カーソルはフィーチャ内で累積する
+    points = np.cumsum(deltas, axis=0)
+    point_features = np.repeat(ring_features, ring_point_counts)
+    feature_first_point = np.zeros(len(features) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(point_features, minlength=len(features)), out=feature_first_point[1:])
+    base = np.zeros((len(features), 2), dtype=np.int64)
+    has_points = feature_first_point[1:] > feature_first_point[:-1]
+    start_rows = feature_first_point[:-1][has_points]
+    base[has_points] = points[start_rows] - deltas[start_rows]
+    points = points - base[point_features]
+    if not y_coord_down:
+        points[:, 1] = extent - points[:, 1]
+
+    # リングを閉じる（最初の点と最後の点が異なる場合は最初の点を末尾に追加）
+    ring_starts = np.zeros(len(ring_point_counts) + 1, dtype=np.int64)
+    np.cumsum(ring_point_counts, out=ring_starts[1:])
+    first = points[ring_starts[:-1]] if len(points) else np.zeros((0, 2), dtype=np.int64)
+    last = points[ring_starts[1:] - 1] if len(points) else np.zeros((0, 2), dtype=np.int64)
+    needs_close = np.any(first != last, axis=1)
+    closed_counts = ring_point_counts + needs_close
+    local = ragged_arange(np.zeros(len(closed_counts), dtype=np.int64), closed_counts)
+    local[local == np.repeat(ring_point_counts, closed_counts)] = 0
+    closed = points[np.repeat(ring_starts[:-1], closed_counts) + local]
+    closed_starts = np.zeros(len(closed_counts) + 1, dtype=np.int64)
+    np.cumsum(closed_counts, out=closed_starts[1:])
+
+    # リングの面積の符号で外周と穴を判定する
+    x, y = closed[:, 0], closed[:, 1]
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    # リングの最後の点から次のリングへの項は含めない
+    cross = np.append(cross, 0)
+    cross[closed_starts[1:] - 1] = 0
+    areas = np.add.reduceat(cross, closed_starts[:-1]) if len(cross) else np.zeros(0, dtype=np.int64)
+    signs = np.sign(areas)
+
+    # 面積が 0 のリングは捨てる
+    kept = np.flatnonzero(signs != 0)
+    kept_features = ring_features[kept]
+    kept_signs = signs[kept]
+    # フィーチャの最初のリングと同じ向きのリングを外周とする
+    feature_ids, first_ring = np.unique(kept_features, return_index=True)
+    reference_sign = np.zeros(len(features), dtype=kept_signs.dtype)
+    reference_sign[feature_ids] = kept_signs[first_ring]
+    is_exterior = kept_signs == reference_sign[kept_features]
+
+    # 出力の配列を組み立てる
+    kept_counts = closed_counts[kept]
+    vertices = closed[ragged_arange(closed_starts[kept], kept_counts)].astype(np.float32)
+    ring_offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+    np.cumsum(kept_counts, out=ring_offsets[1:])
+    polygon_offsets = np.append(np.flatnonzero(is_exterior), len(kept)).astype(np.int64)
+    feature_offsets = np.zeros(len(features) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(kept_features[is_exterior], minlength=len(features)), out=feature_offsets[1:])
+
+    return PolygonArrays(ids, heights, vertices, ring_offsets, polygon_offsets, feature_offsets, extent)
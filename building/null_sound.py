@@ -0,0 +1,74 @@
+import threading
+import numpy as np
+from .audio_analysis import AudioCache
+
+
+class NullSound:
+    """
+    Sound と同じ使い方ができる、音を出さないサウンド（ヘッドレスでの実行用）。
+
+    サウンドデバイスの代わりに、デコードした PCM を chunk_size ごとのブロックで出力用の配列（null sink）に
+    書き込みます。再生位置は実際の時間ではなく advance で進めた時間だけで決まるので、
+    同じフレーム数・フレームレートで実行すると毎回同じ再生位置でビルの高さが計算されます。
+    """
+
+    def __init__(self, file_path, chunk_size=1024, sample_rate=44100, band_count=16, cache_dir='.audio_cache'):
+        # デコードした PCM（モノラル、int16）と解析結果をキャッシュから読み込む（なければ作成）
+        self.analysis = AudioCache(cache_dir).load(file_path, sample_rate=sample_rate, frame_size=chunk_size,
+                                                   band_count=band_count)
+        self.raw_data = self.analysis.pcm
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+
+        # 再生用のフレームカウンタ（Sound と同じ）
+        self.audio_frame = [0]
+        self.output_latency = 0.0
+        # 出力先のブロック（書き込むだけで再生はしない）
+        self.outdata = np.zeros((chunk_size, 1), dtype=np.int16)
+        # 書き込んだブロックの数
+        self.block_count = 0
+        # 進めた時間（秒）。ブロック単位で書き込むので、audio_frame はこれより最大 1 ブロック先に進む
+        self.time = 0.0
+
+        self.is_playing = threading.Event()
+        self.finished = threading.Event()
+
+    def audio_callback(self, outdata, frames):
+        """Sound.audio_callback と同じように、PCM の次のブロックを outdata に書き込みます。"""
+        start = self.audio_frame[0]
+        data = self.raw_data[start:start + frames]
+        outdata[:len(data), 0] = data
+        outdata[len(data):] = 0
+        self.audio_frame[0] += len(data)
+        self.block_count += 1
+        if len(data) < frames:
+            self.is_playing.clear()
+            self.finished.set()
+
+    def advance(self, seconds):
+        """再生を seconds 秒進め、その間に必要なブロックを null sink に書き込みます。"""
+        if self.finished.is_set():
+            return
+        self.time += seconds
+        target = int(round(self.time * self.sample_rate))
+        while self.audio_frame[0] < target and not self.finished.is_set():
+            self.audio_callback(self.outdata, self.chunk_size)
+        if self.audio_frame[0] >= len(self.raw_data):
+            self.is_playing.clear()
+            self.finished.set()
+
+    def playback_time(self, ahead=0.0):
+        """ahead 秒後の再生位置（秒）"""
+        return min(self.time + ahead, self.analysis.duration)
+
+    def amplitude(self, ahead=0.0):
+        """再生位置の振幅 (0〜1)"""
+        return self.analysis.amplitude_at(self.playback_time(ahead))
+
+    def bands(self, ahead=0.0):
+        """再生位置の帯域ごとの強さ (0〜1)"""
+        return self.analysis.bands_at(self.playback_time(ahead))
+
+    def play(self):
+        """再生を開始します（時間は advance で進めます）。"""
+        self.is_playing.set()
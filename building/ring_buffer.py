@@ -0,0 +1,126 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    時刻付きの値を固定長の NumPy 配列に書き込むリングバッファ。
+
+    書き込み（オーディオのコールバック）と読み込み（描画のタスク）はそれぞれ 1 スレッドを想定しています。
+    書き込み側は行を書いてから書き込み数を増やすだけなので、ロックもメモリの確保もしません。
+    読み込み側は書き込み数を先に読み、上書きされた可能性のある古い行は読みません。
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        # 各行は (時刻, 値)
+        self.data = np.zeros((capacity, 2), dtype=np.float64)
+        # 書き込んだ総数と、読み込み側が次に読む位置（総数で数える）
+        self.written = 0
+        self.read = 0
+        # 読まずに捨てた数（読み込みが遅れて古くなったもの、上書きされたもの）
+        self.dropped = 0
+        # 最後に読んだ (時刻, 値)
+        self.last = None
+
+    def __len__(self):
+        """まだ読んでいない値の数（上書きされたものは除く）"""
+        return min(self.written - self.read, self.capacity)
+
+    def push(self, timestamp, value):
+        """値を書き込みます（書き込み側のスレッドから呼びます）。"""
+        row = self.data[self.written % self.capacity]
+        row[0] = timestamp
+        row[1] = value
+        self.written += 1
+
+    def latest(self, until=None):
+        """
+        時刻が until 以前の値のうち最も新しい (時刻, 値) を返し、それより古い値を捨てます。
+        until を省略した場合は最も新しい値を返します。
+        新しい値がまだ来ていない場合は前回返した値を返し、該当する値がない場合は None を返します。
+        """
+        written = self.written
+        oldest = max(self.read, written - self.capacity)
+        # 読む前に上書きされた値
+        self.dropped += oldest - self.read
+        self.read = oldest
+        if written > oldest:
+            rows = np.arange(oldest, written)
+            timestamps = self.data[rows % self.capacity, 0]
+            index = len(rows) - 1 if until is None else int(np.searchsorted(timestamps, until, side='right')) - 1
+            if index >= 0:
+                self.dropped += index
+                self.read = oldest + index + 1
+                timestamp, value = self.data[(oldest + index) % self.capacity]
+                self.last = (float(timestamp), float(value))
+                return self.last
+        if self.last is not None and (until is None or self.last[0] <= until):
+            return self.last
+        return None
+
+
+class PlaybackClock:
+    """
+    オーディオのコールバックが記録したブロックの出力時刻から、任意の時刻に聞こえている再生位置を求めます。
+
+    ブロックの記録は時刻 now 以前のものだけを読み（それより古い記録は捨てます）、ahead 秒先の位置は
+    そこから外挿します。先の時刻で記録を読むと、同じフレームで後から今の位置を求めるときに
+    使う記録が捨てられているので、ahead は記録の検索に使いません。
+    """
+
+    def __init__(self, sample_rate, capacity=256):
+        self.sample_rate = sample_rate
+        # 各行は (ブロックの出力が始まる時刻, ブロックの先頭のフレーム)
+        self.blocks = RingBuffer(capacity)
+
+    def push(self, dac_time, frame):
+        """ブロックの出力時刻と先頭のフレームを記録します（オーディオのコールバックから呼びます）。"""
+        self.blocks.push(dac_time, frame)
+
+    def position(self, now, ahead=0.0):
+        """時刻 now の ahead 秒後に聞こえている位置（秒）。まだ出力が始まっていない場合は None。"""
+        sample = self.blocks.latest(until=now)
+        if sample is None:
+            return None
+        dac_time, frame = sample
+        return frame / self.sample_rate + (now + ahead - dac_time)
+
+
+class SkewMonitor:
+    """
+    音と映像のずれ（映像が使った再生位置 − 映像が表示されたときに聞こえていた位置）を記録します。
+
+    record は描画のたびに呼び、前回の描画で使った再生位置と、今聞こえている位置
+    （前回の描画が表示された頃の位置）の差を記録します。正の値は映像が音より先行していることを表します。
+    """
+
+    def __init__(self, capacity=600):
+        self.skews = RingBuffer(capacity)
+        self._previous = None
+
+    def record(self, timestamp, used_position, audible_position):
+        """
+        timestamp: 描画の時刻
+        used_position: 今回の描画で使った再生位置（秒）
+        audible_position: 今聞こえている再生位置（秒）
+        """
+        if self._previous is not None:
+            self.skews.push(timestamp, self._previous - audible_position)
+        self._previous = used_position
+
+    def summary(self):
+        """直近のずれの (平均, 95 パーセンタイル（絶対値）, 最大（絶対値）)（秒）。記録がない場合は None。"""
+        count = min(self.skews.written, self.skews.capacity)
+        if count == 0:
+            return None
+        skews = self.skews.data[:count, 1]
+        magnitudes = np.abs(skews)
+        return float(skews.mean()), float(np.percentile(magnitudes, 95)), float(magnitudes.max())
+
+    def status(self):
+        summary = self.summary()
+        if summary is None:
+            return 'audio-visual skew: no samples'
+        mean, p95, worst = summary
+        return (f"audio-visual skew: mean {mean * 1000:+.1f} ms, p95 {p95 * 1000:.1f} ms, "
+                f"max {worst * 1000:.1f} ms ({min(self.skews.written, self.skews.capacity)} frames)")
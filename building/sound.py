@@ -1,57 +1,77 @@
 # sound.py
 
-import numpy as np
-from pydub import AudioSegment
 import sounddevice as sd
-from queue import Queue
 import threading
+from .audio_analysis import AudioCache
+from .ring_buffer import PlaybackClock
 
 
 class Sound:
-    def __init__(self, file_path, chunk_size=1024, update_interval=0.1):
-        # MP3ファイルを読み込み
-        self.audio = AudioSegment.from_mp3(file_path)
-        self.audio = self.audio.set_channels(1)  # モノラルに変換
-        self.audio = self.audio.set_frame_rate(44100)  # サンプリングレートを設定
-
-        # 生のデータを取得
-        self.raw_data = np.frombuffer(self.audio.raw_data, dtype=np.int16)
-        self.sample_rate = self.audio.frame_rate
+    def __init__(self, file_path, chunk_size=1024, sample_rate=44100, band_count=16, cache_dir='.audio_cache'):
+        # デコードした PCM（モノラル、int16）と解析結果をキャッシュから読み込む（なければ作成）
+        self.analysis = AudioCache(cache_dir).load(file_path, sample_rate=sample_rate, frame_size=chunk_size,
+                                                   band_count=band_count)
+        # 生のデータ（キャッシュのメモリマップ）
+        self.raw_data = self.analysis.pcm
+        self.sample_rate = sample_rate
         self.chunk_size = chunk_size
-        self.update_interval = update_interval
 
         # 再生用のフレームカウンタ
         self.audio_frame = [0]
+        # 出力の遅延（秒）。再生中のストリームから取得する
+        self.output_latency = 0.0
+        # コールバックが書き込む (ブロックの出力が始まる時刻, ブロックの先頭のフレーム)
+        self.clock = PlaybackClock(sample_rate)
+        self.stream = None
 
-        # 振幅データを格納するキュー
-        self.amplitude_queue = Queue()
-
-        # 再生中フラグ
+        # 再生中フラグと再生終了フラグ
         self.is_playing = threading.Event()
+        self.finished = threading.Event()
 
     def audio_callback(self, outdata, frames, time, status):
         start = self.audio_frame[0]
         end = start + frames
+        # 出力時刻に対応しないバックエンドでは 0 になるので、現在の時刻と遅延から求める
+        self.clock.push(time.outputBufferDacTime or time.currentTime + self.output_latency, start)
         data = self.raw_data[start:end]
         if len(data) < frames:
-            data = np.pad(data, (0, frames - len(data)), 'constant')
-            outdata[:len(data)] = data.reshape(-1, 1)
-            outdata[len(data):] = np.zeros((frames - len(data), 1), dtype='int16')
-            # 振幅を計算してキューに追加
-            amplitude = np.sqrt(np.mean(data.astype(np.float32) ** 2))
-            self.amplitude_queue.put(amplitude)
+            outdata[:len(data), 0] = data
+            outdata[len(data):] = 0
+            self.audio_frame[0] += len(data)
             raise sd.CallbackStop()
-        else:
-            outdata[:] = data.reshape(-1, 1)
-            # 振幅を計算してキューに追加
-            amplitude = np.sqrt(np.mean(data.astype(np.float32) ** 2))
-            self.amplitude_queue.put(amplitude)
+        outdata[:, 0] = data
         self.audio_frame[0] += frames
 
+    def playback_time(self, ahead=0.0):
+        """
+        ahead 秒後に聞こえている位置（秒）。
+        コールバックが記録したブロックの出力時刻のうち、今の時刻以前で最新のものから求めます（PlaybackClock）。
+        古いブロックの記録は読み飛ばすので、描画が止まっても再生位置から遅れません。
+        """
+        stream = self.stream
+        if stream is not None:
+            position = self.clock.position(stream.time, ahead)
+            if position is not None:
+                return min(position, self.analysis.duration)
+        # まだ出力が始まっていない
+        return max(self.audio_frame[0] / self.sample_rate - self.output_latency + ahead, 0.0)
+
+    def amplitude(self, ahead=0.0):
+        """再生位置の振幅 (0〜1)"""
+        return self.analysis.amplitude_at(self.playback_time(ahead))
+
+    def bands(self, ahead=0.0):
+        """再生位置の帯域ごとの強さ (0〜1)"""
+        return self.analysis.bands_at(self.playback_time(ahead))
+
     def play(self):
         # ストリーミング再生を開始
         self.is_playing.set()
         with sd.OutputStream(samplerate=self.sample_rate, channels=1, dtype='int16',
-                             callback=self.audio_callback, blocksize=int(self.sample_rate * self.update_interval)):
+                             callback=self.audio_callback, blocksize=self.chunk_size) as stream:
+            self.output_latency = stream.latency
+            self.stream = stream
             sd.sleep(int(len(self.raw_data) / self.sample_rate * 1000))
+        self.stream = None
         self.is_playing.clear()
+        self.finished.set()
@@ -0,0 +1,103 @@
+import numpy as np
+from .mvt_decoder import ragged_arange
+
+
+class CentroidGrid:
+    """
+    ビルの重心を一様なグリッドのセルに分けて保持します。
+
+    ビルの番号はセルの番号順（セル内は元の順）に並べ、セル c のビルが
+    order[cell_offsets[c]:cell_offsets[c + 1]] となるように保持します。
+    同じ行の連続したセルは order の連続した範囲になるので、矩形の検索は
+    「行数 + 候補のビル数」程度のコストで行えます。
+    """
+
+    def __init__(self, centroids, radii=None, cell_size=256):
+        centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        self.count = len(centroids)
+        # 各ビルの包含円の半径の最大値（矩形の検索範囲をこの分だけ広げる）
+        self.max_radius = float(np.max(radii)) if radii is not None and len(radii) else 0.0
+
+        if self.count:
+            self.origin = centroids.min(axis=0)
+            cells = np.floor((centroids - self.origin) / self.cell_size).astype(np.int64)
+            self.nx, self.ny = (cells.max(axis=0) + 1).tolist()
+        else:
+            self.origin = np.zeros(2)
+            cells = np.zeros((0, 2), dtype=np.int64)
+            self.nx = self.ny = 0
+
+        cell_ids = cells[:, 1] * self.nx + cells[:, 0]
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_offsets = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_ids, minlength=self.nx * self.ny), out=self.cell_offsets[1:])
+
+    def __len__(self):
+        return self.count
+
+    def cell_range(self, x_min, y_min, x_max, y_max):
+        """矩形と重なるセルの範囲 (ix0, iy0, ix1, iy1)（両端を含む）。重ならない場合は None。"""
+        ix0, iy0 = np.floor((np.array([x_min, y_min]) - self.origin) / self.cell_size).astype(np.int64)
+        ix1, iy1 = np.floor((np.array([x_max, y_max]) - self.origin) / self.cell_size).astype(np.int64)
+        ix0, iy0 = max(int(ix0), 0), max(int(iy0), 0)
+        ix1, iy1 = min(int(ix1), self.nx - 1), min(int(iy1), self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return None
+        return ix0, iy0, ix1, iy1
+
+    def query_bbox(self, x_min, y_min, x_max, y_max, expand=True):
+        """
+        矩形と重なる可能性のあるビルの番号の配列（候補）を返します。
+        expand=True の場合は包含円の半径の最大値だけ範囲を広げ、重心が矩形の外でも
+        包含円が矩形にかかるビルを含めます。
+        """
+        if expand:
+            x_min, y_min = x_min - self.max_radius, y_min - self.max_radius
+            x_max, y_max = x_max + self.max_radius, y_max + self.max_radius
+        cell_range = self.cell_range(x_min, y_min, x_max, y_max)
+        if cell_range is None:
+            return np.zeros(0, dtype=np.int64)
+        ix0, iy0, ix1, iy1 = cell_range
+        rows = np.arange(iy0, iy1 + 1) * self.nx
+        starts = self.cell_offsets[rows + ix0]
+        ends = self.cell_offsets[rows + ix1 + 1]
+        if len(rows) == 1:
+            return self.order[starts[0]:ends[0]]
+        return np.concatenate([self.order[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+
+    def query_bbox_batch(self, x_min, y_min, x_max, y_max, expand=True):
+        """
+        複数の矩形（座標の配列）をまとめて検索し、(矩形の番号, ビルの番号) の配列の組を返します。
+        query_bbox と同じく候補を返すので、正確な判定は呼び出し側で行います。
+        """
+        x_min, y_min, x_max, y_max = (np.atleast_1d(np.asarray(v, dtype=np.float64))
+                                      for v in (x_min, y_min, x_max, y_max))
+        if expand:
+            x_min, y_min = x_min - self.max_radius, y_min - self.max_radius
+            x_max, y_max = x_max + self.max_radius, y_max + self.max_radius
+        empty = np.zeros(0, dtype=np.int64)
+        if self.count == 0:
+            return empty, empty
+
+        ix0 = np.maximum(np.floor((x_min - self.origin[0]) / self.cell_size), 0)
+        iy0 = np.maximum(np.floor((y_min - self.origin[1]) / self.cell_size), 0)
+        ix1 = np.minimum(np.floor((x_max - self.origin[0]) / self.cell_size), self.nx - 1)
+        iy1 = np.minimum(np.floor((y_max - self.origin[1]) / self.cell_size), self.ny - 1)
+        valid = (ix0 <= ix1) & (iy0 <= iy1)
+        queries = np.flatnonzero(valid)
+        ix0, iy0, ix1, iy1 = (v[valid].astype(np.int64) for v in (ix0, iy0, ix1, iy1))
+
+        # 矩形ごとの各行について、連続したセルの範囲を order の範囲に変換
+        row_counts = iy1 - iy0 + 1
+        rows = ragged_arange(iy0, row_counts)
+        row_query = np.repeat(np.arange(len(queries)), row_counts)
+        starts = self.cell_offsets[rows * self.nx + ix0[row_query]]
+        ends = self.cell_offsets[rows * self.nx + ix1[row_query] + 1]
+        lengths = ends - starts
+        buildings = self.order[ragged_arange(starts, lengths)]
+        return np.repeat(queries[row_query], lengths), buildings
+
+    def query_radius(self, x, y, radius, expand=True):
+        """点 (x, y) から radius 以内にかかる可能性のあるビルの番号の配列（候補）を返します。"""
+        return self.query_bbox(x - radius, y - radius, x + radius, y + radius, expand=expand)
@@ -0,0 +1,107 @@
+import numpy as np
+
+# 名前 -> ビルを帯域に割り当てる関数
+SPECTRUM_LAYOUTS = {}
+
+
+def register_spectrum_layout(name):
+    """
+    ビルを帯域（空間的なバケット）に割り当てる関数を登録するデコレータ。
+
+    関数は重心の x, y 座標の配列、中心、範囲 (x_min, y_min, x_max, y_max) と帯域の数を受け取り、
+    各ビルの帯域の番号 (0〜band_count - 1) の配列を返します。
+    """
+    def decorator(function):
+        SPECTRUM_LAYOUTS[name] = function
+        return function
+    return decorator
+
+
+@register_spectrum_layout('radial')
+def radial_layout(x, y, center, bounds, band_count):
+    """中心から同心円状に、内側が低音・外側が高音"""
+    x_min, y_min, x_max, y_max = bounds
+    radius = np.hypot(max(abs(x_min - center[0]), abs(x_max - center[0])),
+                      max(abs(y_min - center[1]), abs(y_max - center[1])))
+    return np.hypot(x - center[0], y - center[1]) / max(radius, 1e-6) * band_count
+
+
+@register_spectrum_layout('angle')
+def angle_layout(x, y, center, bounds, band_count):
+    """中心の周りの扇形に、東から反時計回りに低音から高音"""
+    angle = np.arctan2(y - center[1], x - center[0]) % (2 * np.pi)
+    return angle / (2 * np.pi) * band_count
+
+
+@register_spectrum_layout('grid')
+def grid_layout(x, y, center, bounds, band_count):
+    """範囲をほぼ正方形のグリッドに分け、左下から右へ、下から上へ低音から高音"""
+    x_min, y_min, x_max, y_max = bounds
+    columns = int(np.ceil(np.sqrt(band_count)))
+    rows = int(np.ceil(band_count / columns))
+    column = np.clip((x - x_min) / max(x_max - x_min, 1e-6) * columns, 0, columns - 1).astype(np.int64)
+    row = np.clip((y - y_min) / max(y_max - y_min, 1e-6) * rows, 0, rows - 1).astype(np.int64)
+    return row * columns + column
+
+
+class SpectrumAnimator:
+    """
+    周波数の帯域ごとの強さで、帯域に割り当てた場所のビルの高さを全ビル分まとめて計算します。
+
+    ビルの帯域の番号 (bands) は最初に一度だけ計算し、毎回の更新は
+    「帯域の強さの配列から帯域の番号で取り出す」1 回の NumPy のインデックス操作で行います。
+    シェーダーで計算する場合は、帯域の番号を波の位相の基準値の代わりに頂点属性に書き込みます（phase_bases）。
+    """
+
+    def __init__(self, centroids, band_count=16, layout='radial', center=(2048, 2048), bounds=None,
+                 wave_height_scale=500, base_height=100, min_height=1):
+        """
+        bounds: 帯域に割り当てる範囲 (x_min, y_min, x_max, y_max)（省略時は重心を囲む矩形）
+        """
+        if layout not in SPECTRUM_LAYOUTS:
+            raise ValueError(f"Unknown spectrum layout: {layout} (available: {', '.join(SPECTRUM_LAYOUTS)})")
+        self.layout = layout
+        self.band_count = band_count
+        self.center = center
+        self.wave_height_scale = wave_height_scale  # 強さが 1 のときに加わる高さ
+        self.base_height = base_height  # 強さが 0 のときの高さ
+        self.min_height = min_height  # 最低の高さ
+
+        centroids = np.asarray(centroids, dtype=np.float32).reshape(-1, 2)
+        x, y = centroids.T
+        if bounds is None:
+            bounds = (*centroids.min(axis=0), *centroids.max(axis=0)) if len(centroids) else (0, 0, 1, 1)
+        buckets = SPECTRUM_LAYOUTS[layout](x, y, center, bounds, band_count)
+        self.bands = np.clip(np.floor(buckets), 0, band_count - 1).astype(np.int64)
+        # シェーダー用（WaveAnimator の phase_bases と同じ頂点属性に書き込む）
+        self.phase_bases = self.bands.astype(np.float32)
+        # 毎回の計算で使い回す出力用の配列
+        self._heights = np.empty(len(self.bands), dtype=np.float32)
+        self._scaled_levels = np.empty(band_count, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.bands)
+
+    @property
+    def max_height(self):
+        """強さが最大 (1) のときの高さ"""
+        return max(self.wave_height_scale + self.base_height, self.min_height)
+
+    def band_heights(self, levels):
+        """帯域ごとの強さ (0〜1) から帯域ごとの高さを計算します。"""
+        heights = self._scaled_levels
+        np.multiply(np.asarray(levels, dtype=np.float32)[:self.band_count], self.wave_height_scale, out=heights)
+        heights += self.base_height
+        np.maximum(heights, self.min_height, out=heights)
+        return heights
+
+    def heights(self, levels, buildings=None):
+        """
+        帯域ごとの強さ (0〜1) から全ビルの高さを計算します。
+        buildings（ビルの番号の配列）を指定した場合は、そのビルの高さだけを計算します。
+        返す配列は次の呼び出しで上書きされます。
+        """
+        bands = self.bands if buildings is None else self.bands[buildings]
+        heights = self._heights[:len(bands)]
+        np.take(self.band_heights(levels), bands, out=heights)
+        return heights
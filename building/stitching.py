@@ -0,0 +1,127 @@
+import numpy as np
+import shapely
+from .building_table import BuildingTable
+from .batch_geometry import process_polygon_batch, polygon_arrays
+from .triangulate import make_polygons
+
+# 切り取りとまとめで残るこれより小さい部分（面積）は捨てる
+MIN_PART_AREA = 1.0
+
+
+def parts_table(parts, part_group, group_count, ids, heights, colors):
+    """
+    ビルの部分のポリゴン (shapely) から BuildingTable を作ります。
+    part_group が同じ部分は、重心（部分の面積で重み付け）と、その重心を中心に全ての部分を含む半径を共有します。
+    """
+    if len(parts) == 0:
+        return BuildingTable.empty()
+    vertices, ring_offsets, polygon_offsets = polygon_arrays(parts)
+    result = process_polygon_batch(vertices, ring_offsets, 0, polygon_offsets=polygon_offsets)
+
+    areas = shapely.area(parts)
+    weights = np.maximum(np.bincount(part_group, areas, minlength=group_count), 1e-12)
+    centroids = np.stack([np.bincount(part_group, areas * result['centroids'][:, k], minlength=group_count)
+                          for k in range(2)], axis=1) / weights[:, None]
+    part_centroids = centroids[part_group]
+    vertex_part = np.repeat(np.arange(len(parts)), np.diff(result['ring_offsets'][result['polygon_offsets']]))
+    distances = np.hypot(*(result['vertices'] - part_centroids[vertex_part]).T)
+    radii = np.zeros(len(parts))
+    np.maximum.at(radii, vertex_part, distances)
+
+    return BuildingTable(ids, heights, result['vertices'], result['ring_offsets'], result['polygon_offsets'],
+                         part_centroids, radii, result['rect_width'], result['rect_height'], result['rect_angle'],
+                         colors)
+
+
+def stitch_tables(tables, tile_boxes, min_part_area=MIN_PART_AREA):
+    """
+    タイルごとのワールド座標の BuildingTable をつなぎ、stitch_buildings で id ごとにまとめます。
+    tile_boxes: 各タイルのバッファを除いた範囲 (x_min, y_min, x_max, y_max) のリスト
+    """
+    tile_index = np.repeat(np.arange(len(tables)), [len(table) for table in tables])
+    return stitch_buildings(BuildingTable.concatenate(tables), tile_index, tile_boxes, min_part_area)
+
+
+def stitch_buildings(table, tile_index=None, tile_boxes=None, min_part_area=MIN_PART_AREA):
+    """
+    同じ id のポリゴン（隣のタイルのバッファに入った同じビルや、MultiPolygon の各部分）を
+    1 つの論理的なビルにまとめます。
+
+    複数のタイルにまたがるビルは、各タイルのポリゴンをそのタイルのバッファを除いた範囲で切り取ってから
+    合わせるので、バッファの重なりは二重になりません。
+    まとめたビルの部分は同じ id・高さ・色・重心（部分の面積で重み付けした重心）を持つので、
+    色や波のアニメーション、カリングがビル単位で揃います。id が -1 の行はまとめません。
+
+    tile_index: 各行のタイルの番号（省略時は全て同じタイル）
+    tile_boxes: タイルの番号ごとのバッファを除いた範囲 (T, 4)
+    min_part_area: これより小さい部分を捨てる（ワールド座標の単位の面積）
+
+    戻り値は (テーブル, part_offsets) で、テーブルの行はビルの部分のポリゴンです。
+    ビル b の部分は part_offsets[b] 〜 part_offsets[b + 1] 行で、id は ids[part_offsets[:-1]] です。
+    """
+    if len(table) == 0:
+        return table, np.zeros(1, dtype=np.int64)
+    if tile_index is None:
+        tile_index = np.zeros(len(table), dtype=np.int64)
+    tile_index = np.asarray(tile_index, dtype=np.int64)
+
+    # id でまとめる（行はそれぞれの id の中で元の順のまま）
+    order = np.argsort(table.ids, kind='stable')
+    sorted_ids = table.ids[order]
+    is_start = np.ones(len(order), dtype=bool)
+    is_start[1:] = (sorted_ids[1:] != sorted_ids[:-1]) | (sorted_ids[1:] == -1)
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(order)))
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    # 部分が 1 つだけのビルはそのまま使う
+    is_merged = np.repeat(counts > 1, counts)
+    single_rows = order[~is_merged]
+    merge_rows = order[is_merged]
+    merge_group = group[is_merged]
+    if len(merge_rows) == 0:
+        return table.take(order), np.append(starts, len(order))
+
+    polygons = make_polygons(table.vertices.astype(np.float64), table.ring_offsets, table.polygon_offsets,
+                             merge_rows)
+    merged_groups, first = np.unique(merge_group, return_index=True)
+    bounds = np.append(first, len(merge_group))
+
+    # 複数のタイルにまたがるビルは、各タイルのバッファの部分を切り取る
+    clipped = polygons
+    if tile_boxes is not None:
+        tiles = tile_index[merge_rows]
+        spans = np.minimum.reduceat(tiles, first) != np.maximum.reduceat(tiles, first)
+        clip = np.repeat(spans, np.diff(bounds))
+        if clip.any():
+            boxes = np.asarray(tile_boxes, dtype=np.float64)[tiles[clip]]
+            clipped = polygons.copy()
+            clipped[clip] = shapely.intersection(polygons[clip], shapely.box(*boxes.T))
+
+    merged = np.empty(len(merged_groups), dtype=object)
+    for i in range(len(merged_groups)):
+        union = shapely.union_all(clipped[bounds[i]:bounds[i + 1]])
+        if shapely.area(union) < min_part_area:
+            # 全ての部分が他のタイルの範囲にあった場合（読み込んでいないタイル）は切り取らずに合わせる
+            union = shapely.union_all(polygons[bounds[i]:bounds[i + 1]])
+        merged[i] = union
+
+    # まとめた結果のポリゴンの各部分を行にする（元のデータと同じく外周を時計回りにする）
+    parts, part_group = shapely.get_parts(merged, return_index=True)
+    keep = shapely.get_type_id(parts) == shapely.GeometryType.POLYGON
+    keep[keep] = shapely.area(parts[keep]) >= min_part_area
+    parts, part_group = shapely.orient_polygons(parts[keep], exterior_cw=True), part_group[keep]
+    # 高さは部分の最大、色は最初の部分のもの
+    rows = merge_rows[first][part_group]
+    heights = np.maximum.reduceat(table.heights[merge_rows], first)[part_group]
+    merged_table = parts_table(parts, part_group, len(merged), table.ids[rows], heights, table.colors[rows])
+
+    # id の順に並べ直す
+    stitched = BuildingTable.concatenate([table.take(single_rows), merged_table])
+    row_groups = np.concatenate([group[~is_merged], merged_groups[part_group]]).astype(np.int64)
+    final_order = np.argsort(row_groups, kind='stable')
+    part_counts = np.bincount(row_groups, minlength=len(starts))
+    part_counts = part_counts[part_counts > 0]
+    part_offsets = np.zeros(len(part_counts) + 1, dtype=np.int64)
+    np.cumsum(part_counts, out=part_offsets[1:])
+    return stitched.take(final_order), part_offsets
@@ -0,0 +1,182 @@
+import os
+import zlib
+import numpy as np
+from .tile_cache import read_arrays, write_arrays
+
+# アーカイブの形式（write_arrays の meta に書く）
+ARCHIVE_FORMAT = 'plateau-tile-archive'
+ARCHIVE_VERSION = 1
+# タイルごとの圧縮の方法
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+
+def hilbert_tile_id(z, x, y):
+    """
+    タイル座標を PMTiles と同じタイル ID（ズームレベルの順、同じズームレベルの中はヒルベルト曲線の順）に変換します。
+    近いタイルは近い ID になるので、ID の順にデータを並べると近いタイルがファイルの近い位置に入ります。
+    """
+    base = ((1 << (2 * z)) - 1) // 3
+    d = 0
+    s = (1 << z) >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return base + d
+
+
+def _zstd():
+    # zstd はオプションの依存パッケージ（zstandard）なので、使う場合だけ読み込む
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the 'zstandard' package (pip install zstandard)") from None
+    return zstandard
+
+
+def compress_tile(data, compression, level=None):
+    if compression == 'none':
+        return bytes(data)
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    if compression == 'zstd':
+        return _zstd().ZstdCompressor(level=3 if level is None else level).compress(data)
+    raise ValueError(f"Unknown compression: {compression} (available: {', '.join(COMPRESSIONS)})")
+
+
+def decompress_tile(data, compression):
+    if compression == 'none':
+        return data
+    if compression == 'gzip':
+        return zlib.decompress(data, 31)
+    if compression == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown compression: {compression} (available: {', '.join(COMPRESSIONS)})")
+
+
+def find_tile_files(root='.', zooms=range(0, 23)):
+    """root/{z}/{x}/{y}.pbf のタイル座標とパスのリスト"""
+    tiles = []
+    for z in zooms:
+        zoom_dir = os.path.join(root, str(z))
+        if not os.path.isdir(zoom_dir):
+            continue
+        for x_entry in os.scandir(zoom_dir):
+            if not x_entry.is_dir() or not x_entry.name.isdigit():
+                continue
+            for y_entry in os.scandir(x_entry.path):
+                if y_entry.name.endswith('.pbf') and y_entry.name[:-4].isdigit():
+                    tiles.append(((z, int(x_entry.name), int(y_entry.name[:-4])), y_entry.path))
+    return tiles
+
+
+def pack_tiles(output, root='.', zooms=range(0, 23), compression='none', level=None):
+    """
+    root の {z}/{x}/{y}.pbf を 1 つのアーカイブファイルにまとめ、タイル数を返します。
+
+    ファイルは TileCache と同じ形式（write_arrays）で、ディレクトリ（タイル ID の昇順）と、
+    タイル ID の順に並べた全タイルのデータの配列を持ちます。
+    compression: タイルごとの圧縮（'none', 'gzip', 'zstd'）
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression} (available: {', '.join(COMPRESSIONS)})")
+    files = find_tile_files(root, zooms)
+    files.sort(key=lambda entry: hilbert_tile_id(*entry[0]))
+
+    blobs = []
+    offsets = np.zeros(len(files) + 1, dtype=np.uint64)
+    for i, (_, path) in enumerate(files):
+        with open(path, 'rb') as f:
+            blob = compress_tile(f.read(), compression, level)
+        blobs.append(blob)
+        offsets[i + 1] = offsets[i] + len(blob)
+
+    tiles = np.array([tile for tile, _ in files], dtype=np.uint32).reshape(-1, 3)
+    arrays = {
+        'tile_ids': np.array([hilbert_tile_id(*tile) for tile, _ in files], dtype=np.uint64),
+        'tiles': tiles,
+        'offsets': offsets,
+        'data': np.frombuffer(b''.join(blobs), dtype=np.uint8),
+    }
+    write_arrays(output, arrays, meta={'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION,
+                                       'compression': compression})
+    return len(files)
+
+
+class TileArchive:
+    """
+    pack_tiles で作ったアーカイブをメモリマップし、タイル座標からタイルのデータを取り出します。
+
+    ディレクトリはタイル ID の昇順なので二分探索で探し、圧縮していないアーカイブでは
+    メモリマップの memoryview をそのまま返します（データはコピーしません）。
+    プロセスプールに渡すときはパスだけを渡し、各プロセスで開き直します。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        arrays, meta = read_arrays(path)
+        if meta.get('format') != ARCHIVE_FORMAT:
+            raise ValueError(f"Not a tile archive: {path}")
+        if meta.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported tile archive version: {meta.get('version')}")
+        self.compression = meta['compression']
+        self.tile_ids = arrays['tile_ids']
+        self.tile_coords = arrays['tiles']
+        self.offsets = arrays['offsets']
+        self.data = arrays['data']
+        self._view = memoryview(self.data)
+        # キャッシュのキーに使うアーカイブの識別子
+        stat = os.stat(path)
+        self.source = f'{stat.st_mtime_ns}:{stat.st_size}'
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.tile_ids)
+
+    def __contains__(self, tile):
+        return self.find(*tile) >= 0
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def find(self, z, x, y):
+        """タイルのディレクトリの番号（ない場合は -1）"""
+        tile_id = hilbert_tile_id(z, x, y)
+        index = int(np.searchsorted(self.tile_ids, tile_id))
+        if index < len(self.tile_ids) and self.tile_ids[index] == tile_id:
+            return index
+        return -1
+
+    def tiles(self, z=None):
+        """アーカイブのタイル座標のリスト（z を指定した場合はそのズームレベルだけ）"""
+        coords = self.tile_coords if z is None else self.tile_coords[self.tile_coords[:, 0] == z]
+        return [tuple(tile) for tile in coords.tolist()]
+
+    def get(self, z, x, y):
+        """
+        タイルの pbf のバイト列を返します（ない場合は None）。
+        圧縮していない場合はメモリマップの memoryview で、圧縮している場合は展開した bytes です。
+        """
+        index = self.find(z, x, y)
+        if index < 0:
+            return None
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return decompress_tile(self._view[start:end], self.compression)
+
+    def tile_key(self, z, x, y):
+        """TileCache のキーに使うタイルの識別子（アーカイブを作り直すと変わる）"""
+        index = self.find(z, x, y)
+        return f'{self.source}:{int(self.offsets[index])}:{int(self.offsets[index + 1] - self.offsets[index])}'
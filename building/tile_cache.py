@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# キャッシュファイルの先頭に置くマジックナンバー
+CACHE_MAGIC = b'PLTC'
+# 配列データの境界（メモリマップ時のアラインメント）
+CACHE_ALIGNMENT = 64
+# このプロセスで読んだキャッシュのディレクトリごとのファイル一覧（プロセスプールのタスクの間で使い回す）
+_process_entries = {}
+
+
+def write_arrays(path, arrays, meta=None):
+    """
+    配列の辞書を「ヘッダー + 生バッファ」形式のファイルに書き込みます。
+
+    ファイルの構成:
+    - マジックナンバー (4 バイト) + ヘッダー長 (uint32, 4 バイト)
+    - JSON ヘッダー（各配列の dtype, shape, オフセットと meta）
+    - CACHE_ALIGNMENT 境界に揃えた各配列の生データ
+    """
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += _align(array.nbytes)
+
+    header = json.dumps({'arrays': entries, 'meta': meta or {}}).encode('utf-8')
+    data_start = _align(8 + len(header))
+
+    # 書き込み途中のファイルが読まれないように一時ファイルから置き換える
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        f.write(b'\0' * (data_start - 8 - len(header)))
+        for name, array in arrays.items():
+            f.write(array.tobytes())
+            f.write(b'\0' * (_align(array.nbytes) - array.nbytes))
+    os.replace(tmp_path, path)
+
+
+def read_arrays(path):
+    """
+    write_arrays で書いたファイルをメモリマップし、(配列の辞書, meta) を返します。
+    配列は読み取り専用のビューで、データはコピーされません。
+    """
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(buffer[:4]) != CACHE_MAGIC:
+        raise ValueError(f"Not a tile cache file: {path}")
+    header_length = int.from_bytes(bytes(buffer[4:8]), 'little')
+    header = json.loads(bytes(buffer[8:8 + header_length]).decode('utf-8'))
+    data_start = _align(8 + header_length)
+
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        start = data_start + entry['offset']
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+    return arrays, header['meta']
+
+
+def _align(size):
+    return (size + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
+
+
+class TileCache:
+    """
+    処理済みタイルをディスクに保存するキャッシュ。
+
+    キーはタイル座標、pbf ファイルの更新時刻とサイズ（または内容のハッシュ）、
+    簡略化の許容値、ローダーのバージョンから作られます。
+    合計サイズが max_bytes を超えると、最後に使われた時刻が古いものから削除します。
+    """
+
+    def __init__(self, cache_dir='.tile_cache', max_bytes=1 << 30, content_hash=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # True の場合は更新時刻ではなく pbf の内容のハッシュをキーに使う
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        # ファイル名 -> サイズ（古い順）、必要になるまで作らない
+        self._entries = None
+
+    def __getstate__(self):
+        # プロセスプールに渡すときはファイル一覧を含めない
+        state = self.__dict__.copy()
+        state['_entries'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # タスクごとに渡されるので、同じプロセスの前のタスクが読んだファイル一覧を引き継ぐ
+        # （put のたびにディレクトリを読み直さない。他のプロセスが書いたファイルは次に読み直すまで数えない）
+        self._entries = _process_entries.get(os.path.abspath(self.cache_dir))
+
+    def cache_key(self, z, x, y, pbf_file, tolerance, version, source=None):
+        """
+        キャッシュのキーとなるハッシュ文字列
+        source: pbf ファイルの代わりにタイルのデータを識別する文字列（アーカイブから読む場合）
+        """
+        if source is None and self.content_hash:
+            with open(pbf_file, 'rb') as f:
+                source = hashlib.sha1(f.read()).hexdigest()
+        elif source is None:
+            stat = os.stat(pbf_file)
+            source = f'{stat.st_mtime_ns}:{stat.st_size}'
+        key = f'{z}/{x}/{y}|{source}|{tolerance}|{version}'
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    def path_for(self, z, x, y, key):
+        return os.path.join(self.cache_dir, f'{z}-{x}-{y}-{key}.bin')
+
+    def get(self, z, x, y, key):
+        """
+        キャッシュされた配列の辞書を返します。見つからない場合は None を返します。
+        """
+        path = self.path_for(z, x, y, key)
+        try:
+            arrays, _ = read_arrays(path)
+            # 最後に使われた時刻として更新時刻を更新する
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entries = self._load_entries()
+        name = os.path.basename(path)
+        if name in entries:
+            entries.move_to_end(name)
+        return arrays
+
+    def put(self, z, x, y, key, arrays):
+        """配列の辞書をキャッシュに保存し、必要なら古いものを削除します。"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = self._load_entries()
+
+        # 同じタイルの古いキーのファイルを削除
+        prefix = f'{z}-{x}-{y}-'
+        for name in [name for name in entries if name.startswith(prefix)]:
+            self._remove(name)
+
+        path = self.path_for(z, x, y, key)
+        write_arrays(path, dict(arrays), meta={'tile': [z, x, y], 'key': key})
+        entries[os.path.basename(path)] = os.path.getsize(path)
+        self.evict()
+
+    def evict(self):
+        """合計サイズが max_bytes 以下になるまで、古いものから削除します。"""
+        entries = self._load_entries()
+        total = sum(entries.values())
+        while entries and total > self.max_bytes:
+            name, size = next(iter(entries.items()))
+            self._remove(name)
+            total -= size
+
+    def total_bytes(self):
+        return sum(self._load_entries().values())
+
+    def clear(self):
+        for name in list(self._load_entries()):
+            self._remove(name)
+
+    def _remove(self, name):
+        self._entries.pop(name, None)
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+            # 他のプロセスが先に削除した
+            pass
+
+    def _load_entries(self):
+        if self._entries is None:
+            files = []
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith('.bin'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime_ns, entry.name, stat.st_size))
+            files.sort()
+            self._entries = OrderedDict((name, size) for _, name, size in files)
+            _process_entries[os.path.abspath(self.cache_dir)] = self._entries
+        return self._entries
@@ -0,0 +1,413 @@
+import glob
+import os
+import time
+import threading
+import queue
+import numpy as np
+from panda3d.core import BoundingBox, Point3
+from .data_loader import DataLoader, TILE_EXTENT, DEFAULT_COLOR
+from .building_table import BuildingTable
+from .geometry_generator import GeometryGenerator
+
+
+def tile_overlaps(a, b):
+    """タイル a と b の範囲が重なる（どちらかがもう一方の祖先か同じタイル）かどうか"""
+    (za, xa, ya), (zb, xb, yb) = a, b
+    if za > zb:
+        (za, xa, ya), (zb, xb, yb) = (zb, xb, yb), (za, xa, ya)
+    shift = zb - za
+    return xb >> shift == xa and yb >> shift == ya
+
+
+class StreamedTile:
+    """
+    TileStreamer が読み込んだ 1 タイル分のビルと描画用のノード。
+    """
+
+    def __init__(self, tile, table, node, batched_buildings, instanced_boxes):
+        self.tile = tile
+        self.table = table
+        self.node = node
+        self.batched_buildings = batched_buildings
+        self.instanced_boxes = instanced_boxes
+        self.visible = True
+        # 最後に表示対象になった時刻（メモリの上限を超えたときに古いものから解放する）
+        self.last_wanted = time.monotonic()
+        # main.py などが波のアニメーションを関連付けるための属性
+        self.wave_animator = None
+        self.equalizer_shader = None
+        self.nbytes = table.nbytes + StreamedTile.geometry_nbytes(batched_buildings, instanced_boxes)
+
+    @staticmethod
+    def geometry_nbytes(batched_buildings, instanced_boxes):
+        """頂点・インデックス・インスタンスデータのおおよそのバイト数"""
+        nbytes = 0
+        if batched_buildings is not None and len(batched_buildings.vertex_ranges):
+            nbytes += int(batched_buildings.vertex_ranges[-1, 1]) * batched_buildings.stride * 4
+            nbytes += int(batched_buildings.index_ranges[-1, 1]) * 4
+            nbytes += len(batched_buildings.table) * 16
+        if instanced_boxes is not None:
+            nbytes += len(instanced_boxes) * 3 * 16
+        return nbytes
+
+    def set_colors(self, colors):
+        """全ビルの色 (N, 4) を、テーブルと描画中のジオメトリにまとめて反映します。"""
+        self.table.colors[:] = colors
+        if self.batched_buildings is not None:
+            self.batched_buildings.set_colors(self.table.colors)
+        if self.instanced_boxes is not None:
+            self.instanced_boxes.set_colors(self.table.colors)
+
+    def set_visible(self, visible):
+        if visible != self.visible:
+            if visible:
+                self.node.unstash()
+            else:
+                self.node.stash()
+            self.visible = visible
+
+    def remove(self):
+        self.node.removeNode()
+
+
+class TileStreamer:
+    """
+    カメラの位置と視錐台から表示するタイルを選び、バックグラウンドのスレッドで読み込み・解放します。
+
+    ズーム min_zoom〜max_zoom のタイルを四分木としてたどり、視錐台に入るタイルのうち
+    カメラに近い（タイルの大きさの lod_factor 倍より近い）ものは子のタイルに細分化します。
+    そのためカメラの近くは max_zoom、遠くは min_zoom に近い粗いタイルになります。
+
+    座標は max_zoom のタイル origin_tile の左下を原点とし、max_zoom のタイルのローカル座標
+    (0〜4096) を単位とするワールド座標です。粗いズームのタイルはその分だけ拡大して配置します。
+
+    読み込んだタイルのメモリ量（BuildingTable と頂点データ）の合計が max_bytes を超えないように、
+    表示していないタイルを古い順に解放し、上限に達している間は新しいタイルを読み込みません。
+    """
+
+    def __init__(self, base, world_node, parent_node, origin_tile, min_zoom=10, max_zoom=16, lod_factor=2.0,
+                 max_bytes=512 << 20, image_path=None, cache=None, min_height=0, wireframe=False,
+                 instanced_rect_buildings=True, max_building_height=1000,
+                 on_tile_loaded=None, on_tile_unloaded=None, color_sampling='nearest', archive=None,
+                 vertex_budget=None):
+        """
+        base: ShowBase（カメラとレンズ、タスクマネージャーを使用）
+        world_node: ワールド座標系のノード
+        parent_node: タイルのノードを配置するノード（world_node の子）
+        origin_tile: ワールド座標の原点となる (z, x, y)。z が max_zoom でない場合は max_zoom に換算します
+        on_tile_loaded / on_tile_unloaded: タイルを表示用に作成した後・解放する前に StreamedTile を渡して呼ぶ関数
+        color_sampling: 画像から色を取り出す方法（'nearest', 'bilinear', 'area'）
+        archive: pbf を読むアーカイブ (TileArchive)。None の場合は {z}/{x}/{y}.pbf のファイルから読みます
+        vertex_budget: タイルごとに描画する頂点数の上限（DataLoader を参照）
+        """
+        self.base = base
+        self.world_node = world_node
+        self.parent_node = parent_node
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.lod_factor = lod_factor
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.archive = archive
+        self.vertex_budget = vertex_budget
+        self.min_height = min_height
+        self.wireframe = wireframe
+        self.instanced_rect_buildings = instanced_rect_buildings
+        # 視錐台の判定に使うタイルの高さの上限
+        self.max_building_height = max_building_height
+        self.on_tile_loaded = on_tile_loaded
+        self.on_tile_unloaded = on_tile_unloaded
+
+        z, x, y = origin_tile
+        self.origin_x = x << (max_zoom - z)
+        self.origin_y = y << (max_zoom - z)
+
+        # pbf ファイルの有無（毎フレームのファイルアクセスを避けるために記録）
+        self._exists = {}
+        if archive is not None:
+            self.root_tiles = sorted(archive.tiles(min_zoom))
+        else:
+            self.root_tiles = sorted(
+                (min_zoom, int(x), int(os.path.splitext(y)[0]))
+                for x, y in (path.split(os.sep)[-2:]
+                             for path in glob.glob(os.path.join(str(min_zoom), '*', '*.pbf'))))
+        for tile in self.root_tiles:
+            self._exists[tile] = True
+
+        # 画像は全ルートタイルの範囲に対応させて色を付ける
+        self.color_bounds = None
+        if self.root_tiles:
+            bounds = [self.tile_bounds(tile) for tile in self.root_tiles]
+            self.color_bounds = (min(b[0] for b in bounds), min(b[1] for b in bounds),
+                                 max(b[2] for b in bounds), max(b[3] for b in bounds))
+        self.color_sampling = color_sampling
+        self.painter = self.make_painter(image_path)
+
+        self.loaded = {}  # (z, x, y) -> StreamedTile
+        self.wanted = []  # 表示対象のタイル（カメラに近い順）
+        self.total_bytes = 0
+
+        # バックグラウンドのスレッドとの受け渡し
+        self._requests = queue.PriorityQueue()
+        self._results = queue.Queue()
+        self._pending = set()
+        # 読み込みに失敗したタイル（再度要求しない）
+        self._failed = set()
+        self._wanted_set = frozenset()
+        self._sequence = 0
+        self._thread = threading.Thread(target=self._worker, name='tile_streamer', daemon=True)
+        self._thread.start()
+
+        self.base.taskMgr.add(self.update_task, 'tile_streaming_task')
+
+    def tile_exists(self, tile):
+        exists = self._exists.get(tile)
+        if exists is None:
+            z, x, y = tile
+            if self.archive is not None:
+                exists = tile in self.archive
+            else:
+                exists = os.path.isfile(f'{z}/{x}/{y}.pbf')
+            self._exists[tile] = exists
+        return exists
+
+    def tile_scale(self, tile):
+        """タイルのローカル座標からワールド座標への拡大率"""
+        return 1 << (self.max_zoom - tile[0])
+
+    def tile_bounds(self, tile):
+        """タイルのワールド座標の範囲 (x_min, y_min, x_max, y_max)"""
+        z, x, y = tile
+        scale = self.tile_scale(tile)
+        x_min = (x * scale - self.origin_x) * TILE_EXTENT
+        y_min = (self.origin_y + 1 - (y + 1) * scale) * TILE_EXTENT
+        size = scale * TILE_EXTENT
+        return x_min, y_min, x_min + size, y_min + size
+
+    def make_painter(self, image_path):
+        """ビルの色を取得する DataLoader（画像や対応させる範囲がない場合は None）"""
+        if not image_path or self.color_bounds is None:
+            return None
+        return DataLoader(self.max_zoom, self.origin_x, self.origin_y, image_path, color_bounds=self.color_bounds,
+                          color_sampling=self.color_sampling)
+
+    def set_image(self, image_path):
+        """
+        色を付ける画像を切り替え、読み込み済みのタイルの色を塗り直します（ジオメトリは作り直しません）。
+        image_path が None の場合は色を付けません（白）。
+        """
+        self.painter = self.make_painter(image_path)
+        for entry in self.loaded.values():
+            entry.set_colors(self.table_colors(entry.table.arrays(), self.painter))
+
+    @staticmethod
+    def table_colors(arrays, painter):
+        if painter is None:
+            return np.tile(np.asarray(DEFAULT_COLOR, dtype=np.float32), (len(arrays['centroids']), 1))
+        return painter.get_table_colors(arrays)
+
+    def to_world_table(self, tile, table, painter=None):
+        """タイルのローカル座標の BuildingTable をワールド座標に移します。"""
+        scale = self.tile_scale(tile)
+        x_min, y_min, _, _ = self.tile_bounds(tile)
+        offset = np.array([x_min, y_min], dtype=np.float32)
+        arrays = table.arrays()
+        # キャッシュから読んだ配列は読み取り専用なので新しい配列を作る
+        arrays['vertices'] = arrays['vertices'] * scale + offset
+        arrays['centroids'] = arrays['centroids'] * scale + offset
+        for name in ('radii', 'rect_width', 'rect_height'):
+            arrays[name] = arrays[name] * scale
+        if painter is not None:
+            arrays['colors'] = painter.get_table_colors(arrays)
+        return BuildingTable(**arrays)
+
+    def select_tiles(self):
+        """
+        カメラから見えるタイルを四分木でたどって選び、カメラに近い順に (距離, タイル) のリストで返します。
+        """
+        camera_pos = self.base.camera.getPos(self.world_node)
+        frustum = self.base.camLens.makeBounds()
+        frustum.xform(self.base.cam.getMat(self.world_node))
+
+        selected = []
+        stack = list(self.root_tiles)
+        while stack:
+            tile = stack.pop()
+            x_min, y_min, x_max, y_max = self.tile_bounds(tile)
+            box = BoundingBox(Point3(x_min, y_min, 0), Point3(x_max, y_max, self.max_building_height))
+            if not frustum.contains(box):
+                continue
+
+            # タイルの範囲内でカメラに最も近い点までの距離
+            dx = max(x_min - camera_pos.x, 0, camera_pos.x - x_max)
+            dy = max(y_min - camera_pos.y, 0, camera_pos.y - y_max)
+            dz = max(camera_pos.z - self.max_building_height, 0, -camera_pos.z)
+            distance = float(np.sqrt(dx * dx + dy * dy + dz * dz))
+
+            z, x, y = tile
+            if z < self.max_zoom and distance < self.lod_factor * (x_max - x_min):
+                children = [(z + 1, 2 * x + i, 2 * y + j) for i in (0, 1) for j in (0, 1)]
+                children = [child for child in children if self.tile_exists(child)]
+                if children:
+                    stack.extend(children)
+                    continue
+            selected.append((distance, tile))
+
+        selected.sort()
+        return selected
+
+    def update_task(self, task):
+        self.update()
+        return task.cont
+
+    def update(self, wait=False):
+        """
+        毎フレーム呼ばれ、読み込みが終わったタイルの表示、表示対象の更新、
+        タイルの表示の切り替え、メモリの上限を超えた分の解放、読み込み要求を行います。
+        wait が True の場合は要求したタイルの読み込みが終わるまで待ち、同じフレームで表示します
+        （ヘッドレスでの実行で、毎回同じタイルを同じフレームに表示するため）。
+        """
+        self.receive_results()
+
+        selected = self.select_tiles()
+        self.wanted = [tile for _, tile in selected]
+        wanted_set = frozenset(self.wanted)
+        self._wanted_set = wanted_set
+        now = time.monotonic()
+        for tile in self.wanted:
+            if tile in self.loaded:
+                self.loaded[tile].last_wanted = now
+
+        self.update_visibility(wanted_set)
+        self.evict()
+
+        # メモリの上限に達していなければ、近いタイルから読み込みを要求
+        # （読み込み中のタイルは読み込み済みのタイルの平均の大きさで見積もる）
+        estimate = self.total_bytes / len(self.loaded) if self.loaded else 0
+        for distance, tile in selected:
+            if self.total_bytes + len(self._pending) * estimate >= self.max_bytes:
+                break
+            if tile in self.loaded or tile in self._pending or tile in self._failed:
+                continue
+            self._pending.add(tile)
+            self._sequence += 1
+            self._requests.put((distance, self._sequence, tile))
+
+        if wait and self._pending:
+            self.receive_results(wait=True)
+            self.update_visibility(wanted_set)
+
+    def update_visibility(self, wanted_set):
+        """
+        表示対象のタイルを表示します。
+        表示対象ではないタイルは、重なる表示対象のタイルがまだ読み込まれていない間だけ代わりに表示し、
+        その間は重なる表示対象のタイルを隠して二重に描画しないようにします。
+        """
+        missing = [tile for tile in self.wanted if tile not in self.loaded]
+        placeholders = set()
+        for tile, entry in self.loaded.items():
+            if tile not in wanted_set and any(tile_overlaps(tile, other) for other in missing):
+                placeholders.add(tile)
+        for tile, entry in self.loaded.items():
+            if tile in placeholders:
+                entry.set_visible(True)
+            elif tile in wanted_set:
+                entry.set_visible(not any(tile_overlaps(tile, other) for other in placeholders))
+            else:
+                entry.set_visible(False)
+
+    def evict(self):
+        """メモリの上限を超えている間、表示していないタイルを古い順に解放します。"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        hidden = sorted((entry for entry in self.loaded.values() if not entry.visible),
+                        key=lambda entry: entry.last_wanted)
+        for entry in hidden:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.unload(entry.tile)
+
+    def receive_results(self, wait=False):
+        """
+        バックグラウンドのスレッドで読み込み終わったタイルの描画用のノードを作成します。
+        wait が True の場合は要求済みのタイルが全て読み込み終わるまで待ちます。
+        """
+        while True:
+            try:
+                if wait and self._pending:
+                    tile, table, painter = self._results.get()
+                else:
+                    tile, table, painter = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._pending.discard(tile)
+            if table is None or tile in self.loaded:
+                continue
+            # 読み込み中に画像が切り替わった場合は塗り直す
+            if painter is not self.painter:
+                table.colors[:] = self.table_colors(table.arrays(), self.painter)
+            self.loaded[tile] = entry = self.create_tile(tile, table)
+            self.total_bytes += entry.nbytes
+            if self.on_tile_loaded is not None:
+                self.on_tile_loaded(entry)
+
+    def create_tile(self, tile, table):
+        z, x, y = tile
+        node = self.parent_node.attachNewNode(f'tile_{z}_{x}_{y}')
+        batched_buildings = GeometryGenerator.create_batched_buildings(
+            node, table, min_height=self.min_height, wireframe=self.wireframe,
+            include_rect=not self.instanced_rect_buildings)
+        instanced_boxes = None
+        if self.instanced_rect_buildings:
+            instanced_boxes = GeometryGenerator.create_instanced_rect_buildings(
+                node, table, min_height=self.min_height, wireframe=self.wireframe)
+        entry = StreamedTile(tile, table, node, batched_buildings, instanced_boxes)
+        # 表示するかどうかは次の update_visibility で決める
+        entry.set_visible(False)
+        return entry
+
+    def unload(self, tile):
+        entry = self.loaded.pop(tile)
+        if self.on_tile_unloaded is not None:
+            self.on_tile_unloaded(entry)
+        entry.remove()
+        self.total_bytes -= entry.nbytes
+
+    def _worker(self):
+        while True:
+            _, _, tile = self._requests.get()
+            if tile is None:
+                return
+            # 要求した後で表示対象から外れたタイルは読み込まない
+            if tile not in self._wanted_set:
+                self._results.put((tile, None, None))
+                continue
+            painter = self.painter
+            try:
+                z, x, y = tile
+                table = DataLoader(z, x, y, None, cache=self.cache, archive=self.archive,
+                                   vertex_budget=self.vertex_budget).load_building_table()
+                table = self.to_world_table(tile, table, painter)
+            except Exception as e:
+                print(f"Failed to load tile {tile}: {e}")
+                self._failed.add(tile)
+                table = None
+            self._results.put((tile, table, painter))
+
+    def stop(self):
+        """バックグラウンドのスレッドを止め、全タイルを解放します。"""
+        self.base.taskMgr.remove('tile_streaming_task')
+        self._requests.put((-1, -1, None))
+        self._thread.join()
+        for tile in list(self.loaded):
+            self.unload(tile)
+
+    def status(self):
+        """読み込み状況の文字列"""
+        zooms = {}
+        for tile, entry in self.loaded.items():
+            if entry.visible:
+                zooms[tile[0]] = zooms.get(tile[0], 0) + 1
+        per_zoom = ', '.join(f'z{z}: {count}' for z, count in sorted(zooms.items()))
+        return (f"tiles: {len(self.loaded)} loaded, {len(self.wanted)} wanted, {len(self._pending)} pending "
+                f"({per_zoom}), {self.total_bytes / (1 << 20):.1f} / {self.max_bytes / (1 << 20):.0f} MB")
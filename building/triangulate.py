@@ -0,0 +1,311 @@
+import numpy as np
+import shapely
+from shapely.errors import GEOSException
+from .mvt_decoder import ragged_arange
+
+
+def triangulate_polygons(vertices, ring_offsets, polygon_offsets):
+    """
+    穴のあるポリゴンをタイル単位でまとめて三角形分割します。
+
+    vertices: 全リングの頂点を連結した (V, 2) 配列（各リングは閉じた形）
+    ring_offsets: リング r の頂点が vertices[ring_offsets[r]:ring_offsets[r + 1]] となるオフセット配列
+    polygon_offsets: ポリゴン p のリング（先頭が外周、残りが穴）の範囲を表すオフセット配列
+
+    戻り値は (triangles, triangle_offsets) です。
+    - triangles: vertices の行番号による三角形 (T, 3)。上から見て反時計回りに揃えます
+    - triangle_offsets: ポリゴン p の三角形が triangles[triangle_offsets[p]:triangle_offsets[p + 1]]
+
+    有効なポリゴンは GEOS の制約付きドロネー三角形分割でまとめて処理し、
+    自己交差などで失敗するポリゴンだけ耳刈り法 (ear_clip) で個別に処理します。
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+    polygon_offsets = np.asarray(polygon_offsets, dtype=np.int64)
+    polygon_count = len(polygon_offsets) - 1
+    ring_count = len(ring_offsets) - 1
+    if polygon_count == 0:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    ring_lengths = np.diff(ring_offsets)
+    vertex_ring = np.repeat(np.arange(ring_count), ring_lengths)
+    ring_polygon = np.repeat(np.arange(polygon_count), np.diff(polygon_offsets))
+    vertex_polygon = ring_polygon[vertex_ring]
+
+    # 外周が 4 点（閉じた三角形）未満のポリゴンは面がないので除外
+    exterior_lengths = np.zeros(polygon_count, dtype=np.int64)
+    has_rings = np.diff(polygon_offsets) > 0
+    exterior_lengths[has_rings] = ring_lengths[polygon_offsets[:-1][has_rings]]
+    usable = exterior_lengths >= 4
+    # 4 点未満のリング（穴）は shapely で扱えないので、そのポリゴンは個別に処理
+    short_ring_polygons = np.unique(ring_polygon[ring_lengths < 4])
+    fallback = np.zeros(polygon_count, dtype=bool)
+    fallback[short_ring_polygons] = True
+    fallback &= usable
+
+    # 制約付きドロネー三角形分割でまとめて処理
+    batch = np.flatnonzero(usable & ~fallback)
+    polygons = make_polygons(vertices, ring_offsets, polygon_offsets, batch)
+    valid = shapely.is_valid(polygons)
+    fallback[batch[~valid]] = True
+    batch, polygons = batch[valid], polygons[valid]
+
+    triangle_polygon = np.zeros(0, dtype=np.int64)
+    triangles = np.zeros((0, 3), dtype=np.int64)
+    if len(batch):
+        try:
+            collections = shapely.constrained_delaunay_triangles(polygons)
+        except GEOSException:
+            collections = None
+        if collections is None:
+            fallback[batch] = True
+        else:
+            parts, part_index = shapely.get_parts(collections, return_index=True)
+            triangle_polygon = batch[part_index]
+            corners = shapely.get_coordinates(parts).reshape(-1, 4, 2)[:, :3]
+            triangles = _match_vertices(vertices, vertex_polygon, corners, triangle_polygon)
+            # 入力の頂点に対応しない点が出たポリゴンは個別に処理
+            unmatched = np.unique(triangle_polygon[(triangles < 0).any(axis=1)])
+            if len(unmatched):
+                fallback[unmatched] = True
+                keep = ~fallback[triangle_polygon]
+                triangles, triangle_polygon = triangles[keep], triangle_polygon[keep]
+
+    # 残りのポリゴンは耳刈り法で個別に処理
+    extra_triangles = [triangles]
+    extra_polygon = [triangle_polygon]
+    for p in np.flatnonzero(fallback):
+        rings = [(ring_offsets[r], ring_offsets[r + 1]) for r in range(polygon_offsets[p], polygon_offsets[p + 1])]
+        local = triangulate_rings([vertices[start:end] for start, end in rings])
+        if len(local) == 0:
+            continue
+        # リングごとの局所的な番号を vertices の行番号に変換
+        ring_starts = np.array([start for start, _ in rings])
+        local_offsets = np.cumsum([0] + [end - start for start, end in rings])
+        ring_of_local = np.searchsorted(local_offsets, local, side='right') - 1
+        extra_triangles.append(ring_starts[ring_of_local] + local - local_offsets[ring_of_local])
+        extra_polygon.append(np.full(len(local), p, dtype=np.int64))
+    triangles = np.concatenate(extra_triangles)
+    triangle_polygon = np.concatenate(extra_polygon)
+
+    # 上から見て反時計回りに揃える
+    a, b, c = (vertices[triangles[:, k]] for k in range(3))
+    clockwise = _cross(a.T, b.T, c.T) < 0
+    triangles[clockwise] = triangles[clockwise][:, [0, 2, 1]]
+
+    # ポリゴンの順に並べ替える
+    order = np.argsort(triangle_polygon, kind='stable')
+    triangle_offsets = np.zeros(polygon_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(triangle_polygon, minlength=polygon_count), out=triangle_offsets[1:])
+    return triangles[order], triangle_offsets
+
+
+def triangulate_rings(rings):
+    """
+    1 つのポリゴンのリングのリスト（先頭が外周、残りが穴）を三角形分割します。
+    戻り値はリングを連結した頂点の番号による三角形 (T, 3) です。
+    耳刈り法で分割できない場合は、外周の頂点 0 からの扇形で分割します。
+    """
+    rings = [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings]
+    if not rings or len(rings[0]) < 3:
+        return np.zeros((0, 3), dtype=np.int64)
+    triangles = ear_clip(rings)
+    if triangles is None:
+        # 扇形 (0, i, i + 1)（閉じる点は除く）
+        n = len(rings[0]) - 1 if np.array_equal(rings[0][0], rings[0][-1]) else len(rings[0])
+        i = np.arange(1, n - 1)
+        triangles = np.stack([np.zeros_like(i), i, i + 1], axis=1) if n >= 3 else np.zeros((0, 3))
+    return np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def ear_clip(rings):
+    """
+    耳刈り法による三角形分割（earcut と同じく、穴を外周につないで 1 つのリングにしてから分割）。
+    rings はリングの座標配列のリストで、戻り値は連結した頂点の番号による三角形のリストです。
+    分割できない場合（自己交差など）は None を返します。
+    """
+    points = np.concatenate(rings)
+    offsets = np.cumsum([0] + [len(ring) for ring in rings])
+
+    def open_ring(r):
+        # 閉じる点を除いた頂点番号
+        start, end = offsets[r], offsets[r + 1]
+        if end - start > 1 and np.array_equal(points[start], points[end - 1]):
+            end -= 1
+        return list(range(start, end))
+
+    def signed_area(ring):
+        x, y = points[ring, 0], points[ring, 1]
+        return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+    # 外周は反時計回り、穴は時計回りにする
+    outer = open_ring(0)
+    if len(outer) < 3:
+        return None
+    if signed_area(outer) < 0:
+        outer.reverse()
+    holes = []
+    for r in range(1, len(rings)):
+        hole = open_ring(r)
+        if len(hole) < 3:
+            continue
+        if signed_area(hole) > 0:
+            hole.reverse()
+        holes.append(hole)
+
+    # x 座標が大きい穴から順に外周につなぐ
+    holes.sort(key=lambda hole: -points[hole, 0].max())
+    for hole in holes:
+        outer = _bridge_hole(points, outer, hole)
+        if outer is None:
+            return None
+
+    triangles = []
+    ring = outer
+    guard = 0
+    i = 0
+    while len(ring) > 3:
+        n = len(ring)
+        prev, cur, nxt = ring[(i - 1) % n], ring[i % n], ring[(i + 1) % n]
+        if _cross(points[prev], points[cur], points[nxt]) == 0:
+            # 一直線上の頂点は三角形を作らずに取り除く
+            del ring[i % n]
+            guard = 0
+        elif _is_ear(points, ring, i):
+            triangles.append((prev, cur, nxt))
+            del ring[i % n]
+            guard = 0
+        else:
+            i += 1
+            guard += 1
+            if guard > n:
+                return None
+    if len(ring) == 3:
+        triangles.append(tuple(ring))
+    return triangles
+
+
+def _is_ear(points, ring, i):
+    n = len(ring)
+    prev, cur, nxt = ring[(i - 1) % n], ring[i % n], ring[(i + 1) % n]
+    a, b, c = points[prev], points[cur], points[nxt]
+    # 凸の頂点（反時計回り）でなければ耳ではない
+    if _cross(a, b, c) <= 0:
+        return False
+    # 三角形の内部に他の凹の頂点がないこと（earcut と同じく、凸の頂点は内部にあっても判定に影響しない）
+    for k, index in enumerate(ring):
+        p = points[index]
+        if index in (prev, cur, nxt) or (p == a).all() or (p == b).all() or (p == c).all():
+            continue
+        if _cross(a, b, p) >= 0 and _cross(b, c, p) >= 0 and _cross(c, a, p) >= 0 \
+                and _cross(points[ring[k - 1]], p, points[ring[(k + 1) % n]]) <= 0:
+            return False
+    return True
+
+
+def _bridge_hole(points, outer, hole):
+    """
+    穴の最も右の頂点から +x 方向に見える外周の頂点を探し、往復する辺で穴を外周につなぎます。
+    """
+    # 外周に接している穴は、接している頂点でつなぐ
+    for start, h in enumerate(hole):
+        following = points[hole[(start + 1) % len(hole)]]
+        for k, index in enumerate(outer):
+            if (points[index] == points[h]).all() and _locally_inside(points, outer, k, following):
+                return outer[:k + 1] + hole[start + 1:] + hole[:start] + outer[k:]
+
+    h = max(hole, key=lambda index: points[index, 0])
+    hx, hy = points[h]
+
+    # +x 方向の半直線と交わる最も近い外周の辺
+    best_x, best = np.inf, None
+    n = len(outer)
+    for k in range(n):
+        a, b = outer[k], outer[(k + 1) % n]
+        (ax, ay), (bx, by) = points[a], points[b]
+        if (ay <= hy <= by or by <= hy <= ay) and ay != by:
+            x = ax + (hy - ay) * (bx - ax) / (by - ay)
+            if hx <= x < best_x:
+                best_x = x
+                # 辺の端点のうち x が大きい方を候補にする
+                best = k if ax > bx else (k + 1) % n
+    if best is None:
+        return None
+
+    # 候補との間（交点・候補・穴の頂点の三角形の内部）に外周の頂点があれば、
+    # 半直線との角度が最も小さいものにつなぐ
+    candidate = outer[best]
+    triangle = (points[h], np.array([best_x, hy]), points[candidate])
+    best_tan = np.inf
+    for k, index in enumerate(outer):
+        px, py = points[index]
+        if index == candidate or px < hx:
+            continue
+        if _inside_triangle(triangle, points[index]):
+            tan = abs(hy - py) / (px - hx) if px != hx else np.inf
+            if tan < best_tan:
+                best_tan, best = tan, k
+
+    # 穴をつないだ頂点は外周に複数回現れるので、穴の頂点が内側に見える位置を選ぶ
+    for k, index in enumerate(outer):
+        if index == outer[best] and _locally_inside(points, outer, k, points[h]):
+            best = k
+            break
+
+    # 外周 ... m, h, 穴の残り ..., h, m ... の順につなぐ
+    start = hole.index(h)
+    hole_loop = hole[start:] + hole[:start] + [h]
+    return outer[:best + 1] + hole_loop + outer[best:]
+
+
+def _locally_inside(points, ring, k, p):
+    """点 p がリングの k 番目の頂点の内側の角の範囲にあるかどうか"""
+    a = points[ring[k]]
+    prev, nxt = points[ring[k - 1]], points[ring[(k + 1) % len(ring)]]
+    if _cross(prev, a, nxt) > 0:
+        return _cross(a, p, nxt) <= 0 and _cross(a, prev, p) <= 0
+    return _cross(a, p, prev) > 0 or _cross(a, nxt, p) > 0
+
+
+def _inside_triangle(triangle, p):
+    a, b, c = triangle
+    d1, d2, d3 = _cross(a, b, p), _cross(b, c, p), _cross(c, a, p)
+    return (d1 >= 0 and d2 >= 0 and d3 >= 0) or (d1 <= 0 and d2 <= 0 and d3 <= 0)
+
+
+def _cross(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def make_polygons(vertices, ring_offsets, polygon_offsets, polygon_index):
+    """polygon_index のポリゴンの shapely のポリゴンの配列を作ります。"""
+    if len(polygon_index) == 0:
+        return np.empty(0, dtype=object)
+    ring_starts = polygon_offsets[polygon_index]
+    ring_counts = polygon_offsets[polygon_index + 1] - ring_starts
+    rings = ragged_arange(ring_starts, ring_counts)
+    lengths = ring_offsets[rings + 1] - ring_offsets[rings]
+    points = ragged_arange(ring_offsets[rings], lengths)
+    linear_rings = shapely.linearrings(vertices[points], indices=np.repeat(np.arange(len(rings)), lengths))
+    polygons = np.empty(len(polygon_index), dtype=object)
+    polygons[:] = shapely.polygons(linear_rings, indices=np.repeat(np.arange(len(polygon_index)), ring_counts))
+    return polygons
+
+
+def _match_vertices(vertices, vertex_polygon, corners, triangle_polygon):
+    """
+    三角形の頂点座標 (T, 3, 2) を、同じポリゴン内で座標が一致する vertices の行番号に変換します。
+    一致する頂点がない場合は -1 にします。
+    """
+    def row_keys(polygon, points):
+        # (ポリゴン番号, x, y) の行を 1 つの値として比較・ソートできるようにする
+        rows = np.ascontiguousarray(np.column_stack([polygon, points]), dtype=np.float64)
+        return rows.view(f'V{rows.itemsize * 3}').ravel()
+
+    vertex_keys = row_keys(vertex_polygon, vertices)
+    corner_keys = row_keys(np.repeat(triangle_polygon, 3), corners.reshape(-1, 2))
+    order = np.argsort(vertex_keys, kind='stable')
+    sorted_keys = vertex_keys[order]
+    position = np.minimum(np.searchsorted(sorted_keys, corner_keys), len(order) - 1)
+    matched = np.where(sorted_keys[position] == corner_keys, order[position], -1)
+    return matched.reshape(-1, 3)
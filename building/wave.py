@@ -0,0 +1,88 @@
+import numpy as np
+
+# 名前 -> 波の関数
+WAVE_FUNCTIONS = {}
+
+
+def register_wave_function(name):
+    """
+    波の関数を登録するデコレータ。
+
+    波の関数は重心の x, y 座標の配列と波の中心を受け取り、
+    波が進む方向の距離の配列を返します（波長で割る前の値）。
+    """
+    def decorator(function):
+        WAVE_FUNCTIONS[name] = function
+        return function
+    return decorator
+
+
+@register_wave_function('radial')
+def radial_wave(x, y, center):
+    """中心から同心円状に広がる波"""
+    return np.hypot(x - center[0], y - center[1])
+
+
+@register_wave_function('diagonal')
+def diagonal_wave(x, y, center):
+    """斜め方向に進む波"""
+    return x + y
+
+
+@register_wave_function('linear')
+def linear_wave(x, y, center):
+    """x 方向に進む波"""
+    return x
+
+
+class WaveAnimator:
+    """
+    イコライザーの波によるビルの高さを、全ビル分まとめて計算します。
+
+    重心は変わらないので、波の位相の基準値（距離 / 波長）は最初に一度だけ計算し、
+    毎回の更新は全ビルに対する 1 つの NumPy の式で行います。
+    """
+
+    def __init__(self, centroids, wave='radial', center=(2048, 2048), wave_length=500, wave_speed=2,
+                 wave_height_scale=500, base_height=100, min_height=1):
+        if wave not in WAVE_FUNCTIONS:
+            raise ValueError(f"Unknown wave function: {wave} (available: {', '.join(WAVE_FUNCTIONS)})")
+        self.wave = wave
+        self.center = center
+        self.wave_length = wave_length  # 波の長さ（空間的な波長）
+        self.wave_speed = wave_speed  # 波の速度
+        self.wave_height_scale = wave_height_scale  # 波の高さを調整するスケール
+        self.base_height = base_height  # 振幅が 0 のときの高さ
+        self.min_height = min_height  # 最低の高さ
+
+        x, y = np.asarray(centroids, dtype=np.float32).T
+        self.phase_bases = (WAVE_FUNCTIONS[wave](x, y, center) / wave_length).astype(np.float32)
+        # 毎回の計算で使い回す出力用の配列
+        self._heights = np.empty_like(self.phase_bases)
+
+    def __len__(self):
+        return len(self.phase_bases)
+
+    @property
+    def max_height(self):
+        """振幅が最大 (1) のときの波の高さ"""
+        return max(self.wave_height_scale + self.base_height, self.min_height)
+
+    def heights(self, amplitude, current_time, buildings=None):
+        """
+        振幅 (0〜1) と現在の時間から全ビルの高さを計算します。
+        buildings（ビルの番号の配列）を指定した場合は、そのビルの高さだけを計算します。
+        返す配列は次の呼び出しで上書きされます。
+        """
+        if buildings is None:
+            phase_bases = self.phase_bases
+            heights = self._heights
+        else:
+            phase_bases = self.phase_bases[buildings]
+            heights = self._heights[:len(phase_bases)]
+        np.subtract(phase_bases, self.wave_speed * current_time, out=heights)
+        np.sin(heights, out=heights)
+        heights *= amplitude * self.wave_height_scale
+        heights += self.base_height
+        np.maximum(heights, self.min_height, out=heights)
+        return heights
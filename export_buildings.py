@@ -0,0 +1,44 @@
+import os
+import time
+import argparse
+from building.exporter import COORDINATE_SYSTEMS, EXPORT_FORMATS, BATCH_ROWS, MAX_ROWS_PER_FILE, \
+    export_buildings, find_export_tiles
+from building.multi_tile_loader import MultiTileLoader
+from building.tile_archive import TileArchive
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ズームレベル（または経度・緯度の範囲）の全タイルのビルを '
+                                                 'GeoParquet / Arrow / NDJSON に書き出します。')
+    parser.add_argument('zoom', type=int, help='ズームレベル')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+                        help='経度・緯度の範囲（省略時はズームレベルの全タイル）')
+    parser.add_argument('--output', default='export', help='出力先のディレクトリ')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson',
+                        help='出力の形式（parquet と arrow は pyarrow が必要）')
+    parser.add_argument('--crs', choices=COORDINATE_SYSTEMS, default='lonlat', help='ジオメトリの座標系')
+    parser.add_argument('--clip', action='store_true', help='タイルの範囲で切り取る（バッファによる重複を除く）')
+    parser.add_argument('--partition-zoom', type=int, default=None,
+                        help='このズームレベルの祖先のタイルごとにディレクトリを分ける')
+    parser.add_argument('--archive', default=None, help='pbf を読むアーカイブ（pack_tiles.py で作ったファイル）')
+    parser.add_argument('--workers', type=int, default=None, help='ワーカープロセスの数（1 なら同じプロセスで処理）')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help='まとめて書き込む行数')
+    parser.add_argument('--max-rows-per-file', type=int, default=MAX_ROWS_PER_FILE, help='1 ファイルの行数の上限')
+    args = parser.parse_args()
+
+    archive = TileArchive(args.archive) if args.archive else None
+    if args.bbox:
+        tiles = MultiTileLoader.tiles_from_bbox(args.bbox, args.zoom, archive=archive)
+    else:
+        tiles = find_export_tiles(args.zoom, archive)
+    if not tiles:
+        raise SystemExit(f"No tiles found at zoom {args.zoom}")
+
+    start = time.perf_counter()
+    files = export_buildings(tiles, args.output, args.format, args.crs, clip=args.clip,
+                             partition_zoom=args.partition_zoom, archive=archive, max_workers=args.workers,
+                             batch_rows=args.batch_rows, max_rows_per_file=args.max_rows_per_file)
+    rows = sum(count for _, count in files)
+    size = sum(os.path.getsize(path) for path, _ in files)
+    print(f"Exported {rows} buildings from {len(tiles)} tiles into {len(files)} files in {args.output}: "
+          f"{size / 1e6:.1f} MB in {time.perf_counter() - start:.1f} s")
@@ -1,19 +1,41 @@
 from direct.showbase.ShowBase import ShowBase
 from panda3d.core import *
-from building.data_loader import DataLoader
+from building.data_loader import DataLoader, TILE_EXTENT
+from building.tile_cache import TileCache
+from building.tile_archive import TileArchive
+from building.tile_streamer import TileStreamer
+from building.multi_tile_loader import MultiTileLoader
 from building.camera import CameraController
+from building.geo_transform import tile_scale_factor
+import glob
+import os
 import threading
-import math
-from building.sound import Sound
+import time
+import numpy as np
+from building.null_sound import NullSound
+from building.frame_profiler import FrameProfiler, peak_memory_mb
 from building.geometry_generator import GeometryGenerator
+from building.equalizer_shader import EqualizerShader, SpectrumShader
+from building.wave import WaveAnimator
+from building.spectrum import SpectrumAnimator
+from building.culling import BuildingCuller
+from building.building_index import BuildingIndex
+from building.ring_buffer import SkewMonitor
+from direct.gui.OnscreenText import OnscreenText
 from direct.task import Task
-from queue import Empty
 
 
 class MyApp(ShowBase):
     # ワイヤーフレームモードを切り替えるフラグ
     # DRAW_WIREFRAME = True  # Trueにするとワイヤーフレーム、Falseにすると面を描画
     DRAW_WIREFRAME = False  # Trueにするとワイヤーフレーム、Falseにすると面を描画
+    BATCHED_GEOMETRY = True  # Trueにすると全ビルをまとめた少数のGeomで描画
+    INSTANCED_RECT_BUILDINGS = True  # Trueにすると長方形のビルをインスタンス描画（BATCHED_GEOMETRY用）
+    SHADER_ANIMATION = True  # Trueにすると波のアニメーションを頂点シェーダーで計算（BATCHED_GEOMETRY用）
+    WAVE_FUNCTION = 'radial'  # 波の形（'radial', 'diagonal', 'linear' など building.wave に登録した名前）
+    EQUALIZER_MODE = 'wave'  # 'wave' は振幅で波を動かす、'spectrum' は周波数の帯域ごとに場所を分けて動かす
+    SPECTRUM_LAYOUT = 'radial'  # スペクトルモードの帯域の並べ方（'radial', 'angle', 'grid'）
+    SPECTRUM_BANDS = 16  # スペクトルモードの帯域の数
     min_height = 0  # 表示する建物の最低高さ
     IMAGE_PATH = 'images/techno_pop_music.png'
     SOUND_PATH = 'sound/Dive_To_Mod.mp3'
@@ -23,21 +45,50 @@ class MyApp(ShowBase):
     # SOUND_PATH = 'sound/star_spangled_banner.mp3'
     # IMAGE_PATH = 'images/rocky.png'
     # SOUND_PATH = 'sound/rocky_thema.mp3'
-
-    def __init__(self, z, x, y):
+    COLOR_SAMPLING = 'nearest'  # 画像から色を取り出す方法（'nearest', 'bilinear', 'area' はビルの範囲の平均）
+    CACHE_DIR = '.tile_cache'  # 処理済みタイルのキャッシュ（None でキャッシュしない）
+    TILE_ARCHIVE = None  # pack_tiles.py で作ったアーカイブから pbf を読む（例: 'tiles.plta'、None で {z}/{x}/{y}.pbf）
+    TILE_STREAMING = False  # Trueにするとカメラに合わせてズーム10〜16のタイルを読み込み・解放（BATCHED_GEOMETRY用）
+    STREAMING_MAX_MB = 512  # タイルストリーミングで使うメモリの上限
+    CULLING = True  # Trueにすると視錐台の外と遠くのビルを描画・アニメーションしない（1 タイルの表示用）
+    CULL_DISTANCE = 12000  # カメラからこの距離より遠いビルを隠す（None で距離のカリングをしない）
+    LOD = True  # Trueにするとビルごとに詳細度の異なるポリゴンを持ち、カメラからの距離で切り替える（BATCHED_GEOMETRY用）
+    VERTEX_BUDGET = 150000  # タイルごとに描画する頂点数の上限（超える場合は粗い詳細度にする、None で上限なし）
+    NEIGHBOR_TILES = 0  # 1 以上にするとその数だけ周りのタイルも読み込み、バッファに重複したビルを id ごとに 1 つにまとめる（LOD なし）
+
+    def __init__(self, z, x, y, headless=False):
+        """
+        headless: True にするとウインドウとサウンドデバイスを使わずに実行します（run_headless で描画）。
+        """
+        self.headless = headless
+        if headless:
+            # ウインドウの代わりにオフスクリーンのバッファに描画する
+            # （ディスプレイがない環境では EGL のヘッドレスの描画に切り替える）
+            loadPrcFileData('', 'window-type offscreen')
+            loadPrcFileData('', 'aux-display p3headlessgl')
+            loadPrcFileData('', 'win-size 1600 900')
+            loadPrcFileData('', 'audio-library-name null')
+            # GPU の描画が終わるまで待ち、フレームの描画の時間に含める
+            loadPrcFileData('', 'gl-finish true')
+        # 読み込み・作成の時間とメモリの記録
+        self.profiler = FrameProfiler()
         ShowBase.__init__(self)
 
         # ウインドウの設定
         self.props = WindowProperties()
         self.props.setTitle('Plateau Urban Equalizer')
         self.props.setSize(1600, 900)  # ウインドウサイズは環境に合わせて調整する。
-        self.win.requestProperties(self.props)
+        if not headless:
+            self.win.requestProperties(self.props)
         self.setBackgroundColor(0, 0, 0)  # ウインドウの背景色を黒 (0, 0, 0) に設定。
 
         # 全てを配置するノード
         self.world_node = self.render.attachNewNode('world_node')
-        self.world_node.setPos(-2048, -2048, 0)
-        self.world_node.setScale(0.8119, 0.9245, 1)
+        self.world_node.setPos(-TILE_EXTENT / 2, -TILE_EXTENT / 2, 0)
+        # タイルのローカル座標を、タイルの緯度の Web メルカトルの縮尺で東西・南北とも同じ比率で縮める
+        # （1 単位は赤道のタイルの 1 単位の長さになり、どの緯度のタイルでも建物の形と大きさの比率が正しくなる）
+        scale = tile_scale_factor(z, y)
+        self.world_node.setScale(scale, scale, 1)
         # 透明度属性とブレンディングを有効にする
         self.world_node.setTransparency(TransparencyAttrib.MAlpha)
 
@@ -54,7 +105,14 @@ class MyApp(ShowBase):
         self.ground.setColor(0, 0.5, 0, 0.3)  # 緑色
 
         # カメラコントローラーを初期化
-        self.camera_controller = CameraController(self)
+        if headless:
+            # マウスとキーで操作しないので、外部カメラの初期位置に固定する
+            self.camera_controller = None
+            self.disableMouse()
+            self.camera.setPos(2048, -5000, 2048)
+            self.camera.lookAt(0, 0, 0)
+        else:
+            self.camera_controller = CameraController(self)
 
         # ライトの追加
         ambient_light = AmbientLight('ambient_light')
@@ -64,13 +122,307 @@ class MyApp(ShowBase):
         # 全てのビルを配置するノード
         self.buildings_node = self.world_node.attachNewNode('buildings_node')
 
+        cache = TileCache(self.CACHE_DIR) if self.CACHE_DIR else None
+        self.archive = TileArchive(self.TILE_ARCHIVE) if self.TILE_ARCHIVE else None
+        self.tile = (z, x, y)
+        self.building_culler = None
+        # 読み込んだビルの空間インデックス（ピッキングなどの検索用）
+        self.building_index = BuildingIndex()
+        if self.TILE_STREAMING and self.BATCHED_GEOMETRY:
+            # カメラの位置に合わせてタイルを読み込む（(z, x, y) のタイルがワールド座標の原点）
+            self.building_table = None
+            self.building_list = []
+            self.batched_buildings = None
+            self.instanced_boxes = None
+            self.wave_animator = None
+            self.equalizer_shader = None
+            self.tile_streamer = TileStreamer(
+                self, self.world_node, self.buildings_node, (z, x, y),
+                max_bytes=self.STREAMING_MAX_MB << 20,
+                image_path=self.IMAGE_PATH,
+                color_sampling=self.COLOR_SAMPLING,
+                cache=cache,
+                min_height=self.min_height,
+                wireframe=self.DRAW_WIREFRAME,
+                instanced_rect_buildings=self.INSTANCED_RECT_BUILDINGS,
+                on_tile_loaded=self.setup_streamed_tile,
+                on_tile_unloaded=self.remove_streamed_tile,
+                archive=self.archive,
+                vertex_budget=self.VERTEX_BUDGET
+            )
+            # 't'キーでタイルの読み込み状況を表示
+            self.accept('t', lambda: print(self.tile_streamer.status()))
+        else:
+            self.tile_streamer = None
+            self.load_buildings(z, x, y, cache)
+            self.building_index.add_tile((z, x, y), self.building_table)
+
+        # 'i'キーで images/ の画像を順に切り替えてビルの色を塗り直す
+        self.accept('i', self.cycle_image)
+        # 'p'キーでマウスの位置（マウスがなければ画面の中央）の地面にあるビルを表示
+        self.accept('p', self.print_picked_building)
+
+        # 音と映像のずれの記録（'l'キーで表示）
+        self.skew_monitor = SkewMonitor()
+        self.accept('l', lambda: print(self.skew_monitor.status()))
+
+        with self.profiler.stage('sound'):
+            if headless:
+                # 音を出さずに、run_headless がフレームごとに再生位置を進める
+                self.sound = NullSound(self.SOUND_PATH, band_count=self.SPECTRUM_BANDS)
+            else:
+                # sounddevice はサウンドデバイスがある場合だけ必要なので、ここで読み込む
+                from building.sound import Sound
+                self.sound = Sound(self.SOUND_PATH, band_count=self.SPECTRUM_BANDS)
+        if not headless:
+            # サウンドの再生を別スレッドで開始
+            self.sound_thread = threading.Thread(target=self.sound.play)
+            self.sound_thread.start()
+            # ビルの高さを更新するタスクを追加
+            self.taskMgr.doMethodLater(0.1, self.update_buildings_task, 'UpdateBuildingsTask')
+
+        self.accept('escape', exit)
+
+    def load_buildings(self, z, x, y, cache):
+        """
+        1 タイル分（NEIGHBOR_TILES が 1 以上の場合は周りのタイルを含めた分）の建物データを読み込み、
+        3D モデルと波のアニメーションを作成します。
+        """
+        # 画像の色と波の帯域を割り当てる範囲と、まとめたビルの部分の行の範囲（まとめない場合は None）
+        self.color_bounds = (0, 0, TILE_EXTENT, TILE_EXTENT)
+        self.part_offsets = None
+        if self.NEIGHBOR_TILES > 0:
+            self.load_neighbor_buildings(z, x, y, cache)
+            return
+
         # 建物データをロード
-        self.building_list = DataLoader(z, x, y, self.IMAGE_PATH).load_building_list()
+        with self.profiler.stage('load'):
+            loader = DataLoader(z, x, y, self.IMAGE_PATH, cache=cache, color_sampling=self.COLOR_SAMPLING,
+                                archive=self.archive, lod=self.LOD and self.BATCHED_GEOMETRY,
+                                vertex_budget=self.VERTEX_BUDGET)
+            self.building_table = loader.load_building_table()
+            # ビルの詳細度ごとのポリゴン（LOD = False の場合は None）
+            self.building_lod = loader.lod if self.LOD else None
+            # Building と同じ属性で参照できる行ビューのリスト
+            self.building_list = list(self.building_table)
+        with self.profiler.stage('build'):
+            self.create_scene()
+
+    def load_neighbor_buildings(self, z, x, y, cache):
+        """
+        (z, x, y) と周り NEIGHBOR_TILES 個分のタイルを読み込み、隣のタイルのバッファに重複したビルを
+        id ごとに 1 つのビルにまとめて（building.stitching）、3D モデルと波のアニメーションを作成します。
+        座標は (z, x, y) のタイルのローカル座標に合わせます。
+        """
+        r = self.NEIGHBOR_TILES
+        tiles = [(z, x + dx, y + dy) for dy in range(-r, r + 1) for dx in range(-r, r + 1)]
+        tiles = [tile for tile in tiles if DataLoader(*tile, None, archive=self.archive).tile_exists()]
+        with self.profiler.stage('load'):
+            loader = MultiTileLoader(tiles, image_path=self.IMAGE_PATH, cache=cache,
+                                     color_sampling=self.COLOR_SAMPLING, stitch=True, archive=self.archive,
+                                     vertex_budget=self.VERTEX_BUDGET)
+            table = loader.load()
+            # ワールド座標の原点を (z, x, y) のタイルの左下に移す
+            offset = np.array(loader.tile_offset(x, y), dtype=np.float32)
+            table.vertices -= offset
+            table.centroids -= offset
+            x_min, y_min, x_max, y_max = loader.world_bounds()
+            self.color_bounds = (x_min - offset[0], y_min - offset[1], x_max - offset[0], y_max - offset[1])
+            self.part_offsets = loader.part_offsets
+            self.building_table = table
+            self.building_lod = None
+            self.building_list = list(self.building_table)
+        with self.profiler.stage('build'):
+            self.create_scene()
+
+    def create_scene(self):
+        """
+        読み込んだ建物データから 3D モデル、波のアニメーション、カリングを作成します。
+        """
 
         # 建物データから3Dモデルを作成
         building_count = 0
         rect_building_count = 0
         not_rect_building_count = 0
+        self.instanced_boxes = None
+        if self.BATCHED_GEOMETRY:
+            # 全ビルを少数の Geom にまとめて作成
+            self.batched_buildings = GeometryGenerator.create_batched_buildings(
+                self.buildings_node,
+                self.building_table,
+                min_height=self.min_height,
+                wireframe=self.DRAW_WIREFRAME,
+                include_rect=not self.INSTANCED_RECT_BUILDINGS,
+                lod=self.building_lod
+            )
+            if self.INSTANCED_RECT_BUILDINGS:
+                # 長方形のビルは単位立方体のインスタンスで描画
+                self.instanced_boxes = GeometryGenerator.create_instanced_rect_buildings(
+                    self.buildings_node,
+                    self.building_table,
+                    min_height=self.min_height,
+                    wireframe=self.DRAW_WIREFRAME
+                )
+            building_count = len(self.building_table)
+        else:
+            self.batched_buildings = None
+            building_count = self.create_building_nodes()
+
+        # 波の位相の基準値（スペクトルモードでは帯域の番号）を全ビル分まとめて計算
+        self.wave_animator = self.create_animator(self.building_table.centroids, self.color_bounds)
+
+        # 波のアニメーションをシェーダーで行う
+        self.equalizer_shader = None
+        if self.batched_buildings is not None and self.SHADER_ANIMATION:
+            self.equalizer_shader = self.create_shader(self.wave_animator, self.batched_buildings,
+                                                       self.instanced_boxes)
+
+        if self.CULLING:
+            # 重心のグリッドで視錐台と距離のカリングを毎フレーム行う
+            self.building_culler = BuildingCuller(self.building_table, max_distance=self.CULL_DISTANCE,
+                                                  max_height=self.wave_animator.max_height,
+                                                  lod=self.building_lod if self.BATCHED_GEOMETRY else None)
+            self.culling_text = OnscreenText(text='', pos=(-1.75, 0.92), scale=0.045, fg=(1, 1, 1, 1),
+                                             align=TextNode.ALeft, mayChange=True)
+            if not self.headless:
+                self.taskMgr.add(self.cull_buildings_task, 'CullBuildingsTask')
+
+        print(f"ビル数: {DataLoader.all_building_count}")
+        print(f"長方形のビル数: {DataLoader.rect_building_count}")
+        print('長方形ではないビル数:', DataLoader.not_rect_building_count)
+
+        print(f"building_list count: {len(self.building_list)}")
+        print(f"Total buildings: {building_count}")
+        print(f"Total rect buildings: {rect_building_count}")
+        print(f"Total not rect buildings: {not_rect_building_count}")
+
+        print(f'Polygon vertices: {DataLoader.vertex_count}')
+        print(f'Simplified polygon vertices: {DataLoader.simplified_vertex_count}')
+
+    def cull_buildings_task(self, task):
+        self.cull_buildings()
+        return task.cont
+
+    def cull_buildings(self):
+        """
+        視錐台の外と遠くのビルを隠します。表示するビルが変わったときだけ描画対象を更新します。
+        """
+        culler = self.building_culler
+        previous = culler.visible
+        if culler.update(self.camera, self.cam, self.buildings_node):
+            visible = culler.visible
+            if self.batched_buildings is not None:
+                self.batched_buildings.set_visible_buildings(visible, culler.levels)
+                if self.instanced_boxes is not None:
+                    self.instanced_boxes.set_visible_buildings(visible)
+            else:
+                for index in np.setdiff1d(previous, visible).tolist():
+                    self.building_list[index].node.stash()
+                for index in np.setdiff1d(visible, previous).tolist():
+                    self.building_list[index].node.unstash()
+        self.culling_text.setText(f"drawn: {culler.drawn_count}  culled: {culler.culled_count}")
+
+    def setup_streamed_tile(self, streamed_tile):
+        """
+        TileStreamer が読み込んだタイルに波のアニメーションを設定します。
+        """
+        table = streamed_tile.table
+        self.building_index.add_tile(streamed_tile.tile, table)
+        # スペクトルモードの帯域は全ルートタイルの範囲に割り当てる（タイルの境目で揃うように）
+        streamed_tile.wave_animator = self.create_animator(table.centroids, self.tile_streamer.color_bounds)
+        if self.SHADER_ANIMATION:
+            streamed_tile.equalizer_shader = self.create_shader(streamed_tile.wave_animator,
+                                                                streamed_tile.batched_buildings,
+                                                                streamed_tile.instanced_boxes)
+
+    def create_animator(self, centroids, bounds=None):
+        """
+        EQUALIZER_MODE に合わせて、ビルの高さを計算する WaveAnimator か SpectrumAnimator を作成します。
+        """
+        if self.EQUALIZER_MODE == 'spectrum':
+            return SpectrumAnimator(centroids, band_count=self.SPECTRUM_BANDS, layout=self.SPECTRUM_LAYOUT,
+                                    bounds=bounds)
+        return WaveAnimator(centroids, wave=self.WAVE_FUNCTION)
+
+    def create_shader(self, animator, batched_buildings, instanced_boxes):
+        """
+        EQUALIZER_MODE に合わせて、高さを頂点シェーダーで計算する EqualizerShader か SpectrumShader を作成します。
+        """
+        if self.EQUALIZER_MODE == 'spectrum':
+            return SpectrumShader(animator, batched_buildings, instanced_boxes)
+        return EqualizerShader(animator, batched_buildings, instanced_boxes)
+
+    def remove_streamed_tile(self, streamed_tile):
+        """
+        TileStreamer が解放するタイルのビルを空間インデックスから外します。
+        """
+        self.building_index.remove_tile(streamed_tile.tile)
+
+    def cycle_image(self):
+        """
+        images/ の画像を名前順に切り替えます。
+        """
+        images = sorted(glob.glob(os.path.join('images', '*')))
+        if not images:
+            return
+        current = os.path.normpath(self.IMAGE_PATH) if self.IMAGE_PATH else None
+        index = images.index(current) + 1 if current in images else 0
+        self.set_image(images[index % len(images)])
+
+    def set_image(self, image_path):
+        """
+        ビルの色を付ける画像を切り替え、ジオメトリを作り直さずに全ビルの色を塗り直します。
+        """
+        start = time.perf_counter()
+        self.IMAGE_PATH = image_path
+        if self.tile_streamer is not None:
+            self.tile_streamer.set_image(image_path)
+        else:
+            painter = DataLoader(*self.tile, image_path, color_bounds=self.color_bounds,
+                                 color_sampling=self.COLOR_SAMPLING)
+            table = self.building_table
+            table.colors[:] = painter.get_table_colors(table.arrays(), self.part_offsets)
+            if self.batched_buildings is not None:
+                self.batched_buildings.set_colors(table.colors)
+            if self.instanced_boxes is not None:
+                self.instanced_boxes.set_colors(table.colors)
+            if not self.BATCHED_GEOMETRY:
+                for building in self.building_list:
+                    if building.node is not None:
+                        building.node.setColor(*building.color)
+        print(f"画像: {image_path} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+    def print_picked_building(self):
+        """
+        マウスの位置（マウスがなければ画面の中央）から伸ばした視線と地面の交点にあるビルと、
+        その周辺のビルの数を表示します。
+        """
+        mouse = Point2(0, 0)
+        if self.mouseWatcherNode is not None and self.mouseWatcherNode.hasMouse():
+            mouse = self.mouseWatcherNode.getMouse()
+        near, far = Point3(), Point3()
+        if not self.camLens.extrude(mouse, near, far):
+            return
+        near = self.buildings_node.getRelativePoint(self.cam, near)
+        far = self.buildings_node.getRelativePoint(self.cam, far)
+        if near.z == far.z or (near.z > 0) == (far.z > 0):
+            print('地面と交わりません')
+            return
+        ground = near + (far - near) * (near.z / (near.z - far.z))
+
+        tile_ids, buildings = self.building_index.query_point(ground.x, ground.y)
+        queries, _, _ = self.building_index.query_radius(ground.x, ground.y, 500)
+        print(f"({ground.x:.0f}, {ground.y:.0f}) 半径 500 のビル数: {len(queries)}")
+        if tile_ids[0] >= 0:
+            print(self.building_index.building(tile_ids[0], buildings[0]))
+        else:
+            print('ビルはありません')
+
+    def create_building_nodes(self):
+        """
+        ビルごとに NodePath を作成します（BATCHED_GEOMETRY = False の場合）。
+        """
+        building_count = 0
         for building in self.building_list:
             building_count += 1
             # ビル用のノードを作成し、名前をIDに設定
@@ -102,68 +454,111 @@ class MyApp(ShowBase):
                 # 座標がない場合はスキップ
                 continue
 
-        print(f"ビル数: {DataLoader.all_building_count}")
-        print(f"長方形のビル数: {DataLoader.rect_building_count}")
-        print('長方形ではないビル数:', DataLoader.not_rect_building_count)
-
-        print(f"building_list count: {len(self.building_list)}")
-        print(f"Total buildings: {building_count}")
-        print(f"Total rect buildings: {rect_building_count}")
-        print(f"Total not rect buildings: {not_rect_building_count}")
-
-        print(f'Polygon vertices: {DataLoader.vertex_count}')
-        print(f'Simplified polygon vertices: {DataLoader.simplified_vertex_count}')
-
-        # Soundクラスを初期化
-        self.sound = Sound(self.SOUND_PATH)
-        # サウンドの再生を別スレッドで開始
-        self.sound_thread = threading.Thread(target=self.sound.play)
-        self.sound_thread.start()
-
-        # ビルの高さを更新するタスクを追加
-        self.taskMgr.doMethodLater(0.1, self.update_buildings_task, 'UpdateBuildingsTask')
-
-        self.accept('escape', exit)
+        return building_count
 
     def update_buildings_task(self, task):
-        if not self.sound.is_playing.is_set() and self.sound.amplitude_queue.empty():
+        if not self.update_buildings():
             return Task.done  # サウンドの再生が終了したらタスクを停止
+        return task.cont  # タスクを継続
 
-        try:
-            # 振幅データを取得
-            amplitude = self.sound.amplitude_queue.get_nowait()
-        except Empty:
-            # 振幅データがまだない場合は次のフレームへ
-            return task.cont
-
-        # 振幅を正規化（0〜1の範囲）
-        max_amplitude = 32768  # int16の最大値
-        normalized_amplitude = amplitude / max_amplitude
-
-        # 現在の時間を取得
-        current_time = globalClock.getFrameTime()
-
-        # 波のパラメータ
-        wave_length = 500  # 波の長さ（空間的な波長）
-        wave_speed = 2  # 波の速度（値を調整して波の進行速度を変える）
-        wave_height_scale = 500  # 波の高さを調整するスケール
+    def update_buildings(self):
+        """
+        再生位置に合わせてビルの高さを更新します。サウンドの再生が終了している場合は False を返します。
+        """
+        if self.sound.finished.is_set():
+            return False
+
+        # 今聞こえている再生位置と、このフレームが表示される頃（1 フレーム後）に聞こえている再生位置
+        # （同じ時刻から求めるので、ずれの記録に読み方の違いが入らない）
+        audible = self.sound.playback_time()
+        position = min(audible + globalClock.getDt(), self.sound.analysis.duration)
+        self.skew_monitor.record(globalClock.getFrameTime(), position, audible)
+        if self.EQUALIZER_MODE == 'spectrum':
+            # 再生位置の帯域ごとの強さ（0〜1の範囲、事前に解析したスペクトルから取得）
+            frame = (self.sound.analysis.bands_at(position),)
+        else:
+            # 再生位置の振幅（0〜1の範囲、事前に解析した RMS から取得）と現在の時間
+            frame = (self.sound.analysis.amplitude_at(position), globalClock.getFrameTime())
+
+        if self.tile_streamer is not None:
+            # 読み込み済みの全タイルを更新
+            for streamed_tile in self.tile_streamer.loaded.values():
+                if streamed_tile.equalizer_shader is not None:
+                    streamed_tile.equalizer_shader.update(*frame)
+                else:
+                    heights = streamed_tile.wave_animator.heights(*frame)
+                    streamed_tile.batched_buildings.set_heights(heights)
+                    if streamed_tile.instanced_boxes is not None:
+                        streamed_tile.instanced_boxes.set_heights(heights)
+            return True
+
+        if self.equalizer_shader is not None:
+            # 振幅と時間（または帯域ごとの高さ）をシェーダーに渡すだけ（高さは頂点シェーダーで計算）
+            self.equalizer_shader.update(*frame)
+            return True
+
+        # 全ビル（カリングしている場合は表示中のビルだけ）の高さを配列でまとめて計算
+        visible = self.building_culler.visible if self.building_culler is not None else None
+        heights = self.wave_animator.heights(*frame, visible)
+
+        if self.batched_buildings is not None:
+            # 頂点の高さをまとめて更新
+            self.batched_buildings.set_heights(heights, visible)
+            if self.instanced_boxes is not None:
+                self.instanced_boxes.set_heights(heights, visible)
+            return True
 
         # ビルの高さを更新
-        for building in self.building_list:
-            x, y = building.centroid
-            # 波の位相を計算
-            # phase = (x + y) / wave_length - wave_speed * current_time
-            phase = math.sqrt((x - 2048) ** 2 + (y - 2048) ** 2) / wave_length - wave_speed * current_time
-            # phase = x / wave_length - wave_speed * current_time
-            # 波の高さを計算
-            wave_height = normalized_amplitude * math.sin(phase) * wave_height_scale + 100
-
-            # ビルの高さを更新
+        buildings = self.building_list if visible is None else [self.building_list[i] for i in visible.tolist()]
+        for building, height in zip(buildings, heights.tolist()):
             if building.node:
-                building.node.setSz(max(wave_height, 1))  # 最小高さを1に設定
-
-        return task.cont  # タスクを継続
-
+                building.node.setSz(height)
+
+        return True
+
+
+    def run_headless(self, frame_count, fps=60, frame_dir=None):
+        """
+        frame_count フレームを 1 / fps 秒ずつ進めて描画し、FrameProfiler の summary を返します。
+        （headless=True で作成した場合に使用）
+
+        時計とサウンドの再生位置はフレームの番号だけで決まるので、同じ引数なら毎回同じ映像になります。
+        更新の時間はカリング・タイルの切り替え・ビルの高さの計算、描画の時間は renderFrame の時間です。
+        frame_dir を指定すると各フレームを frame_00000.png のような連番の画像で保存します。
+        """
+        profiler = self.profiler
+        if frame_dir is not None:
+            os.makedirs(frame_dir, exist_ok=True)
+        # フレームの時間を実際の時間ではなく 0 から 1 / fps 秒ずつ進める
+        globalClock.setMode(ClockObject.MNonRealTime)
+        globalClock.setFrameRate(fps)
+        globalClock.setFrameTime(0.0)
+        self.sound.play()
+        # 最初のフレームの前にシェーダーのコンパイルなどを済ませる
+        with profiler.stage('first_frame'):
+            self.graphicsEngine.renderFrame()
+
+        for frame in range(frame_count):
+            globalClock.tick()
+            self.sound.advance(1 / fps)
+
+            start = time.perf_counter()
+            if self.building_culler is not None:
+                self.cull_buildings()
+            if self.tile_streamer is not None:
+                self.tile_streamer.update(wait=True)
+            playing = self.update_buildings()
+            updated = time.perf_counter()
+            self.graphicsEngine.renderFrame()
+            profiler.record_frame(updated - start, time.perf_counter() - updated)
+
+            if frame_dir is not None:
+                self.win.saveScreenshot(Filename.fromOsSpecific(os.path.join(frame_dir, f'frame_{frame:05d}.png')))
+            if not playing:
+                break
+
+        profiler.memory['frames'] = peak_memory_mb()
+        return profiler.summary()
 
 if __name__ == '__main__':
     # 渋谷駅のタイル座標
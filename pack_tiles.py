@@ -0,0 +1,21 @@
+import os
+import time
+import argparse
+from building.tile_archive import COMPRESSIONS, pack_tiles
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='{z}/{x}/{y}.pbf のタイルを 1 つのアーカイブファイルにまとめます。')
+    parser.add_argument('output', nargs='?', default='tiles.plta', help='アーカイブのファイル')
+    parser.add_argument('--root', default='.', help='{z}/ のディレクトリがあるディレクトリ')
+    parser.add_argument('--min-zoom', type=int, default=10, help='最小ズームレベル')
+    parser.add_argument('--max-zoom', type=int, default=16, help='最大ズームレベル')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='none', help='タイルごとの圧縮')
+    parser.add_argument('--level', type=int, default=None, help='圧縮レベル')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = pack_tiles(args.output, args.root, range(args.min_zoom, args.max_zoom + 1),
+                       compression=args.compression, level=args.level)
+    print(f"Packed {count} tiles (z{args.min_zoom}-z{args.max_zoom}, {args.compression}) into {args.output}: "
+          f"{os.path.getsize(args.output) / 1e6:.1f} MB in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,51 @@
+import json
+import argparse
+from main import MyApp
+
+
+def render_headless(tile, frame_count, fps=60, frame_dir=None, **settings):
+    """
+    ウインドウとサウンドデバイスを使わずに tile を frame_count フレーム描画し、
+    読み込み・作成の時間、フレームごとの更新・描画の時間、メモリの結果の辞書を返します。
+    settings には MyApp のクラス属性（SOUND_PATH, EQUALIZER_MODE など）を指定します。
+    MyApp 自体は変えずに、settings を設定したサブクラスで描画します。
+    """
+    app_class = type('HeadlessApp', (MyApp,), dict(settings))
+    app = app_class(*tile, headless=True)
+    result = app.run_headless(frame_count, fps=fps, frame_dir=frame_dir)
+    result['tile'] = list(tile)
+    result['fps'] = fps
+    result['settings'] = settings
+    result['report'] = app.profiler.report()
+    app.destroy()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='イコライザーをヘッドレスで決まったフレーム数だけ描画し、時間とメモリを表示します。')
+    parser.add_argument('--tile', type=int, nargs=3, default=(16, 58199, 25811), metavar=('Z', 'X', 'Y'),
+                        help='タイル座標（省略時は渋谷駅のズームレベル 16 のタイル）')
+    parser.add_argument('--frames', type=int, default=600, help='描画するフレーム数')
+    parser.add_argument('--fps', type=int, default=60, help='1 秒あたりのフレーム数（再生位置の進み方）')
+    parser.add_argument('--sound', default='sound/kimigayo.mp3', help='音声ファイル')
+    parser.add_argument('--image', default=MyApp.IMAGE_PATH, help='ビルの色を付ける画像')
+    parser.add_argument('--mode', choices=('wave', 'spectrum'), default=MyApp.EQUALIZER_MODE,
+                        help='イコライザーのモード')
+    parser.add_argument('--cpu-animation', action='store_true', help='ビルの高さを頂点シェーダーではなく CPU で計算する')
+    parser.add_argument('--streaming', action='store_true', help='タイルストリーミングで描画する')
+    parser.add_argument('--neighbors', type=int, default=MyApp.NEIGHBOR_TILES,
+                        help='周りのタイルも読み込み、重複したビルをまとめて描画する（タイルの数）')
+    parser.add_argument('--frame-dir', default=None, help='各フレームを連番の画像で保存するディレクトリ')
+    parser.add_argument('--json', default=None, help='結果を書き出す JSON ファイル')
+    args = parser.parse_args()
+
+    result = render_headless(
+        args.tile, args.frames, fps=args.fps, frame_dir=args.frame_dir,
+        SOUND_PATH=args.sound, IMAGE_PATH=args.image, EQUALIZER_MODE=args.mode,
+        SHADER_ANIMATION=not args.cpu_animation, TILE_STREAMING=args.streaming,
+        NEIGHBOR_TILES=args.neighbors
+    )
+    print(result['report'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
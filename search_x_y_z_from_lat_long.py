@@ -1,10 +1,13 @@
-import mercantile
+import numpy as np
+from building.geo_transform import lonlat_to_tile, lonlat_to_extent
 
 # 渋谷駅の緯度・経度
 latitude = 35.6580
 longitude = 139.7016
 
-# 複数のズームレベルでタイル座標を取得
-for z in range(10, 17):
-    tile = mercantile.tile(longitude, latitude, z)
-    print(f"ズームレベル {z}: x={tile.x}, y={tile.y}")
+# 複数のズームレベルのタイル座標とタイルの中の位置をまとめて取得
+zooms = np.arange(10, 17)
+xs, ys = lonlat_to_tile(longitude, latitude, zooms)
+positions = lonlat_to_extent(longitude, latitude, zooms, xs, ys)
+for z, x, y, (local_x, local_y) in zip(zooms, xs, ys, positions):
+    print(f"ズームレベル {z}: x={x}, y={y}（タイルの中の位置: {local_x:.0f}, {local_y:.0f}）")
@@ -0,0 +1,54 @@
+import numpy as np
+from building.ring_buffer import PlaybackClock, SkewMonitor
+
+
+def simulate_skew(sample_rate=44100, block_size=1024, latency=0.05, fps=60, frames=600, jitter=0.0, seed=0):
+    """
+    偽のストリームの時計で、コールバック（ブロックごと）と描画（フレームごと）を交互に進め、
+    main.py の update_buildings と同じ方法で記録したずれの (平均, 95 パーセンタイル, 最大) を返します。
+    """
+    rng = np.random.default_rng(seed)
+    clock = PlaybackClock(sample_rate)
+    monitor = SkewMonitor()
+    block_duration = block_size / sample_rate
+    block = 0
+    now = 0.0
+    for _ in range(frames):
+        # jitter を指定するとフレームの間隔をその割合だけ揺らす
+        dt = (1 + rng.uniform(-jitter, jitter)) / fps
+        now += dt
+        # now までに呼ばれたコールバック（出力は latency 秒後に始まる）
+        while block * block_duration <= now:
+            clock.push(block * block_duration + latency, block * block_size)
+            block += 1
+        audible = clock.position(now)
+        if audible is None:
+            continue
+        # 聞こえている位置は now - latency のはず
+        assert abs(audible - (now - latency)) < 1e-9
+        monitor.record(now, audible + dt, audible)
+    return monitor.summary()
+
+
+def test_skew_is_near_zero():
+    mean, p95, worst = simulate_skew()
+    assert abs(mean) < 1e-6
+    assert worst < 1e-6
+    # フレームの間隔が揺れると、前のフレームの間隔で先の位置を求める分（最大で揺れの幅）だけずれる
+    mean, p95, worst = simulate_skew(jitter=0.2)
+    assert abs(mean) < 0.001
+    assert worst < 2 * 0.2 / 60
+
+
+def test_position_uses_records_before_now_only():
+    clock = PlaybackClock(1000)
+    clock.push(1.0, 0)
+    clock.push(2.0, 1000)
+    # 先の時刻の位置を求めても、今の位置を求めるための記録は残る
+    assert clock.position(1.5, ahead=1.0) == 1.5
+    assert clock.position(1.5) == 0.5
+    assert clock.position(0.5) is None
+
+
+if __name__ == '__main__':
+    print('skew (mean, p95, max) [s]:', simulate_skew())
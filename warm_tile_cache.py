@@ -0,0 +1,61 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from building.data_loader import DataLoader
+from building.tile_cache import TileCache
+
+
+def find_tiles(z):
+    """ズームレベル z の pbf ファイルのタイル座標を列挙します。"""
+    tiles = []
+    if not os.path.isdir(str(z)):
+        return tiles
+    for x_entry in os.scandir(str(z)):
+        if not x_entry.is_dir():
+            continue
+        for y_entry in os.scandir(x_entry.path):
+            if y_entry.name.endswith('.pbf'):
+                tiles.append((z, int(x_entry.name), int(y_entry.name[:-4])))
+    return sorted(tiles)
+
+
+def warm_tile(tile, cache):
+    z, x, y = tile
+    table = DataLoader(z, x, y, None, cache=cache).load_building_table()
+    return len(table)
+
+
+def warm_cache(min_zoom, max_zoom, cache, max_workers=None):
+    tiles = [tile for z in range(min_zoom, max_zoom + 1) for tile in find_tiles(z)]
+    print(f"Warming {len(tiles)} tiles (z{min_zoom}-z{max_zoom}) into {cache.cache_dir}")
+
+    start = time.perf_counter()
+    building_count = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(warm_tile, tile, cache) for tile in tiles]
+        for i, future in enumerate(futures, 1):
+            building_count += future.result()
+            if i % 500 == 0:
+                print(f"  {i}/{len(tiles)} tiles")
+
+    # ワーカーが個別に書き込んだ後、全体のサイズ上限を適用
+    cache = TileCache(cache.cache_dir, cache.max_bytes, cache.content_hash)
+    cache.evict()
+    print(f"Done: {building_count} buildings in {time.perf_counter() - start:.1f} s, "
+          f"cache size {cache.total_bytes() / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='処理済みタイルのキャッシュを事前に作成します。')
+    parser.add_argument('min_zoom', type=int, help='最小ズームレベル')
+    parser.add_argument('max_zoom', type=int, nargs='?', help='最大ズームレベル（省略時は min_zoom）')
+    parser.add_argument('--cache-dir', default='.tile_cache', help='キャッシュのディレクトリ')
+    parser.add_argument('--max-mb', type=float, default=1024, help='キャッシュの最大サイズ (MB)')
+    parser.add_argument('--content-hash', action='store_true', help='更新時刻ではなく内容のハッシュをキーに使う')
+    parser.add_argument('--workers', type=int, default=None, help='ワーカープロセス数')
+    args = parser.parse_args()
+
+    tile_cache = TileCache(args.cache_dir, int(args.max_mb * 1e6), args.content_hash)
+    warm_cache(args.min_zoom, args.max_zoom if args.max_zoom is not None else args.min_zoom,
+               tile_cache, args.workers)